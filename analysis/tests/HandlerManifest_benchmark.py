@@ -0,0 +1,76 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Startup benchmark for handler registration. Times, in fresh interpreters, importing every module in module_dirs (the
+webapp without a manifest) against registering the same handlers from a handler manifest.
+
+Usage: python tests/HandlerManifest_benchmark.py [runs]
+"""
+
+import ConfigParser
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pkg_resources
+
+EAGER = """
+import importlib
+for module_dir in %r:
+    importlib.import_module(module_dir)
+"""
+
+LAZY = """
+from webservice import HandlerManifest
+HandlerManifest.load_manifest(HandlerManifest.read_manifest(%r))
+"""
+
+
+def timed(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    webconfig = ConfigParser.RawConfigParser()
+    webconfig.readfp(pkg_resources.resource_stream('webservice', "config/web.ini"), filename='web.ini')
+    module_dirs = webconfig.get("modules", "module_dirs").split(",")
+
+    fd, manifest_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        subprocess.check_call([sys.executable, '-m', 'webservice.HandlerManifest', manifest_path])
+
+        eager = timed(EAGER % module_dirs, runs)
+        lazy = timed(LAZY % manifest_path, runs)
+    finally:
+        os.remove(manifest_path)
+
+    print "Best of %d interpreter starts" % runs
+    print "%-20s %10.1f ms" % ("import module_dirs", eager * 1000)
+    print "%-20s %10.1f ms" % ("handler manifest", lazy * 1000)
+
+
+if __name__ == '__main__':
+    main()
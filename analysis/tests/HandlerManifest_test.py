@@ -0,0 +1,100 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from webservice import HandlerManifest, NexusHandler
+
+HANDLER_MODULE = '''
+from webservice.NexusHandler import CalcHandler, nexus_handler
+
+
+@nexus_handler
+class LazyTestHandler(CalcHandler):
+    name = "Lazy Test"
+    path = "/lazyTest"
+    description = "Handler loaded on first use"
+    params = {}
+    singleton = True
+
+    def calc(self, computeOptions, **args):
+        return "calculated"
+'''
+
+
+class TestHandlerManifest(unittest.TestCase):
+    def setUp(self):
+        self.handlers = list(NexusHandler.AVAILABLE_HANDLERS)
+
+        self.root = tempfile.mkdtemp()
+        package = os.path.join(self.root, 'lazypackage')
+        os.mkdir(package)
+        with open(os.path.join(package, '__init__.py'), 'w') as init:
+            init.write("raise ImportError('package __init__ must not run')\n")
+        with open(os.path.join(package, 'LazyTest.py'), 'w') as module:
+            module.write(HANDLER_MODULE)
+        sys.path.insert(0, self.root)
+
+        self.manifest = {
+            'version': HandlerManifest.MANIFEST_VERSION,
+            'handlers': [{
+                'path': '/lazyTest',
+                'name': 'Lazy Test',
+                'description': 'Handler loaded on first use',
+                'params': {},
+                'module': 'lazypackage.LazyTest',
+                'class': 'LazyTestHandler',
+                'spark': False
+            }],
+            'initializers': []
+        }
+
+    def tearDown(self):
+        NexusHandler.AVAILABLE_HANDLERS[:] = self.handlers
+        sys.path.remove(self.root)
+        for name in ['lazypackage', 'lazypackage.LazyTest']:
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.root)
+
+    def test_handlers_are_registered_without_importing(self):
+        HandlerManifest.load_manifest(self.manifest)
+
+        wrapper = NexusHandler.AVAILABLE_HANDLERS[-1]
+        self.assertEqual('/lazyTest', wrapper.path())
+        self.assertEqual('Lazy Test', wrapper.name())
+        self.assertFalse(wrapper.is_spark())
+        self.assertNotIn('lazypackage.LazyTest', sys.modules)
+
+    def test_module_is_imported_on_first_instance(self):
+        HandlerManifest.load_manifest(self.manifest)
+        wrapper = NexusHandler.AVAILABLE_HANDLERS[-1]
+
+        instance = wrapper.instance()
+
+        self.assertEqual("calculated", instance.calc(None))
+        self.assertIs(instance, wrapper.instance())
+        self.assertEqual('LazyTestHandler', wrapper.clazz().__name__)
+        # The handler's own registration is skipped in favour of the manifest entry
+        self.assertEqual(1, len([handler for handler in NexusHandler.AVAILABLE_HANDLERS
+                                 if handler.path() == '/lazyTest']))
+
+    def test_unsupported_version(self):
+        self.manifest['version'] = HandlerManifest.MANIFEST_VERSION + 1
+
+        self.assertRaises(ValueError, HandlerManifest.load_manifest, self.manifest)
@@ -0,0 +1,123 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ConfigParser
+import threading
+import time
+import unittest
+
+from webservice.RequestScheduler import AdmissionQueue, DeadlineExceededException, QueueFullException, \
+    create_request_scheduler
+
+
+class TestAdmissionQueue(unittest.TestCase):
+    def test_clients_are_served_round_robin(self):
+        queue = AdmissionQueue('test', 1, 100)
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        blocker = queue.submit('a', block)
+        started.wait(5)
+        futures = [queue.submit('a', order.append, 'a%s' % i) for i in xrange(3)]
+        futures += [queue.submit('b', order.append, 'b%s' % i) for i in xrange(2)]
+        release.set()
+
+        blocker.result(5)
+        for future in futures:
+            future.result(5)
+        self.assertEqual(['a0', 'b0', 'a1', 'b1', 'a2'], order)
+
+    def test_full_queue_rejects(self):
+        queue = AdmissionQueue('test', 1, 1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        running = queue.submit('a', block)
+        started.wait(5)
+        queued = queue.submit('a', lambda: 'done')
+        rejected = queue.submit('b', lambda: 'done')
+        release.set()
+
+        self.assertIsInstance(rejected.exception(5), QueueFullException)
+        self.assertEqual(503, rejected.exception().code)
+        running.result(5)
+        self.assertEqual('done', queued.result(5))
+        self.assertEqual(1, queue.stats()['rejected'])
+
+    def test_expired_requests_are_not_run(self):
+        queue = AdmissionQueue('test', 1, 10, deadline=0.1)
+        calls = []
+
+        blocker = queue.submit('a', time.sleep, 0.3)
+        expired = queue.submit('b', calls.append, 1)
+
+        blocker.result(5)
+        self.assertIsInstance(expired.exception(5), DeadlineExceededException)
+        self.assertEqual([], calls)
+        stats = queue.stats()
+        self.assertEqual(1, stats['expired'])
+        self.assertEqual(1, stats['started'])
+
+    def test_exceptions_are_returned(self):
+        queue = AdmissionQueue('test', 2, 10)
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            queue.executor('a').submit(fail).result(5)
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def test_classification(self):
+        config = ConfigParser.RawConfigParser()
+        config.add_section("scheduler")
+        for option, value in [("enabled", "true"), ("classes", "cheap,default,heavy"), ("default_class", "default"),
+                              ("spark_class", "heavy"), ("cheap.paths", "/list,/heartbeat"),
+                              ("heavy.paths", "/domsmatchup")]:
+            config.set("scheduler", option, value)
+        for name in ["cheap", "default", "heavy"]:
+            config.set("scheduler", "%s.workers" % name, "1")
+            config.set("scheduler", "%s.max_queued" % name, "10")
+
+        scheduler = create_request_scheduler(config)
+
+        self.assertEqual('cheap', scheduler.queue_for('/list').name)
+        self.assertEqual('cheap', scheduler.queue_for('/heartbeat', spark=True).name)
+        self.assertEqual('heavy', scheduler.queue_for('/domsmatchup').name)
+        self.assertEqual('heavy', scheduler.queue_for('/timeSeriesSpark', spark=True).name)
+        self.assertEqual('default', scheduler.queue_for('/stats').name)
+        self.assertIsNone(scheduler.queues['cheap'].deadline)
+        self.assertEqual(set(['cheap', 'default', 'heavy']), set(scheduler.stats()))
+
+    def test_disabled(self):
+        config = ConfigParser.RawConfigParser()
+        self.assertIsNone(create_request_scheduler(config))
+        config.add_section("scheduler")
+        config.set("scheduler", "enabled", "false")
+        self.assertIsNone(create_request_scheduler(config))
+
+
+if __name__ == '__main__':
+    unittest.main()
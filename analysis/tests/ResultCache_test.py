@@ -0,0 +1,114 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from webservice.ResultCache import DiskResultStore, MemoryResultStore, ResultCache, result_cache_key
+
+
+class TestResultCacheKey(unittest.TestCase):
+    def test_equivalent_requests_share_a_key(self):
+        first = result_cache_key('/timeSeriesSpark', {
+            'ds': ['MUR'], 'b': ['-10,0,10,20'], 'startTime': ['2016-01-01T00:00:00Z'], 'endTime': ['1454284800'],
+            'output': ['json']
+        })
+        second = result_cache_key('/timeSeriesSpark', {
+            'output': ['JSON'], 'endTime': ['2016-02-01T00:00:00Z'], 'startTime': ['1451606400'],
+            'b': ['-10.0, 0, 10.00, 20'], 'ds': [' MUR'], 'nocached': ['false']
+        })
+
+        self.assertEqual(first, second)
+
+    def test_different_requests_have_different_keys(self):
+        arguments = {'ds': ['MUR'], 'b': ['-10,0,10,20']}
+
+        self.assertNotEqual(result_cache_key('/timeSeriesSpark', arguments),
+                            result_cache_key('/timeAvgMapSpark', arguments))
+        self.assertNotEqual(result_cache_key('/timeSeriesSpark', arguments),
+                            result_cache_key('/timeSeriesSpark', {'ds': ['MUR'], 'b': ['-10,0,10,21']}))
+
+    def test_arguments_need_not_be_utf8(self):
+        key = result_cache_key('/timeSeriesSpark', {'ds': ['\xff\xfe'], 'startTime': ['\xff']})
+
+        self.assertEqual(key, result_cache_key('/timeSeriesSpark', {'ds': [' \xff\xfe'], 'startTime': ['\xff']}))
+        self.assertNotEqual(key, result_cache_key('/timeSeriesSpark', {'ds': ['\xfe\xff'], 'startTime': ['\xff']}))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def check_store(self, store):
+        cache = ResultCache(store, ttl=60)
+        headers = [('Content-Type', 'application/json')]
+
+        cache.put('a', 200, headers, '{"a": 1}')
+        cache.put('b', 200, headers, u'{"b": 2}')
+
+        entry = cache.get('b')
+        self.assertEqual(200, entry['status'])
+        self.assertEqual(headers, entry['headers'])
+        self.assertEqual('{"b": 2}', entry['body'])
+        self.assertIsNone(cache.get('c'))
+
+        # Entries expire after ttl seconds
+        with mock.patch('webservice.ResultCache.time.time', return_value=entry['time'] + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertIsNone(cache.get('a'))
+
+    def test_memory_store(self):
+        self.check_store(MemoryResultStore(1024))
+
+    def test_disk_store(self):
+        self.check_store(DiskResultStore(self.cache_dir, 1024 * 1024))
+
+    def test_memory_store_evicts_least_recently_used(self):
+        cache = ResultCache(MemoryResultStore(250), ttl=60)
+
+        cache.put('a', 200, [], 'a' * 100)
+        cache.put('b', 200, [], 'b' * 100)
+        cache.get('a')
+        cache.put('c', 200, [], 'c' * 100)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_disk_store_evicts_and_survives_restart(self):
+        store = DiskResultStore(self.cache_dir, 2500)
+        cache = ResultCache(store, ttl=60)
+
+        cache.put('a', 200, [], 'a' * 1000)
+        cache.put('b', 200, [], 'b' * 1000)
+        cache.put('c', 200, [], 'c' * 1000)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(2, len(store))
+
+        reopened = ResultCache(DiskResultStore(self.cache_dir, 2500), ttl=60)
+        self.assertEqual('c' * 1000, reopened.get('c')['body'])
+
+    def test_paths(self):
+        self.assertTrue(ResultCache(MemoryResultStore(1024), ttl=60).is_cacheable('/anything'))
+        cache = ResultCache(MemoryResultStore(1024), ttl=60, paths={'/timeSeriesSpark'})
+        self.assertTrue(cache.is_cacheable('/timeSeriesSpark'))
+        self.assertFalse(cache.is_cacheable('/stats'))
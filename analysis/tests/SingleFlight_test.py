@@ -0,0 +1,69 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from webservice.SingleFlight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_identical_calls_share_one_computation(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        pool = ThreadPool(5)
+        try:
+            leader = pool.apply_async(single_flight.do, ('key', compute))
+            started.wait(5)
+            followers = [pool.apply_async(single_flight.do, ('key', compute)) for _ in xrange(4)]
+            # Give the followers time to find the in-flight call before it completes
+            time.sleep(0.2)
+            release.set()
+
+            self.assertEqual(('result', False), leader.get(5))
+            self.assertEqual([('result', True)] * 4, [follower.get(5) for follower in followers])
+        finally:
+            pool.close()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(0, len(single_flight))
+
+    def test_exceptions_are_shared_and_key_is_released(self):
+        single_flight = SingleFlight()
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            single_flight.do('key', fail)
+
+        self.assertEqual(('ok', False), single_flight.do('key', lambda: 'ok'))
+
+    def test_different_keys_run_separately(self):
+        single_flight = SingleFlight()
+
+        self.assertEqual((1, False), single_flight.do('a', lambda: 1))
+        self.assertEqual((2, False), single_flight.do('b', lambda: 2))
@@ -0,0 +1,53 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from webservice.RequestScheduler import client_id
+from webservice.webapp import SparkProxyHandler
+
+
+class FakeSparkHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.application.forwarded_for.append(self.request.headers.get("X-Forwarded-For"))
+        self.application.client_ids.append(client_id(self.request))
+        self.write("ok")
+
+
+class TestSparkProxyHandler(AsyncHTTPTestCase):
+    def get_app(self):
+        self.app = tornado.web.Application([
+            (r'/spark/.*', FakeSparkHandler),
+            (r'/timeSeriesSpark', SparkProxyHandler, dict(spark_url='http://127.0.0.1:%d/spark' % self.get_http_port(),
+                                                          http_client=self.http_client, request_timeout=10))
+        ])
+        self.app.forwarded_for = []
+        self.app.client_ids = []
+        return self.app
+
+    def test_proxied_request_keeps_the_client_address(self):
+        response = self.fetch('/timeSeriesSpark')
+
+        self.assertEqual(200, response.code)
+        self.assertEqual(['127.0.0.1'], self.app.forwarded_for)
+        self.assertEqual(['127.0.0.1'], self.app.client_ids)
+
+    def test_proxied_request_keeps_its_client_id(self):
+        response = self.fetch('/timeSeriesSpark', headers={"X-Forwarded-For": "10.0.0.1, 10.0.0.2"})
+
+        self.assertEqual(200, response.code)
+        self.assertEqual(['10.0.0.1, 10.0.0.2, 127.0.0.1'], self.app.forwarded_for)
+        self.assertEqual(['10.0.0.1'], self.app.client_ids)
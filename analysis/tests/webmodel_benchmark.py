@@ -0,0 +1,62 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serialization benchmark for gridded results. Encodes an N x N time average map with the per-cell JSON output
+(json.dumps with CustomEncoder, one dict per grid cell) and with output=JSON_COLUMNAR.
+
+Usage: python tests/webmodel_benchmark.py [grid_size]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from webservice.webmodel import NexusGridResults
+
+
+def make_results(size):
+    lats = np.linspace(-89.5, 89.5, size)
+    lons = np.linspace(-179.5, 179.5, size)
+    mean = np.random.random((size, size))
+    cnt = np.random.randint(0, 100, (size, size)).astype(np.uint32)
+    mean[cnt == 0] = 0
+
+    return NexusGridResults(lats, lons, [('mean', mean), ('cnt', cnt)], meta={}, ds='benchmark', startTime=0,
+                            endTime=86400)
+
+
+def timed(serialize, size):
+    # Fresh results every time so the per-cell dicts are not reused between runs
+    results = make_results(size)
+    start = time.time()
+    body = serialize(results)
+    return time.time() - start, len(body)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    per_cell, per_cell_bytes = timed(lambda results: results.toJson(), size)
+    columnar, columnar_bytes = timed(lambda results: results.toJsonColumnar(), size)
+
+    print "%d x %d grid" % (size, size)
+    print "%-20s %10.1f ms %12d bytes" % ("JSON", per_cell * 1000, per_cell_bytes)
+    print "%-20s %10.1f ms %12d bytes" % ("JSON_COLUMNAR", columnar * 1000, columnar_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import StringIO
+import json
+import unittest
+
+import numpy as np
+
+from webservice.webmodel import CustomEncoder, NexusGridResults, NexusResults, join_chunks, json_chunks
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+
+class TestJoinChunks(unittest.TestCase):
+    def test_pieces_are_grouped_up_to_chunk_size(self):
+        chunks = list(join_chunks(['ab', 'cd', 'e', 'fgh', 'i'], chunk_size=4))
+
+        self.assertEqual(['abcd', 'efgh', 'i'], chunks)
+
+    def test_no_pieces(self):
+        self.assertEqual([], list(join_chunks([])))
+
+
+class TestJsonChunks(unittest.TestCase):
+    def test_chunks_match_json_dumps(self):
+        data = {
+            'meta': {'shortName': 'ds'},
+            'data': [{'time': i, 'mean': np.float32(i) / 3, 'values': np.arange(3)} for i in range(500)],
+            'stats': {}
+        }
+
+        chunks = list(json_chunks(data, chunk_size=1024))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.dumps(data, indent=4, cls=CustomEncoder), ''.join(chunks))
+
+
+class TestNexusGridResults(unittest.TestCase):
+    def setUp(self):
+        self.lats = np.array([-0.5, 0.5])
+        self.lons = np.array([10.5, 11.5, 12.5])
+        self.mean = np.array([[1.5, np.nan, 2.0], [0.1, 0.2, 0.3]])
+        self.cnt = np.array([[2, 0, 1], [5, 6, 7]], dtype=np.uint32)
+        self.results = NexusGridResults(self.lats, self.lons, [('mean', self.mean), ('cnt', self.cnt)], meta={},
+                                        ds='ds', startTime=0, endTime=86400)
+
+    def test_json_matches_per_cell_results(self):
+        cells = [[{'mean': self.mean[y, x], 'cnt': int(self.cnt[y, x]), 'lat': self.lats[y], 'lon': self.lons[x]}
+                  for x in range(3)] for y in range(2)]
+        expected = NexusResults(results=cells, meta={}, ds='ds', startTime=0, endTime=86400)
+
+        self.assertEqual(json.loads(expected.toJson()), json.loads(self.results.toJson()))
+
+    def test_json_columnar(self):
+        columnar = json.loads(self.results.toJsonColumnar())
+
+        self.assertEqual([2, 3], columnar['shape'])
+        self.assertEqual([-0.5, 0.5], columnar['lat'])
+        self.assertEqual([10.5, 11.5, 12.5], columnar['lon'])
+        self.assertEqual([1.5, None, 2.0, 0.1, 0.2, 0.3], columnar['data']['mean'])
+        self.assertEqual([2, 0, 1, 5, 6, 7], columnar['data']['cnt'])
+        self.assertEqual('ds', columnar['meta']['shortName'])
+
+    def test_json_columnar_masked_values(self):
+        masked = np.ma.array([[1, 2], [3, 4]], mask=[[False, True], [False, False]])
+        results = NexusGridResults([0, 1], [0, 1], [('value', masked)], meta={})
+
+        self.assertEqual([1, None, 3, 4], json.loads(results.toJsonColumnar())['data']['value'])
+
+    def test_npz(self):
+        masked = np.ma.array([[1.0, 2.0], [3.0, 4.0]], mask=[[False, True], [False, False]])
+        results = NexusGridResults([0, 1], [10, 11], [('value', masked), ('cnt', np.ones((2, 2)))], meta={})
+
+        arrays = np.load(StringIO.StringIO(results.toNpz()))
+
+        np.testing.assert_array_equal([0, 1], arrays['lat'])
+        np.testing.assert_array_equal([10, 11], arrays['lon'])
+        np.testing.assert_array_equal(masked.data, arrays['value'])
+        np.testing.assert_array_equal(masked.mask, arrays['value_mask'])
+        self.assertNotIn('cnt_mask', arrays.files)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow(self):
+        table = pyarrow.ipc.open_stream(self.results.toArrow()).read_all().to_pydict()
+
+        self.assertEqual([-0.5, -0.5, -0.5, 0.5, 0.5, 0.5], table['lat'])
+        self.assertEqual([10.5, 11.5, 12.5] * 2, table['lon'])
+        self.assertEqual([1.5, None, 2.0, 0.1, 0.2, 0.3], table['mean'])
+        self.assertEqual([2, 0, 1, 5, 6, 7], table['cnt'])
+
+    @unittest.skipIf(netCDF4 is None, "netCDF4 is not installed")
+    def test_netcdf(self):
+        dataset = netCDF4.Dataset('in-memory.nc', memory=self.results.toNetCDF())
+        try:
+            np.testing.assert_array_almost_equal(self.lats, dataset['lat'][:])
+            np.testing.assert_array_equal(self.cnt, dataset['cnt'][:])
+        finally:
+            dataset.close()
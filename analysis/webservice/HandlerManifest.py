@@ -0,0 +1,183 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Handler manifest for lazy algorithm loading. The manifest records the path, metadata and defining module of every
+algorithm handler, so the webapp can route and describe handlers at startup and only import a handler's module, with
+its heavy dependencies, on the handler's first request.
+
+Regenerate the manifest whenever handlers change:
+
+    python -m webservice.HandlerManifest [manifest.json]
+"""
+
+import ConfigParser
+import imp
+import importlib
+import json
+import logging
+import os
+import pkgutil
+import sys
+import threading
+
+import pkg_resources
+
+from webservice import NexusHandler
+
+MANIFEST_VERSION = 1
+
+
+class LazyAlgorithmModuleWrapper(object):
+    """
+    Stands in for an AlgorithmModuleWrapper using the metadata from the manifest. The handler module is imported the
+    first time the class or an instance is needed.
+    """
+
+    def __init__(self, entry):
+        self.__entry = entry
+        self.__wrapper = None
+        self.__lock = threading.Lock()
+
+    def __wrapped(self):
+        if self.__wrapper is None:
+            with self.__lock:
+                if self.__wrapper is None:
+                    logging.getLogger(__name__).info("Loading algorithm module '%s' from %s" % (
+                        self.__entry['name'], self.__entry['module']))
+                    module = import_handler_module(self.__entry['module'])
+                    self.__wrapper = NexusHandler.AlgorithmModuleWrapper(getattr(module, self.__entry['class']))
+        return self.__wrapper
+
+    def clazz(self):
+        return self.__wrapped().clazz()
+
+    def name(self):
+        return self.__entry['name']
+
+    def path(self):
+        return self.__entry['path']
+
+    def description(self):
+        return self.__entry['description']
+
+    def params(self):
+        return self.__entry['params']
+
+    def is_spark(self):
+        return self.__entry['spark']
+
+    def instance(self, algorithm_config=None, sc=None):
+        return self.__wrapped().instance(algorithm_config=algorithm_config, sc=sc)
+
+    def isValid(self):
+        return self.__wrapped().isValid()
+
+
+def import_handler_module(module_name):
+    """
+    Import module_name without running the __init__ of its algorithm packages, which import every module in the
+    package. Packages that are not loaded yet are registered as empty packages pointing at their directory.
+    """
+    parts = module_name.split('.')
+    for i in range(1, len(parts)):
+        package_name = '.'.join(parts[:i])
+        if package_name in sys.modules:
+            continue
+
+        parent = sys.modules['.'.join(parts[:i - 1])] if i > 1 else None
+        _, package_path, _ = imp.find_module(parts[i - 1], parent.__path__ if parent is not None else None)
+
+        package = imp.new_module(package_name)
+        package.__path__ = [package_path]
+        package.__file__ = os.path.join(package_path, '__init__.py')
+        sys.modules[package_name] = package
+        if parent is not None:
+            setattr(parent, parts[i - 1], package)
+
+    return importlib.import_module(module_name)
+
+
+def build_manifest(module_dirs):
+    """
+    Import module_dirs the way the webapp does without a manifest and describe every handler and initializer they
+    register.
+    """
+    for module_dir in module_dirs:
+        importlib.import_module(module_dir)
+
+    handlers = []
+    for wrapper in NexusHandler.AVAILABLE_HANDLERS:
+        clazz = wrapper.clazz()
+        handlers.append({
+            'path': wrapper.path(),
+            'name': wrapper.name(),
+            'description': wrapper.description(),
+            'params': wrapper.params(),
+            'module': clazz.__module__,
+            'class': clazz.__name__,
+            'spark': wrapper.is_spark()
+        })
+
+    initializers = sorted(set(wrapper.clazz().__module__ for wrapper in NexusHandler.AVAILABLE_INITIALIZERS))
+
+    return {
+        'version': MANIFEST_VERSION,
+        'handlers': handlers,
+        'initializers': initializers
+    }
+
+
+def load_manifest(manifest):
+    """
+    Register the handlers of manifest in NexusHandler.AVAILABLE_HANDLERS without importing them, and import the
+    modules that declare initializers so NexusHandler.executeInitializers can run them.
+    """
+    log = logging.getLogger(__name__)
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("Unsupported handler manifest version %s" % manifest.get('version'))
+
+    has_pyspark = pkgutil.find_loader('pyspark') is not None
+    for entry in manifest['handlers']:
+        if entry['spark'] and not has_pyspark:
+            log.warn("pyspark not found. Skipping algorithm module '%s'" % entry['name'])
+            continue
+
+        log.info("Adding algorithm module '%s' with path '%s' (not loaded)" % (entry['name'], entry['path']))
+        NexusHandler.AVAILABLE_HANDLERS.append(LazyAlgorithmModuleWrapper(entry))
+
+    for module_name in manifest['initializers']:
+        import_handler_module(module_name)
+
+
+def read_manifest(path):
+    with open(path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARN, stream=sys.stderr)
+
+    webconfig = ConfigParser.RawConfigParser()
+    webconfig.readfp(pkg_resources.resource_stream(__name__, "config/web.ini"), filename='web.ini')
+
+    manifest = build_manifest(webconfig.get("modules", "module_dirs").split(","))
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+    else:
+        json.dump(manifest, sys.stdout, indent=4, sort_keys=True)
@@ -20,7 +20,8 @@ import types
 
 import numpy as np
 from netCDF4 import Dataset
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
+from nexustiles.rollup import DAY
 
 from webservice.webmodel import NexusProcessingException
 
@@ -43,6 +44,10 @@ def nexus_handler(clazz):
     log = logging.getLogger(__name__)
     try:
         wrapper = AlgorithmModuleWrapper(clazz)
+        if any(handler.path() == wrapper.path() for handler in AVAILABLE_HANDLERS):
+            # Already registered, e.g. from the handler manifest before this module was imported on first use
+            log.debug("Algorithm module with path '%s' is already registered" % wrapper.path())
+            return clazz
         log.info("Adding algorithm module '%s' with path '%s' (%s)" % (wrapper.name(), wrapper.path(), wrapper.clazz()))
         AVAILABLE_HANDLERS.append(wrapper)
     except Exception as ex:
@@ -162,6 +167,9 @@ class AlgorithmModuleWrapper:
     def params(self):
         return self.__clazz.params
 
+    def is_spark(self):
+        return issubclass(self.__clazz, SparkHandler)
+
     def instance(self, algorithm_config=None, sc=None):
         if "singleton" in self.__clazz.__dict__ and self.__clazz.__dict__["singleton"] is True:
             if self.__instance is None:
@@ -210,7 +218,7 @@ class NexusHandler(CalcHandler):
         CalcHandler.__init__(self)
 
         self.algorithm_config = None
-        self._tile_service = NexusTileService(skipCassandra, skipSolr)
+        self._tile_service = get_tile_service(skipCassandra, skipSolr)
 
     def set_config(self, algorithm_config):
         self.algorithm_config = algorithm_config
@@ -256,6 +264,23 @@ class NexusHandler(CalcHandler):
         return resultsList
 
 
+class AsyncNexusHandler(NexusHandler):
+    """
+    Handler whose calc is a tornado coroutine. It runs on the IOLoop instead of the request thread pool, so
+    calc must only wait on the futures returned by self._tile_service and never block.
+    """
+    asynchronous = True
+
+    def __init__(self, skipCassandra=False, skipSolr=False):
+        CalcHandler.__init__(self)
+
+        # Imported here so that only asynchronous handlers pull in the coroutine tile service
+        from nexustiles.nexustiles_async import get_async_tile_service
+
+        self.algorithm_config = None
+        self._tile_service = get_async_tile_service(skipCassandra, skipSolr)
+
+
 class SparkHandler(NexusHandler):
     class SparkJobContext(object):
 
@@ -320,7 +345,7 @@ class SparkHandler(NexusHandler):
 
     def _setQueryParams(self, ds, bounds, start_time=None, end_time=None,
                         start_year=None, end_year=None, clim_month=None,
-                        fill=-9999.):
+                        fill=-9999., level=0):
         self._ds = ds
         self._minLat, self._maxLat, self._minLon, self._maxLon = bounds
         self._startTime = start_time
@@ -329,6 +354,7 @@ class SparkHandler(NexusHandler):
         self._endYear = end_year
         self._climMonth = clim_month
         self._fill = fill
+        self._level = level
         
     def _set_info_from_tile_set(self, nexus_tiles):
         ntiles = len(nexus_tiles)
@@ -391,7 +417,7 @@ class SparkHandler(NexusHandler):
         # Check one time stamp at a time and attempt to extract the global
         # tile set.
         for t in t_in_range:
-            nexus_tiles = self._tile_service.get_tiles_bounded_by_box(self._minLat, self._maxLat, self._minLon, self._maxLon, ds=ds, start_time=t, end_time=t)
+            nexus_tiles = self._tile_service.get_tiles_bounded_by_box(self._minLat, self._maxLat, self._minLon, self._maxLon, ds=ds, start_time=t, end_time=t, level=self._level)
             if self._set_info_from_tile_set(nexus_tiles):
                 # Successfully retrieved global tile set from nexus_tiles,
                 # so no need to check any other time stamps.
@@ -419,9 +445,33 @@ class SparkHandler(NexusHandler):
             bounds = None
         return bounds
 
+    def _time_parts(self, start_time, end_time, days=None, max_time_parts=1):
+        """
+        Split a time range into the parts mapped by Spark: one part per run of the temporal rollups (see
+        nexustiles.rollup) covering it, and the days in between. Rollups are only built at full resolution.
+        :param days: The time stamps of the range, as returned by find_days_in_range_asc. If given, each run of days is
+                     split into at most max_time_parts parts, otherwise it is a single part.
+        :return: list of (start time, end time, rollup), rollup DAY for parts read from the daily tiles
+        """
+        if self._level:
+            plan = [(DAY, start_time, end_time)]
+        else:
+            plan = self._tile_service.plan_rollups(self._ds, start_time, end_time)
+
+        time_parts = []
+        for rollup, part_start, part_end in plan:
+            if rollup != DAY or days is None:
+                time_parts.append((part_start, part_end, rollup))
+                continue
+            part_days = np.array([d for d in days if part_start <= d <= part_end])
+            if len(part_days) > 0:
+                time_parts.extend((a[0], a[-1], DAY)
+                                  for a in np.array_split(part_days, min(max_time_parts, len(part_days))))
+        return time_parts
+
     @staticmethod
     def query_by_parts(tile_service, min_lat, max_lat, min_lon, max_lon,
-                       dataset, start_time, end_time, part_dim=0):
+                       dataset, start_time, end_time, part_dim=0, level=0, rollup=DAY):
         nexus_max_tiles_per_query = 100
         # print 'trying query: ',min_lat, max_lat, min_lon, max_lon, \
         #    dataset, start_time, end_time
@@ -432,7 +482,9 @@ class SparkHandler(NexusHandler):
                                                dataset,
                                                start_time=start_time,
                                                end_time=end_time,
-                                               fetch_data=False)
+                                               fetch_data=False,
+                                               level=level,
+                                               rollup=rollup)
             assert (len(tiles) <= nexus_max_tiles_per_query)
         except:
             # print 'failed query: ',min_lat, max_lat, min_lon, max_lon, \
@@ -445,7 +497,7 @@ class SparkHandler(NexusHandler):
                                                           min_lon, max_lon,
                                                           dataset,
                                                           start_time, end_time,
-                                                          part_dim=part_dim)
+                                                          part_dim=part_dim, level=level, rollup=rollup)
                 nexus_tiles.extend(SparkHandler.query_by_parts(tile_service,
                                                                mid_lat,
                                                                max_lat,
@@ -454,7 +506,7 @@ class SparkHandler(NexusHandler):
                                                                dataset,
                                                                start_time,
                                                                end_time,
-                                                               part_dim=part_dim))
+                                                               part_dim=part_dim, level=level, rollup=rollup))
             elif part_dim == 1:
                 # Partition by longitude.
                 mid_lon = (min_lon + max_lon) / 2
@@ -463,7 +515,7 @@ class SparkHandler(NexusHandler):
                                                           min_lon, mid_lon,
                                                           dataset,
                                                           start_time, end_time,
-                                                          part_dim=part_dim)
+                                                          part_dim=part_dim, level=level, rollup=rollup)
                 nexus_tiles.extend(SparkHandler.query_by_parts(tile_service,
                                                                min_lat,
                                                                max_lat,
@@ -472,7 +524,7 @@ class SparkHandler(NexusHandler):
                                                                dataset,
                                                                start_time,
                                                                end_time,
-                                                               part_dim=part_dim))
+                                                               part_dim=part_dim, level=level, rollup=rollup))
             elif part_dim == 2:
                 # Partition by time.
                 mid_time = (start_time + end_time) / 2
@@ -481,7 +533,7 @@ class SparkHandler(NexusHandler):
                                                           min_lon, max_lon,
                                                           dataset,
                                                           start_time, mid_time,
-                                                          part_dim=part_dim)
+                                                          part_dim=part_dim, level=level, rollup=rollup)
                 nexus_tiles.extend(SparkHandler.query_by_parts(tile_service,
                                                                min_lat,
                                                                max_lat,
@@ -490,7 +542,7 @@ class SparkHandler(NexusHandler):
                                                                dataset,
                                                                mid_time,
                                                                end_time,
-                                                               part_dim=part_dim))
+                                                               part_dim=part_dim, level=level, rollup=rollup))
         else:
             # No exception, so query Cassandra for the tile data.
             # print 'Making NEXUS query to Cassandra for %d tiles...' % \
@@ -546,34 +598,6 @@ class SparkHandler(NexusHandler):
         times.units = 'seconds since 1970-01-01 00:00:00'
         rootgrp.close()
 
-    def _create_nc_file_latlon2d(self, a, fname, varname, varunits=None,
-                                 fill=None):
-        self.log.debug('a={0}'.format(a))
-        self.log.debug('shape a = {0}'.format(a.shape))
-        assert len(a.shape) == 2
-        lat_dim, lon_dim = a.shape
-        rootgrp = Dataset(fname, "w", format="NETCDF4")
-        rootgrp.createDimension("lat", lat_dim)
-        rootgrp.createDimension("lon", lon_dim)
-        vals = rootgrp.createVariable(varname, "f4",
-                                      dimensions=("lat", "lon",),
-                                      fill_value=fill)
-        lats = rootgrp.createVariable("lat", "f4", dimensions=("lat",))
-        lons = rootgrp.createVariable("lon", "f4", dimensions=("lon",))
-        vals[:, :] = a
-        lats[:] = np.linspace(self._minLatCent,
-                              self._maxLatCent, lat_dim)
-        lons[:] = np.linspace(self._minLonCent,
-                              self._maxLonCent, lon_dim)
-        if varunits is not None:
-            vals.units = varunits
-        lats.units = "degrees north"
-        lons.units = "degrees east"
-        rootgrp.close()
-
-    def _create_nc_file(self, a, fname, varname, **kwargs):
-        self._create_nc_file_latlon2d(a, fname, varname, **kwargs)
-
     def _spark_nparts(self, nparts_requested):
         max_parallelism = 128
         num_partitions = min(nparts_requested if nparts_requested > 0
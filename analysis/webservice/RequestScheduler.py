@@ -0,0 +1,261 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Admission control for analysis requests. Every handler path belongs to a cost class (for example cheap metadata calls,
+regular analyses and Spark jobs), and every cost class has its own worker threads and bounded queue, so a cheap request
+never waits behind a long Spark job. Within a class, queued requests are taken round robin per client so one client
+cannot starve the others, and a request that waited longer than its class deadline is rejected instead of run.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from concurrent.futures import Future
+
+from webservice.webmodel import NexusProcessingException
+
+# Number of recent queue times kept per class for the percentiles in the stats
+RECENT_WAITS = 1000
+
+
+class QueueFullException(NexusProcessingException):
+    def __init__(self, queue_name):
+        NexusProcessingException.__init__(self, code=503,
+                                          reason="Too many %s requests are queued. Please try again later." % queue_name)
+
+
+class DeadlineExceededException(NexusProcessingException):
+    def __init__(self, queue_name, waited):
+        NexusProcessingException.__init__(self, code=503,
+                                          reason="Request waited %.1f seconds in the %s queue and was dropped. "
+                                                 "Please try again later." % (waited, queue_name))
+
+
+class AdmissionQueue(object):
+    """
+    Bounded, client-fair work queue of one cost class, served by its own worker threads.
+    """
+
+    def __init__(self, name, workers, max_queued, deadline=None):
+        """
+        :param workers: number of requests of this class that run at the same time
+        :param max_queued: number of waiting requests above which new ones are rejected
+        :param deadline: seconds a request may wait before it is rejected, None to wait indefinitely
+        """
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.deadline = deadline
+        self.log = logging.getLogger(__name__)
+
+        self._condition = threading.Condition()
+        # client -> deque of (future, fn, args, kwargs, enqueue time), in round robin order
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = 0
+
+        self._stats_lock = threading.Lock()
+        self._completed = 0
+        self._rejected = 0
+        self._expired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits = deque(maxlen=RECENT_WAITS)
+
+        for i in xrange(workers):
+            worker = threading.Thread(target=self._work, name="%s-%s" % (name, i + 1))
+            worker.daemon = True
+            worker.start()
+
+    def executor(self, client):
+        """
+        :return: an executor whose submit() queues work in this class on behalf of client
+        """
+        return ClientExecutor(self, client)
+
+    def submit(self, client, fn, *args, **kwargs):
+        future = Future()
+        with self._condition:
+            if self._queued >= self.max_queued:
+                with self._stats_lock:
+                    self._rejected += 1
+                future.set_exception(QueueFullException(self.name))
+                return future
+
+            self._queues.setdefault(client, deque()).append((future, fn, args, kwargs, time.time()))
+            self._queued += 1
+            self._condition.notify()
+
+        return future
+
+    def _next_task(self):
+        client, tasks = next(self._queues.iteritems())
+        task = tasks.popleft()
+        # Move the client to the back so that the next task comes from another client
+        del self._queues[client]
+        if tasks:
+            self._queues[client] = tasks
+        self._queued -= 1
+        return task
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._queued == 0:
+                    self._condition.wait()
+                future, fn, args, kwargs, enqueued = self._next_task()
+                self._running += 1
+
+            try:
+                self._run(future, fn, args, kwargs, time.time() - enqueued)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def _run(self, future, fn, args, kwargs, waited):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        if self.deadline is not None and waited > self.deadline:
+            with self._stats_lock:
+                self._expired += 1
+            self.log.warn("Dropping request that waited %.1f seconds in the %s queue" % (waited, self.name))
+            future.set_exception(DeadlineExceededException(self.name, waited))
+            return
+
+        with self._stats_lock:
+            self._completed += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._recent_waits.append(waited)
+        self.log.debug("Request waited %.3f seconds in the %s queue" % (waited, self.name))
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def stats(self):
+        with self._condition:
+            queued, running, clients = self._queued, self._running, len(self._queues)
+
+        with self._stats_lock:
+            recent = sorted(self._recent_waits)
+            started = self._completed
+
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'deadline_seconds': self.deadline,
+                'queued': queued,
+                'queued_clients': clients,
+                'running': running,
+                'started': started,
+                'rejected': self._rejected,
+                'expired': self._expired,
+                'mean_wait_seconds': self._total_wait / started if started else 0.0,
+                'max_wait_seconds': self._max_wait,
+                'p50_wait_seconds': _percentile(recent, 0.5),
+                'p95_wait_seconds': _percentile(recent, 0.95)
+            }
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ClientExecutor(object):
+    """
+    Executor facade, usable with tornado.concurrent.run_on_executor, that queues work for one client.
+    """
+
+    def __init__(self, queue, client):
+        self.queue = queue
+        self.client = client
+
+    def submit(self, fn, *args, **kwargs):
+        return self.queue.submit(self.client, fn, *args, **kwargs)
+
+
+class RequestScheduler(object):
+    def __init__(self, queues, default_class, spark_class=None, path_classes=None):
+        """
+        :param queues: dict of cost class name to AdmissionQueue
+        :param default_class: class of handlers not otherwise classified
+        :param spark_class: class of Spark handlers without an explicit path class
+        :param path_classes: dict of handler path to class name
+        """
+        self.queues = queues
+        self.default_class = default_class
+        self.spark_class = spark_class
+        self.path_classes = path_classes or {}
+
+    def queue_for(self, path, spark=False):
+        if path in self.path_classes:
+            return self.queues[self.path_classes[path]]
+        if spark and self.spark_class is not None:
+            return self.queues[self.spark_class]
+        return self.queues[self.default_class]
+
+    def stats(self):
+        return dict((name, queue.stats()) for name, queue in self.queues.iteritems())
+
+
+def client_id(request):
+    """
+    Identify the client of a tornado request for fair sharing: the first X-Forwarded-For address when behind a proxy,
+    the remote address otherwise.
+    """
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.remote_ip
+
+
+def create_request_scheduler(webconfig):
+    """
+    Build the RequestScheduler described by the [scheduler] section of web.ini, or None if it is disabled.
+    """
+    if not webconfig.has_section("scheduler") or not webconfig.getboolean("scheduler", "enabled"):
+        return None
+
+    queues = {}
+    path_classes = {}
+    for name in [name.strip() for name in webconfig.get("scheduler", "classes").split(',') if name.strip()]:
+        deadline = webconfig.getint("scheduler", "%s.deadline_seconds" % name) \
+            if webconfig.has_option("scheduler", "%s.deadline_seconds" % name) else 0
+        queues[name] = AdmissionQueue(name, webconfig.getint("scheduler", "%s.workers" % name),
+                                      webconfig.getint("scheduler", "%s.max_queued" % name),
+                                      deadline=deadline if deadline > 0 else None)
+
+        if webconfig.has_option("scheduler", "%s.paths" % name):
+            for path in webconfig.get("scheduler", "%s.paths" % name).split(','):
+                if path.strip():
+                    path_classes[path.strip()] = name
+
+    default_class = webconfig.get("scheduler", "default_class")
+    spark_class = webconfig.get("scheduler", "spark_class") if webconfig.has_option("scheduler", "spark_class") else None
+    for name in [default_class, spark_class] + path_classes.values():
+        if name is not None and name not in queues:
+            raise ValueError("Unknown request cost class %s" % name)
+
+    return RequestScheduler(queues, default_class, spark_class=spark_class, path_classes=path_classes)
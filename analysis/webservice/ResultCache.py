@@ -0,0 +1,287 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of serialized analysis results. Entries are keyed on the handler path and the normalized request arguments and
+hold the exact bytes and headers written to the client, so a hit skips both the computation and the serialization.
+"""
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pytz
+
+EPOCH = pytz.timezone('UTC').localize(datetime(1970, 1, 1))
+ISO_8601 = '%Y-%m-%dT%H:%M:%SZ'
+
+# Arguments that change how a request is answered but not what the answer is
+IGNORED_ARGUMENTS = {'nocached', '_'}
+TIME_ARGUMENTS = {'startTime', 'endTime'}
+BBOX_ARGUMENTS = {'b'}
+CASE_INSENSITIVE_ARGUMENTS = {'output'}
+
+
+def _normalize_time(value):
+    try:
+        return str(long(value))
+    except ValueError:
+        pass
+    try:
+        return str(long((pytz.UTC.localize(datetime.strptime(value, ISO_8601)) - EPOCH).total_seconds()))
+    except ValueError:
+        return value
+
+
+def _normalize_bbox(value):
+    try:
+        return ','.join(repr(float(coordinate)) for coordinate in value.split(','))
+    except ValueError:
+        return value
+
+
+def normalize_arguments(arguments):
+    """
+    Turn request arguments (name -> list of values, as in tornado's request.arguments) into a canonical, sorted list of
+    (name, values) so that equivalent requests (e.g. startTime given in seconds or ISO format, b=-10,0 or b=-10.0,0.0,
+    arguments in a different order) map to the same cache key.
+    """
+    normalized = []
+    for name in sorted(arguments.keys()):
+        if name in IGNORED_ARGUMENTS:
+            continue
+
+        values = [value.strip() for value in arguments[name]]
+        if name in TIME_ARGUMENTS:
+            values = [_normalize_time(value) for value in values]
+        elif name in BBOX_ARGUMENTS:
+            values = [_normalize_bbox(value) for value in values]
+        elif name in CASE_INSENSITIVE_ARGUMENTS:
+            values = [value.upper() for value in values]
+        else:
+            values = [','.join(item.strip() for item in value.split(',')) for value in values]
+
+        normalized.append((name, values))
+
+    return normalized
+
+
+def result_cache_key(path, arguments):
+    # Argument values are the raw request bytes and need not be valid UTF-8, so the key is hashed from their repr
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return hashlib.sha1(repr([path, normalize_arguments(arguments)])).hexdigest()
+
+
+def entry_nbytes(entry):
+    return len(entry['body']) + sum(len(name) + len(value) for name, value in entry['headers'])
+
+
+class MemoryResultStore(object):
+    """
+    In-process LRU store of cache entries bounded by the total size of the cached bodies.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def put(self, key, entry):
+        nbytes = entry_nbytes(entry)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._nbytes -= entry_nbytes(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskResultStore(object):
+    """
+    LRU store of cache entries in a local directory, one pickle per entry, bounded by the total size of the files.
+    Recency is tracked with the file modification times so the cache survives restarts.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._index = OrderedDict()
+        self._nbytes = 0
+        files = []
+        for name in os.listdir(path):
+            if name.endswith('.result'):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_mtime, name[:-len('.result')], stat.st_size))
+        for _, key, nbytes in sorted(files):
+            self._index[key] = nbytes
+            self._nbytes += nbytes
+
+    def _file(self, key):
+        return os.path.join(self.path, '%s.result' % key)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index[key] = self._index.pop(key)
+
+        try:
+            with open(self._file(key), 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(self._file(key), None)
+            return entry
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.remove(key)
+            return None
+
+    def put(self, key, entry):
+        fd, temp_path = tempfile.mkstemp(prefix='.', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            nbytes = os.path.getsize(temp_path)
+            if nbytes > self.max_bytes:
+                os.remove(temp_path)
+                return
+            os.rename(temp_path, self._file(key))
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with self._lock:
+            self._nbytes -= self._index.pop(key, 0)
+            self._index[key] = nbytes
+            self._nbytes += nbytes
+            evicted = []
+            while self._nbytes > self.max_bytes:
+                evicted_key, evicted_nbytes = self._index.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+                evicted.append(evicted_key)
+
+        for evicted_key in evicted:
+            try:
+                os.remove(self._file(evicted_key))
+            except OSError:
+                pass
+
+    def remove(self, key):
+        with self._lock:
+            self._nbytes -= self._index.pop(key, 0)
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self._index)
+
+
+class ResultCache(object):
+    """
+    Time-limited cache of serialized results on top of a MemoryResultStore or DiskResultStore. Entries are dicts with
+    'status', 'headers' (list of (name, value)) and 'body' (the bytes written to the client).
+    """
+
+    def __init__(self, store, ttl, paths=None):
+        self.store = store
+        self.ttl = ttl
+        self.paths = paths
+        self.logger = logging.getLogger(__name__)
+
+    def is_cacheable(self, path):
+        return self.paths is None or path in self.paths
+
+    def get(self, key):
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+
+        if time.time() - entry['time'] > self.ttl:
+            self.store.remove(key)
+            return None
+
+        return entry
+
+    def put(self, key, status, headers, body):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+
+        try:
+            self.store.put(key, {
+                'time': time.time(),
+                'status': status,
+                'headers': list(headers),
+                'body': body
+            })
+        except (IOError, OSError):
+            self.logger.warning("Unable to cache result %s" % key, exc_info=True)
+
+
+def create_result_cache(webconfig):
+    """
+    Build the ResultCache described by the [cache] section of web.ini, or None if result caching is disabled.
+    """
+    if not webconfig.has_section("cache") or not webconfig.getboolean("cache", "enabled"):
+        return None
+
+    max_bytes = webconfig.getint("cache", "max_mb") * 1024 * 1024
+    backend = webconfig.get("cache", "backend")
+    if backend == "memory":
+        store = MemoryResultStore(max_bytes)
+    elif backend == "disk":
+        store = DiskResultStore(webconfig.get("cache", "disk_path"), max_bytes)
+    else:
+        raise ValueError("Unknown result cache backend %s" % backend)
+
+    paths = webconfig.get("cache", "paths").strip() if webconfig.has_option("cache", "paths") else ''
+    paths = set(path.strip() for path in paths.split(',') if path.strip()) if paths else None
+
+    return ResultCache(store, webconfig.getint("cache", "ttl_seconds"), paths=paths)
@@ -21,7 +21,7 @@ from multiprocessing.dummy import Pool, Manager
 
 import numpy as np
 import pytz
-from nexustiles.nexustiles import NexusTileService, NexusTileServiceException
+from nexustiles.nexustiles import NexusTileServiceException, get_tile_service
 from shapely.geometry import box
 
 from webservice.NexusHandler import NexusHandler, nexus_handler
@@ -188,7 +188,7 @@ class DailyDifferenceAverageImpl(NexusHandler):
 
 class DailyDifferenceAverageCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
+        self.__tile_service = get_tile_service()
 
     def calc_average_diff_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, timeinseconds):
 
@@ -20,7 +20,7 @@ from datetime import datetime
 from pytz import timezone
 
 from webservice.NexusHandler import NexusHandler, nexus_handler
-from webservice.webmodel import NexusResults, NexusProcessingException
+from webservice.webmodel import NexusResults, NexusProcessingException, join_chunks, json_chunks
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
@@ -132,9 +132,9 @@ class DataInBoundsSearchHandlerImpl(NexusHandler):
             max_lon = bounding_polygon.bounds[2]
 
             tiles = self._tile_service.get_tiles_bounded_by_box(min_lat, max_lat, min_lon, max_lon, ds, start_time,
-                                                                end_time)
+                                                                end_time, sparse=True)
         else:
-            tiles = self._tile_service.get_tiles_by_metadata(metadata_filter, ds, start_time, end_time)
+            tiles = self._tile_service.get_tiles_by_metadata(metadata_filter, ds, start_time, end_time, sparse=True)
 
         data = []
         for tile in tiles:
@@ -189,9 +189,26 @@ class DataInBoundsSearchHandlerImpl(NexusHandler):
 
 
 class DataInBoundsResult(NexusResults):
+    def toJsonChunks(self):
+        return json_chunks({
+            'meta': self.meta(),
+            'data': self.results(),
+            'stats': self.stats()
+        })
+
     def toCSV(self):
-        rows = []
+        return "\r\n".join(self._csv_rows())
+
+    def toCSVChunks(self):
+        def pieces():
+            for i, row in enumerate(self._csv_rows()):
+                if i > 0:
+                    yield "\r\n"
+                yield row
 
+        return join_chunks(pieces())
+
+    def _csv_rows(self):
         headers = [
             "id",
             "lon",
@@ -226,7 +243,5 @@ class DataInBoundsResult(NexusResults):
                     headers.append("wind_speed")
 
             if i == 0:
-                rows.append(",".join(headers))
-            rows.append(",".join(cols))
-
-        return "\r\n".join(rows)
+                yield ",".join(headers)
+            yield ",".join(cols)
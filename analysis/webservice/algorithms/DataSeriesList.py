@@ -16,22 +16,25 @@
 
 import json
 
-from webservice.NexusHandler import NexusHandler
+from tornado import gen
+
+from webservice.NexusHandler import AsyncNexusHandler
 from webservice.NexusHandler import nexus_handler
 from webservice.webmodel import cached
 
 
 @nexus_handler
-class DataSeriesListHandlerImpl(NexusHandler):
+class DataSeriesListHandlerImpl(AsyncNexusHandler):
     name = "Dataset List"
     path = "/list"
     description = "Lists datasets currently available for analysis"
     params = {}
 
     def __init__(self):
-        NexusHandler.__init__(self, skipCassandra=True)
+        AsyncNexusHandler.__init__(self, skipCassandra=True)
 
     @cached(ttl=(60 * 60 * 1000))  # 1 hour cached
+    @gen.coroutine
     def calc(self, computeOptions, **args):
         class SimpleResult(object):
             def __init__(self, result):
@@ -40,4 +43,5 @@ class DataSeriesListHandlerImpl(NexusHandler):
             def toJson(self):
                 return json.dumps(self.result)
 
-        return SimpleResult(self._tile_service.get_dataseries_list())
+        dataseries = yield self._tile_service.get_dataseries_list()
+        raise gen.Return(SimpleResult(dataseries))
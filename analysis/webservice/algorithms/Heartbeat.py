@@ -16,11 +16,13 @@
 
 import json
 
-from webservice.NexusHandler import NexusHandler, nexus_handler
+from tornado import gen
+
+from webservice.NexusHandler import AsyncNexusHandler, nexus_handler
 
 
 @nexus_handler
-class HeartbeatHandlerImpl(NexusHandler):
+class HeartbeatHandlerImpl(AsyncNexusHandler):
     name = "Backend Services Status"
     path = "/heartbeat"
     description = "Returns health status of Nexus backend services"
@@ -28,10 +30,11 @@ class HeartbeatHandlerImpl(NexusHandler):
     singleton = True
 
     def __init__(self):
-        NexusHandler.__init__(self, skipCassandra=True)
+        AsyncNexusHandler.__init__(self, skipCassandra=True)
 
+    @gen.coroutine
     def calc(self, computeOptions, **args):
-        solrOnline = self._tile_service.pingSolr()
+        solrOnline = yield self._tile_service.pingSolr()
 
         # Not sure how to best check cassandra cluster status so just return True for now
         cassOnline = True
@@ -48,4 +51,4 @@ class HeartbeatHandlerImpl(NexusHandler):
             def toJson(self):
                 return json.dumps(self.result)
 
-        return SimpleResult(status)
+        raise gen.Return(SimpleResult(status))
@@ -69,6 +69,13 @@ class LongitudeLatitudeMapHandlerImpl(NexusHandler):
             "name": "End Time",
             "type": "string",
             "description": "Ending time in format YYYY-MM-DDTHH:mm:ssZ or seconds since epoch (Jan 1st, 1970)"
+        },
+        "resolution": {
+            "name": "Output Resolution",
+            "type": "float",
+            "description": "Size in degrees of the map cells wanted. When overviews of the dataset have been built, the "
+                           "statistics are computed over the cell means of the coarsest overview level no coarser "
+                           "than this. Optional (Default: full resolution)"
         }
     }
     singleton = True
@@ -106,20 +113,28 @@ class LongitudeLatitudeMapHandlerImpl(NexusHandler):
                 reason="'endTime' argument is required. Can be int value milliseconds from epoch or string format YYYY-MM-DDTHH:mm:ssZ",
                 code=400)
 
+        resolution = request.get_float_arg("resolution", None)
+        if resolution is not None and resolution <= 0:
+            raise NexusProcessingException(reason="'resolution' argument must be a positive number of degrees",
+                                           code=400)
+
         start_seconds_from_epoch = long((start_time - EPOCH).total_seconds())
         end_seconds_from_epoch = long((end_time - EPOCH).total_seconds())
 
-        return ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch
+        return ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch, resolution
 
     def calc(self, request, **args):
 
-        ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch = self.parse_arguments(request)
+        ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch, resolution = \
+            self.parse_arguments(request)
+        level = self._tile_service.get_overview_level(ds, resolution) if resolution is not None else 0
 
         boxes = self._tile_service.get_distinct_bounding_boxes_in_polygon(bounding_polygon, ds,
                                                                           start_seconds_from_epoch,
-                                                                          end_seconds_from_epoch)
+                                                                          end_seconds_from_epoch,
+                                                                          level=level)
         point_avg_over_time = lat_lon_map_driver(bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch, ds,
-                                                 [a_box.bounds for a_box in boxes])
+                                                 [a_box.bounds for a_box in boxes], level=level)
 
         kwargs = {
             "minLon": bounding_polygon.bounds[0],
@@ -166,17 +181,17 @@ def pool_initializer():
     connection.set_default_connection(current_process().name)
 
 
-def lat_lon_map_driver(search_bounding_polygon, search_start, search_end, ds, distinct_boxes):
+def lat_lon_map_driver(search_bounding_polygon, search_start, search_end, ds, distinct_boxes, level=0):
     from functools import partial
-    from nexustiles.nexustiles import NexusTileService
+    from nexustiles.nexustiles import get_tile_service
     # Start new processes to handle the work
     # pool = Pool(5, pool_initializer)
 
     func = partial(regression_on_tiles, search_bounding_polygon_wkt=search_bounding_polygon.wkt,
-                   search_start=search_start, search_end=search_end, ds=ds)
+                   search_start=search_start, search_end=search_end, ds=ds, level=level)
 
     global tile_service
-    tile_service = NexusTileService()
+    tile_service = get_tile_service()
     map_result = map(func, distinct_boxes)
     return [item for sublist in map_result for item in sublist]
     # TODO Use for multiprocessing:
@@ -201,7 +216,7 @@ def calc_linear_regression(arry, xarry):
     return slope, intercept, r_value, p_value, std_err
 
 
-def regression_on_tiles(tile_bounds, search_bounding_polygon_wkt, search_start, search_end, ds):
+def regression_on_tiles(tile_bounds, search_bounding_polygon_wkt, search_start, search_end, ds, level=0):
     if len(tile_bounds) < 1:
         return []
 
@@ -213,7 +228,7 @@ def regression_on_tiles(tile_bounds, search_bounding_polygon_wkt, search_start,
     tile_bounding_shape = box(*tile_bounds)
 
     # Load all tiles for given (exact) bounding box across the search time range
-    tiles = tile_service.find_tiles_by_exact_bounds(tile_bounds, ds, search_start, search_end)
+    tiles = tile_service.find_tiles_by_exact_bounds(tile_bounds, ds, search_start, search_end, level=level)
     if search_bounding_shape.contains(tile_bounding_shape):
         # The tile bounds are totally contained in the search area, we don't need to mask it.
         pass
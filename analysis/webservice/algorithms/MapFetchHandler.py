@@ -234,9 +234,11 @@ class MapFetchHandler(BaseHandler):
                                                                 dataTimeEnd)
 
         if len(daysinrange) > 0:
+            # The global image is drawn on a 1 degree canvas, so the coarsest overview level up to 1 degree will do
             ds1_nexus_tiles = self._tile_service.get_tiles_bounded_by_box_at_time(-90.0, 90.0, -180.0, 180.0,
                                                                                   ds,
-                                                                                  daysinrange[0])
+                                                                                  daysinrange[0],
+                                                                                  resolution=1.0)
 
             img = self.__create_global(ds1_nexus_tiles, stats, width, height, force_min, force_max, color_table,
                                        interpolation)
@@ -28,7 +28,8 @@ import pytz
 import shapely.geometry
 import shapely.wkt
 from backports.functools_lru_cache import lru_cache
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.model.nexusmodel import Tile, BBox
+from nexustiles.nexustiles import get_tile_service
 from pytz import timezone
 from scipy import stats
 
@@ -316,26 +317,30 @@ class TimeSeriesHandlerImpl(NexusHandler):
                                                                       'tile_min_val_d,tile_max_val_d,'
                                                                       'tile_min_lat,tile_max_lat,'
                                                                       'tile_min_lon,tile_max_lon'),
-                                                                  fetch_data=False)
-            if len(tile_stats) == 0:
+                                                                  fetch_data=False, columnar=True)
+            if len(tile_stats['id']) == 0:
                 continue
 
-            # Split list into tiles on the border of the bounding box and tiles completely inside the bounding box.
-            border_tiles, inner_tiles = [], []
-            for tile in tile_stats:
-                inner_tiles.append(tile) if bounding_polygon.contains(shapely.geometry.box(tile.bbox.min_lon,
-                                                                                           tile.bbox.min_lat,
-                                                                                           tile.bbox.max_lon,
-                                                                                           tile.bbox.max_lat)) else border_tiles.append(
-                    tile)
+            # Split tiles into those on the border of the bounding box and those completely inside the bounding box.
+            inner = np.array([bounding_polygon.contains(shapely.geometry.box(min_lon, min_lat, max_lon, max_lat))
+                              for min_lon, min_lat, max_lon, max_lat in
+                              zip(tile_stats['tile_min_lon'], tile_stats['tile_min_lat'],
+                                  tile_stats['tile_max_lon'], tile_stats['tile_max_lat'])], dtype=bool)
 
             # We can use the stats of the inner tiles directly
-            tile_means = [tile.tile_stats.mean for tile in inner_tiles]
-            tile_mins = [tile.tile_stats.min for tile in inner_tiles]
-            tile_maxes = [tile.tile_stats.max for tile in inner_tiles]
-            tile_counts = [tile.tile_stats.count for tile in inner_tiles]
+            tile_means = tile_stats['tile_avg_val_d'][inner].tolist()
+            tile_mins = tile_stats['tile_min_val_d'][inner].tolist()
+            tile_maxes = tile_stats['tile_max_val_d'][inner].tolist()
+            tile_counts = tile_stats['tile_count_i'][inner].tolist()
 
             # Border tiles need have the data loaded, masked, and stats recalculated
+            border_tiles = []
+            for index in np.flatnonzero(~inner):
+                tile = Tile()
+                tile.tile_id = tile_stats['id'][index]
+                tile.bbox = BBox(tile_stats['tile_min_lat'][index], tile_stats['tile_max_lat'][index],
+                                 tile_stats['tile_min_lon'][index], tile_stats['tile_max_lon'][index])
+                border_tiles.append(tile)
             border_tiles = list(self._tile_service.fetch_data_for_tiles(*border_tiles))
             border_tiles = self._tile_service.mask_tiles_to_polygon(bounding_polygon, border_tiles)
             for tile in border_tiles:
@@ -511,7 +516,7 @@ class TimeSeriesResults(NexusResults):
 
 class TimeSeriesCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
+        self.__tile_service = get_tile_service()
 
     def calc_average_on_day(self, bounding_polygon_wkt, dataset, timeinseconds):
         bounding_polygon = shapely.wkt.loads(bounding_polygon_wkt)
@@ -23,7 +23,7 @@ from multiprocessing.dummy import Pool, Manager
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from scipy import stats
 
 from webservice import Filtering as filt
@@ -294,7 +294,7 @@ class TimeSeriesResults(NexusResults):
 
 class TimeSeriesCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
+        self.__tile_service = get_tile_service()
 
     def calc_average_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds):
         # Get stats using solr only
@@ -27,7 +27,7 @@ from pytz import timezone, UTC
 import config
 import geo
 from webservice.NexusHandler import NexusHandler as BaseHandler
-from webservice.webmodel import NexusResults
+from webservice.webmodel import NexusResults, STREAM_CHUNK_SIZE, json_chunks
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
@@ -95,9 +95,18 @@ class DomsQueryResults(NexusResults):
             {"executionId": self.__executionId, "data": self.results(), "params": self.__args, "bounds": bounds,
              "count": self.__count, "details": self.__details}, indent=4, cls=DomsEncoder)
 
+    def toJsonChunks(self):
+        bounds = self.__bounds.toMap() if self.__bounds is not None else {}
+        return json_chunks(
+            {"executionId": self.__executionId, "data": self.results(), "params": self.__args, "bounds": bounds,
+             "count": self.__count, "details": self.__details}, cls=DomsEncoder)
+
     def toCSV(self):
         return DomsCSVFormatter.create(self.__executionId, self.results(), self.__args, self.__details)
 
+    def toCSVChunks(self):
+        return DomsCSVFormatter.create_chunks(self.__executionId, self.results(), self.__args, self.__details)
+
     def toNetCDF(self):
         return DomsNetCDFFormatter.create(self.__executionId, self.results(), self.__args, self.__details)
 
@@ -105,6 +114,10 @@ class DomsQueryResults(NexusResults):
 class DomsCSVFormatter:
     @staticmethod
     def create(executionId, results, params, details):
+        return ''.join(DomsCSVFormatter.create_chunks(executionId, results, params, details))
+
+    @staticmethod
+    def create_chunks(executionId, results, params, details):
 
         csv_mem_file = StringIO.StringIO()
         try:
@@ -112,16 +125,22 @@ class DomsCSVFormatter:
             DomsCSVFormatter.__addDynamicAttrs(csv_mem_file, executionId, results, params, details)
             csv.writer(csv_mem_file).writerow([])
 
-            DomsCSVFormatter.__packValues(csv_mem_file, results, params)
+            for _ in DomsCSVFormatter.__packValues(csv_mem_file, results, params):
+                if csv_mem_file.tell() >= STREAM_CHUNK_SIZE:
+                    yield csv_mem_file.getvalue()
+                    csv_mem_file.seek(0)
+                    csv_mem_file.truncate()
 
-            csv_out = csv_mem_file.getvalue()
+            if csv_mem_file.tell() > 0:
+                yield csv_mem_file.getvalue()
         finally:
             csv_mem_file.close()
 
-        return csv_out
-
     @staticmethod
     def __packValues(csv_mem_file, results, params):
+        """
+        Write the matchup rows to csv_mem_file, yielding after each one so the caller can drain the buffer.
+        """
 
         writer = csv.writer(csv_mem_file)
 
@@ -169,6 +188,7 @@ class DomsCSVFormatter:
                     matchup.get("wind_u", ""), matchup.get("wind_v", ""),
                 ]
                 writer.writerow(row)
+                yield
 
     @staticmethod
     def __addConstants(csvfile):
@@ -20,10 +20,12 @@ from calendar import timegm, monthrange
 from datetime import datetime
 
 import numpy as np
-from nexustiles.nexustiles import NexusTileService
+from nexustiles import pyramid
+from nexustiles.nexustiles import get_tile_service
+from nexustiles.rollup import DAY
 
 from webservice.NexusHandler import nexus_handler, SparkHandler, DEFAULT_PARAMETERS_SPEC
-from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
+from webservice.webmodel import NexusGridResults, NexusProcessingException, NoDataException
 
 
 @nexus_handler
@@ -31,7 +33,13 @@ class ClimMapSparkHandlerImpl(SparkHandler):
     name = "Climatology Map Spark"
     path = "/climMapSpark"
     description = "Computes a Latitude/Longitude Time Average map for a given month given an arbitrary geographical area and year range"
-    params = DEFAULT_PARAMETERS_SPEC
+    params = dict(DEFAULT_PARAMETERS_SPEC, resolution={
+        "name": "Output Resolution",
+        "type": "float",
+        "description": "Size in degrees of the map cells wanted. When overviews of the dataset have been built, the "
+                       "coarsest overview level no coarser than this is read instead of the full resolution tiles. "
+                       "Optional (Default: full resolution)"
+    })
     singleton = True
 
     def __init__(self):
@@ -47,7 +55,9 @@ class ClimMapSparkHandlerImpl(SparkHandler):
         startTime = tile_in_spark[1]
         endTime = tile_in_spark[2]
         ds = tile_in_spark[3]
-        tile_service = NexusTileService()
+        level = tile_in_spark[4]
+        rollup = tile_in_spark[5]
+        tile_service = get_tile_service()
         # print 'Started tile', tile_bounds
         # sys.stdout.flush()
         tile_inbounds_shape = (max_y - min_y + 1, max_x - min_x + 1)
@@ -72,7 +82,9 @@ class ClimMapSparkHandlerImpl(SparkHandler):
                                                        ds,
                                                        t_start,
                                                        t_end,
-                                                       part_dim=2)
+                                                       part_dim=2,
+                                                       level=level,
+                                                       rollup=rollup)
             # nexus_tiles = \
             #    tile_service.get_tiles_bounded_by_box(min_lat, max_lat, 
             #                                          min_lon, max_lon, 
@@ -93,11 +105,13 @@ class ClimMapSparkHandlerImpl(SparkHandler):
             # sys.stdout.flush()
 
             for tile in nexus_tiles:
-                tile.data.data[:, :] = np.nan_to_num(tile.data.data)
-                sum_tile += tile.data.data[0, min_y:max_y + 1, min_x:max_x + 1]
-                cnt_tile += (~tile.data.mask[0,
-                              min_y:max_y + 1,
-                              min_x:max_x + 1]).astype(np.uint8)
+                # Overview and rollup cells carry the sum and count of the values they cover, so the average stays
+                # exact
+                tile_sums, tile_counts = pyramid.sum_count(tile)
+                sum_tile += tile_sums[0, min_y:max_y + 1, min_x:max_x + 1]
+                cnt_tile += tile_counts[0,
+                                        min_y:max_y + 1,
+                                        min_x:max_x + 1].astype(np.uint32)
             t_start = t_end + 1
 
         # print 'cnt_tile = ', cnt_tile
@@ -121,14 +135,22 @@ class ClimMapSparkHandlerImpl(SparkHandler):
         :return:
         """
 
-        self._setQueryParams(computeOptions.get_dataset()[0],
+        ds = computeOptions.get_dataset()[0]
+        resolution = computeOptions.get_float_arg("resolution", None)
+        if resolution is not None and resolution <= 0:
+            raise NexusProcessingException(reason="'resolution' argument must be a positive number of degrees",
+                                           code=400)
+        level = self._tile_service.get_overview_level(ds, resolution) if resolution is not None else 0
+
+        self._setQueryParams(ds,
                              (float(computeOptions.get_min_lat()),
                               float(computeOptions.get_max_lat()),
                               float(computeOptions.get_min_lon()),
                               float(computeOptions.get_max_lon())),
                              start_year=computeOptions.get_start_year(),
                              end_year=computeOptions.get_end_year(),
-                             clim_month=computeOptions.get_clim_month())
+                             clim_month=computeOptions.get_clim_month(),
+                             level=level)
         self._startTime = timegm((self._startYear, 1, 1, 0, 0, 0))
         self._endTime = timegm((self._endYear, 12, 31, 23, 59, 59))
 
@@ -154,6 +176,7 @@ class ClimMapSparkHandlerImpl(SparkHandler):
         # for tile in nexus_tiles:
         #    print 'lats: ', tile.latitudes.compressed()
         #    print 'lons: ', tile.longitudes.compressed()
+        self.log.debug('Using overview level {0}'.format(self._level))
         self.log.debug('Using Native resolution: lat_res={0}, lon_res={1}'.format(self._latRes, self._lonRes))
         self.log.debug('nlats={0}, nlons={1}'.format(self._nlats, self._nlons))
         self.log.debug('center lat range = {0} to {1}'.format(self._minLatCent,
@@ -164,7 +187,7 @@ class ClimMapSparkHandlerImpl(SparkHandler):
         # Create array of tuples to pass to Spark map function
         nexus_tiles_spark = [[self._find_tile_bounds(t),
                               self._startTime, self._endTime,
-                              self._ds] for t in nexus_tiles]
+                              self._ds, self._level, DAY] for t in nexus_tiles]
         # print 'nexus_tiles_spark = ', nexus_tiles_spark
         # Remove empty tiles (should have bounds set to None)
         bad_tile_inds = np.where([t[0] is None for t in nexus_tiles_spark])[0]
@@ -173,26 +196,19 @@ class ClimMapSparkHandlerImpl(SparkHandler):
         num_nexus_tiles_spark = len(nexus_tiles_spark)
         self.log.debug('Created {0} spark tiles'.format(num_nexus_tiles_spark))
 
-        # Expand Spark map tuple array by duplicating each entry N times,
-        # where N is the number of ways we want the time dimension carved up.
-        # (one partition per year in this case).
-        num_years = self._endYear - self._startYear + 1
-        nexus_tiles_spark = np.repeat(nexus_tiles_spark, num_years, axis=0)
+        # Expand Spark map tuple array by duplicating each entry once per
+        # year, read from the monthly rollup of that year when it was built.
+        time_parts = [time_part
+                      for y in range(self._startYear, self._endYear + 1)
+                      for time_part in self._time_parts(timegm((y, self._climMonth, 1, 0, 0, 0)),
+                                                        timegm((y, self._climMonth,
+                                                                monthrange(y, self._climMonth)[1],
+                                                                23, 59, 59)))]
+        self.log.debug('time_parts={0}'.format(time_parts))
+        nexus_tiles_spark = [[t[0], part_start, part_end, t[3], t[4], rollup]
+                             for t in nexus_tiles_spark
+                             for part_start, part_end, rollup in time_parts]
         self.log.debug('repeated len(nexus_tiles_spark) = {0}'.format(len(nexus_tiles_spark)))
-
-        # Set the time boundaries for each of the Spark map tuples.
-        # Every Nth element in the array gets the same time bounds.
-        spark_part_time_ranges = \
-            np.repeat(np.array([[timegm((y, self._climMonth, 1, 0, 0, 0)),
-                                 timegm((y, self._climMonth,
-                                         monthrange(y, self._climMonth)[1],
-                                         23, 59, 59))]
-                                for y in range(self._startYear,
-                                               self._endYear + 1)]),
-                      num_nexus_tiles_spark,
-                      axis=0).reshape((len(nexus_tiles_spark), 2))
-        self.log.debug('spark_part_time_ranges={0}'.format(spark_part_time_ranges))
-        nexus_tiles_spark[:, 1:3] = spark_part_time_ranges
         # print 'nexus_tiles_spark final = '
         # for i in range(len(nexus_tiles_spark)):
         #    print nexus_tiles_spark[i]
@@ -252,17 +268,12 @@ class ClimMapSparkHandlerImpl(SparkHandler):
                             tile_min_lon, tile_max_lon,
                             y0, y1, x0, x1))
 
-        # Store global map in a NetCDF file.
-        self._create_nc_file(a, 'clmap.nc', 'val')
-
-        # Create dict for JSON response
-        results = [[{'avg': a[y, x], 'cnt': int(n[y, x]),
-                     'lat': self._ind2lat(y), 'lon': self._ind2lon(x)}
-                    for x in range(a.shape[1])] for y in range(a.shape[0])]
+        lats = [self._ind2lat(y) for y in range(a.shape[0])]
+        lons = [self._ind2lon(x) for x in range(a.shape[1])]
 
-        return ClimMapSparkResults(results=results, meta={}, computeOptions=computeOptions)
+        return ClimMapSparkResults(lats, lons, [('avg', a), ('cnt', n)], meta={}, computeOptions=computeOptions)
 
 
-class ClimMapSparkResults(NexusResults):
-    def __init__(self, results=None, meta=None, computeOptions=None):
-        NexusResults.__init__(self, results=results, meta=meta, stats=None, computeOptions=computeOptions)
+class ClimMapSparkResults(NexusGridResults):
+    def __init__(self, lats, lons, variables, meta=None, computeOptions=None):
+        NexusGridResults.__init__(self, lats, lons, variables, meta=meta, stats=None, computeOptions=computeOptions)
@@ -19,11 +19,11 @@ import math
 import logging
 from datetime import datetime
 import numpy as np
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 
 # from time import time
 from webservice.NexusHandler import nexus_handler, SparkHandler, DEFAULT_PARAMETERS_SPEC
-from webservice.webmodel import NexusProcessingException, NexusResults, NoDataException
+from webservice.webmodel import CustomEncoder, NexusGridResults, NexusProcessingException, NoDataException
 
 
 @nexus_handler
@@ -65,7 +65,7 @@ class CorrMapSparkHandlerImpl(SparkHandler):
         # print 'days_at_a_time = ', days_at_a_time
         t_incr = 86400 * days_at_a_time
 
-        tile_service = NexusTileService()
+        tile_service = get_tile_service()
 
         # Compute the intermediate summations needed for the Pearson 
         # Correlation Coefficient.  We use a one-pass online algorithm
@@ -303,26 +303,20 @@ class CorrMapSparkHandlerImpl(SparkHandler):
             r[y0:y1 + 1, x0:x1 + 1] = tile_data
             n[y0:y1 + 1, x0:x1 + 1] = tile_cnt
 
-        # Store global map in a NetCDF file.
-        self._create_nc_file(r, 'corrmap.nc', 'r')
+        lats = [self._ind2lat(y) for y in range(r.shape[0])]
+        lons = [self._ind2lon(x) for x in range(r.shape[1])]
 
-        # Create dict for JSON response
-        results = [[{'r': r[y, x], 'cnt': int(n[y, x]),
-                     'lat': self._ind2lat(y), 'lon': self._ind2lon(x)}
-                    for x in range(r.shape[1])] for y in range(r.shape[0])]
+        return CorrelationResults(lats, lons, [('r', r), ('cnt', n)])
 
-        return CorrelationResults(results)
 
-
-class CorrelationResults(NexusResults):
-    def __init__(self, results):
-        NexusResults.__init__(self)
-        self.results = results
+class CorrelationResults(NexusGridResults):
+    def __init__(self, lats, lons, variables):
+        NexusGridResults.__init__(self, lats, lons, variables)
 
     def toJson(self):
         json_d = {
             "stats": {},
             "meta": [None, None],
-            "data": self.results
+            "data": self.results()
         }
-        return json.dumps(json_d, indent=4)
+        return json.dumps(json_d, indent=4, cls=CustomEncoder)
@@ -19,7 +19,7 @@ from datetime import datetime
 
 import numpy as np
 import pytz
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from shapely import wkt
 from shapely.geometry import Polygon
 
@@ -131,12 +131,11 @@ class DailyDifferenceAverageSparkImpl(SparkHandler):
 
         self.log.debug("Querying for tiles in search domain")
         # Get tile ids in box
-        tile_ids = [tile.tile_id for tile in
-                    self._tile_service.find_tiles_in_polygon(bounding_polygon, dataset,
-                                                             start_seconds_from_epoch, end_seconds_from_epoch,
-                                                             fetch_data=False, fl='id',
-                                                             sort=['tile_min_time_dt asc', 'tile_min_lon asc',
-                                                                   'tile_min_lat asc'], rows=5000)]
+        tile_ids = list(self._tile_service.find_tiles_in_polygon(bounding_polygon, dataset,
+                                                              start_seconds_from_epoch, end_seconds_from_epoch,
+                                                              fetch_data=False, fl='id', export=True,
+                                                              sort=['tile_min_time_dt asc', 'tile_min_lon asc',
+                                                                    'tile_min_lat asc']))
 
         # Call spark_matchup
         self.log.debug("Calling Spark Driver")
@@ -315,7 +314,7 @@ def calculate_diff(tile_ids, bounding_wkt, dataset, climatology):
     tile_ids = list(tile_ids)
     if len(tile_ids) == 0:
         return []
-    tile_service = NexusTileService()
+    tile_service = get_tile_service()
 
     for tile_id in tile_ids:
         # Get the dataset tile
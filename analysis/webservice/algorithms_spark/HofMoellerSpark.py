@@ -24,7 +24,7 @@ import numpy as np
 import shapely.geometry
 from matplotlib import cm
 from matplotlib.ticker import FuncFormatter
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from pytz import timezone
 
 from webservice.NexusHandler import SparkHandler, nexus_handler
@@ -45,10 +45,10 @@ class HofMoellerCalculator(object):
         (latlon, tile_id, index,
          min_lat, max_lat, min_lon, max_lon) = tile_in_spark
 
-        tile_service = NexusTileService()
+        tile_service = get_tile_service()
         try:
             # Load the dataset tile
-            tile = tile_service.find_tile_by_id(tile_id)[0]
+            tile = tile_service.find_tile_by_id(tile_id, variables=[], sparse=True)[0]
             # Mask it to the search domain
             tile = tile_service.mask_tiles_to_bbox(min_lat, max_lat,
                                                    min_lon, max_lon, [tile])[0]
@@ -25,7 +25,7 @@ from math import cos, radians
 import numpy as np
 import pyproj
 import requests
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from pytz import timezone, UTC
 from scipy import spatial
 from shapely import wkt
@@ -219,12 +219,11 @@ class Matchup(SparkHandler):
 
         self.log.debug("Querying for tiles in search domain")
         # Get tile ids in box
-        tile_ids = [tile.tile_id for tile in
-                    self._tile_service.find_tiles_in_polygon(bounding_polygon, primary_ds_name,
-                                                             start_seconds_from_epoch, end_seconds_from_epoch,
-                                                             fetch_data=False, fl='id',
-                                                             sort=['tile_min_time_dt asc', 'tile_min_lon asc',
-                                                                   'tile_min_lat asc'], rows=5000)]
+        tile_ids = list(self._tile_service.find_tiles_in_polygon(bounding_polygon, primary_ds_name,
+                                                              start_seconds_from_epoch, end_seconds_from_epoch,
+                                                              fetch_data=False, fl='id', export=True,
+                                                              sort=['tile_min_time_dt asc', 'tile_min_lon asc',
+                                                                    'tile_min_lat asc']))
 
         # Call spark_matchup
         self.log.debug("Calling Spark Driver")
@@ -524,7 +523,7 @@ def match_satellite_to_insitu(tile_ids, primary_b, matchup_b, parameter_b, tt_b,
     tile_ids = list(tile_ids)
     if len(tile_ids) == 0:
         return []
-    tile_service = NexusTileService()
+    tile_service = get_tile_service()
 
     # Determine the spatial temporal extents of this partition of tiles
     tiles_bbox = tile_service.get_bounding_box(tile_ids)
@@ -611,8 +610,9 @@ def match_tile_to_point_generator(tile_service, tile_id, m_tree, edge_results, s
     # Load tile
     try:
         the_time = datetime.now()
+        # Swath and time series tiles stay sparse, only the populated cells are ever read
         tile = tile_service.mask_tiles_to_polygon(wkt.loads(search_domain_bounding_wkt),
-                                                  tile_service.find_tile_by_id(tile_id))[0]
+                                                  tile_service.find_tile_by_id(tile_id, sparse=True))[0]
         print "%s Time to load tile %s" % (str(datetime.now() - the_time), tile_id)
     except IndexError:
         # This should only happen if all measurements in a tile become masked after applying the bounding polygon
@@ -622,6 +622,7 @@ def match_tile_to_point_generator(tile_service, tile_id, m_tree, edge_results, s
     the_time = datetime.now()
     # Get list of indices of valid values
     valid_indices = tile.get_indices()
+    tile_data = tile.sparse_data if tile.sparse_data is not None else tile.data
     primary_points = np.array(
         [pyproj.transform(p1=lonlat_proj, p2=aeqd_proj, x=tile.longitudes[aslice[2]], y=tile.latitudes[aslice[1]]) for
          aslice in valid_indices])
@@ -640,7 +641,7 @@ def match_tile_to_point_generator(tile_service, tile_id, m_tree, edge_results, s
             p_nexus_point = NexusPoint(tile.latitudes[valid_indices[i][1]],
                                        tile.longitudes[valid_indices[i][2]], None,
                                        tile.times[valid_indices[i][0]], valid_indices[i],
-                                       tile.data[tuple(valid_indices[i])])
+                                       tile_data[tuple(valid_indices[i])])
             p_doms_point = DomsPoint.from_nexus_point(p_nexus_point, tile=tile, parameter=search_parameter)
             for m_point_index in point_matches:
                 m_doms_point = DomsPoint.from_edge_point(edge_results[m_point_index])
@@ -20,15 +20,20 @@ from datetime import datetime
 
 import numpy as np
 import shapely.geometry
-from nexustiles.nexustiles import NexusTileService
+from nexustiles import pyramid
+from nexustiles.nexustiles import get_tile_service
+from nexustiles.rollup import DAY, ROLLUP_VARIABLES
 from pytz import timezone
 
 from webservice.NexusHandler import nexus_handler, SparkHandler
-from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
+from webservice.webmodel import NexusGridResults, NexusProcessingException, NoDataException
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
 
+# Tiles fetched at a time by each Spark task
+TILES_PER_PAGE = 50
+
 
 @nexus_handler
 class TimeAvgMapSparkHandlerImpl(SparkHandler):
@@ -63,6 +68,13 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
             "description": "Configuration used to launch in the Spark cluster. Value should be 3 elements separated by "
                            "commas. 1) Spark Master 2) Number of Spark Executors 3) Number of Spark Partitions. Only "
                            "Number of Spark Partitions is used by this function. Optional (Default: local,1,1)"
+        },
+        "resolution": {
+            "name": "Output Resolution",
+            "type": "float",
+            "description": "Size in degrees of the map cells wanted. When overviews of the dataset have been built, the "
+                           "coarsest overview level no coarser than this is read instead of the full resolution "
+                           "tiles. Optional (Default: full resolution)"
         }
     }
     singleton = True
@@ -131,10 +143,15 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
 
         nparts_requested = request.get_nparts()
 
+        resolution = request.get_float_arg("resolution", None)
+        if resolution is not None and resolution <= 0:
+            raise NexusProcessingException(reason="'resolution' argument must be a positive number of degrees",
+                                           code=400)
+
         start_seconds_from_epoch = long((start_time - EPOCH).total_seconds())
         end_seconds_from_epoch = long((end_time - EPOCH).total_seconds())
 
-        return ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch, nparts_requested
+        return ds, bounding_polygon, start_seconds_from_epoch, end_seconds_from_epoch, nparts_requested, resolution
 
     def calc(self, compute_options, **args):
         """
@@ -144,14 +161,16 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
         :return:
         """
 
-        ds, bbox, start_time, end_time, nparts_requested = self.parse_arguments(compute_options)
+        ds, bbox, start_time, end_time, nparts_requested, resolution = self.parse_arguments(compute_options)
+        level = self._tile_service.get_overview_level(ds, resolution) if resolution is not None else 0
         self._setQueryParams(ds,
                              (float(bbox.bounds[1]),
                               float(bbox.bounds[3]),
                               float(bbox.bounds[0]),
                               float(bbox.bounds[2])),
                              start_time,
-                             end_time)
+                             end_time,
+                             level=level)
 
         nexus_tiles = self._find_global_tile_set()
 
@@ -176,6 +195,7 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
             self.log.debug('{0}, {1}'.format(i, datetime.utcfromtimestamp(d)))
 
 
+        self.log.debug('Using overview level {0}'.format(self._level))
         self.log.debug('Using Native resolution: lat_res={0}, lon_res={1}'.format(self._latRes, self._lonRes))
         self.log.debug('nlats={0}, nlons={1}'.format(self._nlats, self._nlons))
         self.log.debug('center lat range = {0} to {1}'.format(self._minLatCent,
@@ -186,23 +206,23 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
         # Create array of tuples to pass to Spark map function
         nexus_tiles_spark = [[self._find_tile_bounds(t),
                               self._startTime, self._endTime,
-                              self._ds] for t in nexus_tiles]
+                              self._ds, self._level, DAY] for t in nexus_tiles]
 
         # Remove empty tiles (should have bounds set to None)
         bad_tile_inds = np.where([t[0] is None for t in nexus_tiles_spark])[0]
         for i in np.flipud(bad_tile_inds):
             del nexus_tiles_spark[i]
 
-        # Expand Spark map tuple array by duplicating each entry N times,
-        # where N is the number of ways we want the time dimension carved up.
-        # Set the time boundaries for each of the Spark map tuples so that
-        # every Nth element in the array gets the same time bounds.
+        # Expand Spark map tuple array by duplicating each entry once per
+        # time part. Full months and years with rollups are one part per run,
+        # the days in between are carved up in at most max_time_parts parts.
         max_time_parts = 72
-        num_time_parts = min(max_time_parts, ndays)
+        time_parts = self._time_parts(self._startTime, self._endTime, daysinrange, max_time_parts)
+        self.log.debug('Time parts: {0}'.format(time_parts))
 
-        spark_part_time_ranges = np.tile(np.array([a[[0,-1]] for a in np.array_split(np.array(daysinrange), num_time_parts)]), (len(nexus_tiles_spark),1))
-        nexus_tiles_spark = np.repeat(nexus_tiles_spark, num_time_parts, axis=0)
-        nexus_tiles_spark[:, 1:3] = spark_part_time_ranges
+        nexus_tiles_spark = [[t[0], part_start, part_end, t[3], t[4], rollup]
+                             for t in nexus_tiles_spark
+                             for part_start, part_end, rollup in time_parts]
 
         # Launch Spark computations
         spark_nparts = self._spark_nparts(nparts_requested)
@@ -262,19 +282,14 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
                             tile_min_lon, tile_max_lon,
                             y0, y1, x0, x1))
 
-        # Store global map in a NetCDF file.
-        self._create_nc_file(a, 'tam.nc', 'val', fill=self._fill)
+        lats = [self._ind2lat(y) for y in range(a.shape[0])]
+        lons = [self._ind2lon(x) for x in range(a.shape[1])]
 
-        # Create dict for JSON response
-        results = [[{'mean': a[y, x], 'cnt': int(n[y, x]),
-                     'lat': self._ind2lat(y), 'lon': self._ind2lon(x)}
-                    for x in range(a.shape[1])] for y in range(a.shape[0])]
-
-        return NexusResults(results=results, meta={}, stats=None,
-                            computeOptions=None, minLat=bbox.bounds[1],
-                            maxLat=bbox.bounds[3], minLon=bbox.bounds[0],
-                            maxLon=bbox.bounds[2], ds=ds, startTime=start_time,
-                            endTime=end_time)
+        return NexusGridResults(lats, lons, [('mean', a), ('cnt', n)], meta={}, stats=None,
+                                computeOptions=None, minLat=bbox.bounds[1],
+                                maxLat=bbox.bounds[3], minLon=bbox.bounds[0],
+                                maxLon=bbox.bounds[2], ds=ds, startTime=start_time,
+                                endTime=end_time)
 
     @staticmethod
     def _map(tile_in_spark):
@@ -284,30 +299,26 @@ class TimeAvgMapSparkHandlerImpl(SparkHandler):
         startTime = tile_in_spark[1]
         endTime = tile_in_spark[2]
         ds = tile_in_spark[3]
-        tile_service = NexusTileService()
-
-        tile_inbounds_shape = (max_y - min_y + 1, max_x - min_x + 1)
-
-        days_at_a_time = 30
-
-        t_incr = 86400 * days_at_a_time
-        sum_tile = np.array(np.zeros(tile_inbounds_shape, dtype=np.float64))
-        cnt_tile = np.array(np.zeros(tile_inbounds_shape, dtype=np.uint32))
-        t_start = startTime
-        while t_start <= endTime:
-            t_end = min(t_start + t_incr, endTime)
-
-            nexus_tiles = \
-                tile_service.get_tiles_bounded_by_box(min_lat, max_lat,
-                                                      min_lon, max_lon,
-                                                      ds=ds,
-                                                      start_time=t_start,
-                                                      end_time=t_end)
-
-            for tile in nexus_tiles:
-                tile.data.data[:, :] = np.nan_to_num(tile.data.data)
-                sum_tile += tile.data.data[0, min_y:max_y + 1, min_x:max_x + 1]
-                cnt_tile += (~tile.data.mask[0, min_y:max_y + 1, min_x:max_x + 1]).astype(np.uint8)
-            t_start = t_end + 1
-
-        return (min_lat, max_lat, min_lon, max_lon), (sum_tile, cnt_tile)
+        level = tile_in_spark[4]
+        rollup = tile_in_spark[5]
+        tile_service = get_tile_service()
+
+        if rollup != DAY:
+            variables = ROLLUP_VARIABLES
+        elif level:
+            variables = pyramid.OVERVIEW_VARIABLES
+        else:
+            variables = []
+
+        # Tiles are fetched and folded one page at a time, bypassing the tile caches, so memory does not grow with the
+        # time range. Overview and rollup cells carry the sum and count of the values they cover, so the average stays
+        # exact.
+        window_sum = pyramid.WindowSum(*tile_bounds)
+        for page in tile_service.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, ds=ds, start_time=startTime,
+                                                   end_time=endTime, stream=True, rows=TILES_PER_PAGE, level=level,
+                                                   rollup=rollup, variables=variables, use_cache=False):
+            for tile in page:
+                if startTime <= tile.times[0] <= endTime:
+                    window_sum.add(tile)
+
+        return (min_lat, max_lat, min_lon, max_lon), (window_sum.sums, window_sum.counts)
@@ -29,7 +29,8 @@ import pytz
 import shapely.geometry
 import shapely.wkt
 from backports.functools_lru_cache import lru_cache
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.model.nexusmodel import Tile, BBox, TileAggregates, reduce_aggregates
+from nexustiles.nexustiles import get_tile_service
 from pytz import timezone
 from scipy import stats
 
@@ -289,26 +290,30 @@ class TimeSeriesHandlerImpl(SparkHandler):
                                                                       'tile_min_val_d,tile_max_val_d,'
                                                                       'tile_min_lat,tile_max_lat,'
                                                                       'tile_min_lon,tile_max_lon'),
-                                                                  fetch_data=False)
-            if len(tile_stats) == 0:
+                                                                  fetch_data=False, columnar=True)
+            if len(tile_stats['id']) == 0:
                 continue
 
-            # Split list into tiles on the border of the bounding box and tiles completely inside the bounding box.
-            border_tiles, inner_tiles = [], []
-            for tile in tile_stats:
-                inner_tiles.append(tile) if bounding_polygon.contains(shapely.geometry.box(tile.bbox.min_lon,
-                                                                                           tile.bbox.min_lat,
-                                                                                           tile.bbox.max_lon,
-                                                                                           tile.bbox.max_lat)) else border_tiles.append(
-                    tile)
+            # Split tiles into those on the border of the bounding box and those completely inside the bounding box.
+            inner = np.array([bounding_polygon.contains(shapely.geometry.box(min_lon, min_lat, max_lon, max_lat))
+                              for min_lon, min_lat, max_lon, max_lat in
+                              zip(tile_stats['tile_min_lon'], tile_stats['tile_min_lat'],
+                                  tile_stats['tile_max_lon'], tile_stats['tile_max_lat'])], dtype=bool)
 
             # We can use the stats of the inner tiles directly
-            tile_means = [tile.tile_stats.mean for tile in inner_tiles]
-            tile_mins = [tile.tile_stats.min for tile in inner_tiles]
-            tile_maxes = [tile.tile_stats.max for tile in inner_tiles]
-            tile_counts = [tile.tile_stats.count for tile in inner_tiles]
+            tile_means = tile_stats['tile_avg_val_d'][inner].tolist()
+            tile_mins = tile_stats['tile_min_val_d'][inner].tolist()
+            tile_maxes = tile_stats['tile_max_val_d'][inner].tolist()
+            tile_counts = tile_stats['tile_count_i'][inner].tolist()
 
             # Border tiles need have the data loaded, masked, and stats recalculated
+            border_tiles = []
+            for index in np.flatnonzero(~inner):
+                tile = Tile()
+                tile.tile_id = tile_stats['id'][index]
+                tile.bbox = BBox(tile_stats['tile_min_lat'][index], tile_stats['tile_max_lat'][index],
+                                 tile_stats['tile_min_lon'][index], tile_stats['tile_max_lon'][index])
+                border_tiles.append(tile)
             border_tiles = list(self._tile_service.fetch_data_for_tiles(*border_tiles))
             border_tiles = self._tile_service.mask_tiles_to_polygon(bounding_polygon, border_tiles)
             for tile in border_tiles:
@@ -503,6 +508,11 @@ def spark_driver(daysinrange, bounding_polygon, ds, fill=-9999.,
 
 
 def calc_average_on_day(tile_in_spark):
+    """
+    Compute the daily statistics of a dataset over the bounding polygon. Tiles completely inside the polygon are
+    summarized from the partial statistics stored with their metadata, only tiles on the border of the polygon (or
+    without stored partials) have their data fetched and masked.
+    """
     import shapely.wkt
     from datetime import datetime
     from pytz import timezone
@@ -511,59 +521,63 @@ def calc_average_on_day(tile_in_spark):
     (bounding_wkt, dataset, timestamps, fill) = tile_in_spark
     if len(timestamps) == 0:
         return []
-    tile_service = NexusTileService()
-    ds1_nexus_tiles = \
-        tile_service.get_tiles_bounded_by_polygon(shapely.wkt.loads(bounding_wkt),
-                                                  dataset,
-                                                  timestamps[0],
-                                                  timestamps[-1],
-                                                  rows=5000)
-
-    tile_dict = {}
-    for timeinseconds in timestamps:
-        tile_dict[timeinseconds] = []
-
-    for i in range(len(ds1_nexus_tiles)):
-        tile = ds1_nexus_tiles[i]
-        tile_dict[tile.times[0]].append(i)
+    tile_service = get_tile_service()
+    bounding_polygon = shapely.wkt.loads(bounding_wkt)
+    tile_stats = tile_service.find_tile_aggregates_in_polygon(bounding_polygon, dataset, timestamps[0],
+                                                              timestamps[-1], rows=5000)
+
+    # Split tiles into those completely inside the bounding polygon that have stored partials and all others
+    inner = np.array([bounding_polygon.contains(shapely.geometry.box(min_lon, min_lat, max_lon, max_lat))
+                      for min_lon, min_lat, max_lon, max_lat in
+                      zip(tile_stats['tile_min_lon'], tile_stats['tile_min_lat'],
+                          tile_stats['tile_max_lon'], tile_stats['tile_max_lat'])], dtype=bool)
+    inner &= ~np.isnan(tile_stats['weight_sum'])
+
+    border_tiles = []
+    for index in np.flatnonzero(~inner):
+        tile = Tile()
+        tile.tile_id = tile_stats['id'][index]
+        tile.bbox = BBox(tile_stats['tile_min_lat'][index], tile_stats['tile_max_lat'][index],
+                         tile_stats['tile_min_lon'][index], tile_stats['tile_max_lon'][index])
+        border_tiles.append(tile)
+    if border_tiles:
+        border_tiles = list(tile_service.fetch_data_for_tiles(*border_tiles, variables=[]))
+        border_tiles = tile_service.mask_tiles_to_polygon(bounding_polygon, border_tiles)
+        border_tiles = tile_service.mask_tiles_to_time_range(timestamps[0], timestamps[-1], border_tiles)
+
+    # Reduce the stored partials of the inner tiles and the valid values of the border tiles of all days at once,
+    # grouped by the index of their day in timestamps
+    border_values, border_weights, border_times = [], [], []
+    for tile in border_tiles:
+        values, weights = tile.get_valid_values()
+        border_values.append(values)
+        border_weights.append(weights)
+        border_times.append(np.full(values.size, int(tile.times[0]), dtype=np.int64))
+    border_aggregates = TileAggregates.of_values(np.concatenate(border_values or [np.empty(0)]),
+                                                 np.concatenate(border_weights or [np.empty(0)]))
+    times = np.concatenate([tile_stats['tile_min_time_dt'][inner].astype(np.int64)] + border_times)
+    aggregates = TileAggregates(*[np.concatenate((tile_stats[field][inner], border_field))
+                                  for field, border_field in zip(TileAggregates._fields, border_aggregates)])
+
+    days = np.array(timestamps, dtype=np.int64)
+    groups = np.searchsorted(days, times)
+    in_days = days[np.minimum(groups, len(days) - 1)] == times
+    daily_aggregates = reduce_aggregates(groups[in_days], len(days),
+                                         TileAggregates(*[field[in_days] for field in aggregates]))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means, stds = daily_aggregates.mean, daily_aggregates.std
 
     stats_arr = []
-    for timeinseconds in timestamps:
-        cur_tile_list = tile_dict[timeinseconds]
-        if len(cur_tile_list) == 0:
-            continue
-        tile_data_agg = \
-            np.ma.array(data=np.hstack([ds1_nexus_tiles[i].data.data.flatten()
-                                        for i in cur_tile_list
-                                        if (ds1_nexus_tiles[i].times[0] ==
-                                            timeinseconds)]),
-                        mask=np.hstack([ds1_nexus_tiles[i].data.mask.flatten()
-                                        for i in cur_tile_list
-                                        if (ds1_nexus_tiles[i].times[0] ==
-                                            timeinseconds)]))
-        lats_agg = np.hstack([np.repeat(ds1_nexus_tiles[i].latitudes,
-                                        len(ds1_nexus_tiles[i].longitudes))
-                              for i in cur_tile_list
-                              if (ds1_nexus_tiles[i].times[0] ==
-                                  timeinseconds)])
-        if (len(tile_data_agg) == 0) or tile_data_agg.mask.all():
-            continue
-        else:
-            data_min = np.ma.min(tile_data_agg)
-            data_max = np.ma.max(tile_data_agg)
-            daily_mean = \
-                np.ma.average(tile_data_agg,
-                              weights=np.cos(np.radians(lats_agg))).item()
-            data_count = np.ma.count(tile_data_agg)
-            data_std = np.ma.std(tile_data_agg)
+    for index in np.flatnonzero(daily_aggregates.count):
+        timeinseconds = days[index]
 
         # Return Stats by day
         stat = {
-            'min': data_min,
-            'max': data_max,
-            'mean': daily_mean,
-            'cnt': data_count,
-            'std': data_std,
+            'min': daily_aggregates.min[index].item(),
+            'max': daily_aggregates.max[index].item(),
+            'mean': means[index].item(),
+            'cnt': int(daily_aggregates.count[index]),
+            'std': stds[index].item(),
             'time': int(timeinseconds),
             'iso_time': datetime.utcfromtimestamp(int(timeinseconds)).replace(tzinfo=timezone('UTC')).strftime(ISO_8601)
         }
@@ -20,11 +20,12 @@ from datetime import datetime
 
 import numpy as np
 import shapely.geometry
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
+from nexustiles.rollup import DAY, ROLLUP_VARIABLES, moments
 from pytz import timezone
 
 from webservice.NexusHandler import nexus_handler, SparkHandler
-from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
+from webservice.webmodel import NexusGridResults, NexusProcessingException, NoDataException
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
@@ -186,23 +187,23 @@ class VarianceSparkHandlerImpl(SparkHandler):
         # Create array of tuples to pass to Spark map function
         nexus_tiles_spark = [[self._find_tile_bounds(t),
                               self._startTime, self._endTime,
-                              self._ds] for t in nexus_tiles]
+                              self._ds, DAY] for t in nexus_tiles]
 
         # Remove empty tiles (should have bounds set to None)
         bad_tile_inds = np.where([t[0] is None for t in nexus_tiles_spark])[0]
         for i in np.flipud(bad_tile_inds):
             del nexus_tiles_spark[i]
 
-        # Expand Spark map tuple array by duplicating each entry N times,
-        # where N is the number of ways we want the time dimension carved up.
-        # Set the time boundaries for each of the Spark map tuples so that
-        # every Nth element in the array gets the same time bounds.
+        # Expand Spark map tuple array by duplicating each entry once per
+        # time part. Full months and years with rollups are one part per run,
+        # the days in between are carved up in at most max_time_parts parts.
         max_time_parts = 72
-        num_time_parts = min(max_time_parts, ndays)
+        time_parts = self._time_parts(self._startTime, self._endTime, daysinrange, max_time_parts)
+        self.log.debug('Time parts: {0}'.format(time_parts))
 
-        spark_part_time_ranges = np.tile(np.array([a[[0,-1]] for a in np.array_split(np.array(daysinrange), num_time_parts)]), (len(nexus_tiles_spark),1))
-        nexus_tiles_spark = np.repeat(nexus_tiles_spark, num_time_parts, axis=0)
-        nexus_tiles_spark[:, 1:3] = spark_part_time_ranges
+        nexus_tiles_spark = [[t[0], part_start, part_end, t[3], rollup]
+                             for t in nexus_tiles_spark
+                             for part_start, part_end, rollup in time_parts]
 
         # Launch Spark computations to calculate x_bar
         spark_nparts = self._spark_nparts(nparts_requested)
@@ -231,8 +232,12 @@ class VarianceSparkHandlerImpl(SparkHandler):
         #
 
         # Create array of tuples to pass to Spark map function - first param are the tile bounds that were in the
-        # results and the last param is the data for the results (x bar)
-        nexus_tiles_spark = [[t[0], self._startTime, self._endTime, self._ds, t[1]] for t in avg_tiles]
+        # results and the last param is the data for the results (x bar). Each tile is mapped once per run of
+        # rollups or days.
+        time_parts = self._time_parts(self._startTime, self._endTime)
+        nexus_tiles_spark = [[t[0], part_start, part_end, self._ds, rollup, t[1]]
+                             for t in avg_tiles
+                             for part_start, part_end, rollup in time_parts]
 
         self.log.info('Using {} partitions'.format(spark_nparts))
         rdd = self._sc.parallelize(nexus_tiles_spark, spark_nparts)
@@ -290,19 +295,14 @@ class VarianceSparkHandlerImpl(SparkHandler):
                             tile_min_lon, tile_max_lon,
                             y0, y1, x0, x1))
 
-        # Store global map in a NetCDF file.
-        self._create_nc_file(a, 'tam.nc', 'val', fill=self._fill)
+        lats = [self._ind2lat(y) for y in range(a.shape[0])]
+        lons = [self._ind2lon(x) for x in range(a.shape[1])]
 
-        # Create dict for JSON response
-        results = [[{'variance': a[y, x], 'cnt': int(n[y, x]),
-                     'lat': self._ind2lat(y), 'lon': self._ind2lon(x)}
-                    for x in range(a.shape[1])] for y in range(a.shape[0])]
-
-        return NexusResults(results=results, meta={}, stats=None,
-                            computeOptions=None, minLat=bbox.bounds[1],
-                            maxLat=bbox.bounds[3], minLon=bbox.bounds[0],
-                            maxLon=bbox.bounds[2], ds=ds, startTime=start_time,
-                            endTime=end_time)
+        return NexusGridResults(lats, lons, [('variance', a), ('cnt', n)], meta={}, stats=None,
+                                computeOptions=None, minLat=bbox.bounds[1],
+                                maxLat=bbox.bounds[3], minLon=bbox.bounds[0],
+                                maxLon=bbox.bounds[2], ds=ds, startTime=start_time,
+                                endTime=end_time)
 
     @staticmethod
     def _map(tile_in_spark):
@@ -313,7 +313,8 @@ class VarianceSparkHandlerImpl(SparkHandler):
         startTime = tile_in_spark[1]
         endTime = tile_in_spark[2]
         ds = tile_in_spark[3]
-        tile_service = NexusTileService()
+        rollup = tile_in_spark[4]
+        tile_service = get_tile_service()
 
         tile_inbounds_shape = (max_y - min_y + 1, max_x - min_x + 1)
 
@@ -325,21 +326,23 @@ class VarianceSparkHandlerImpl(SparkHandler):
         cnt_tile = np.array(np.zeros(tile_inbounds_shape, dtype=np.uint32))
         t_start = startTime
         while t_start <= endTime:
-            t_end = min(t_start + t_incr, endTime)
+            # A run of rollups holds one tile per period, it is read at once
+            t_end = min(t_start + t_incr, endTime) if rollup == DAY else endTime
 
             nexus_tiles = \
                 tile_service.get_tiles_bounded_by_box(min_lat, max_lat,
                                                       min_lon, max_lon,
                                                       ds=ds,
                                                       start_time=t_start,
-                                                      end_time=t_end)
+                                                      end_time=t_end,
+                                                      rollup=rollup,
+                                                      variables=ROLLUP_VARIABLES if rollup != DAY else [])
 
             for tile in nexus_tiles:
-                # Taking the data, converted masked nans to 0
-                tile.data.data[:, :] = np.nan_to_num(tile.data.data)
-                sum_tile += tile.data.data[0, min_y:max_y + 1, min_x:max_x + 1]
-                # Taking the opposite of the value of the bool of mask - add 0 if it's a masked value
-                cnt_tile += (~tile.data.mask[0, min_y:max_y + 1, min_x:max_x + 1]).astype(np.uint8)
+                # Sums of the values, masked values count 0, and number of valid values
+                tile_sums, tile_counts, _ = moments(tile)
+                sum_tile += tile_sums[0, min_y:max_y + 1, min_x:max_x + 1]
+                cnt_tile += tile_counts[0, min_y:max_y + 1, min_x:max_x + 1].astype(np.uint32)
             t_start = t_end + 1
 
         print("sum tile", sum_tile)
@@ -355,8 +358,9 @@ class VarianceSparkHandlerImpl(SparkHandler):
         startTime = tile_in_spark[1]
         endTime = tile_in_spark[2]
         ds = tile_in_spark[3]
-        x_bar = tile_in_spark[4]
-        tile_service = NexusTileService()
+        rollup = tile_in_spark[4]
+        x_bar = tile_in_spark[5]
+        tile_service = get_tile_service()
 
         tile_inbounds_shape = (max_y - min_y + 1, max_x - min_x + 1)
 
@@ -372,25 +376,33 @@ class VarianceSparkHandlerImpl(SparkHandler):
 
         t_start = startTime
         while t_start <= endTime:
-            t_end = min(t_start + t_incr, endTime)
+            # A run of rollups holds one tile per period, it is read at once
+            t_end = min(t_start + t_incr, endTime) if rollup == DAY else endTime
 
             nexus_tiles = \
                 tile_service.get_tiles_bounded_by_box(min_lat, max_lat,
                                                       min_lon, max_lon,
                                                       ds=ds,
                                                       start_time=t_start,
-                                                      end_time=t_end)
+                                                      end_time=t_end,
+                                                      rollup=rollup,
+                                                      variables=ROLLUP_VARIABLES if rollup != DAY else [])
 
             for tile in nexus_tiles:
-                # Taking the data, converted masked nans to 0
-                tile.data.data[:, :] = np.nan_to_num(tile.data.data)
-
-                # subtract x_bar from each value, then square it
-                data_anomaly_tile = tile.data.data[0, min_y:max_y + 1, min_x:max_x + 1] - x_bar
-                data_anomaly_squared_tile += data_anomaly_tile * data_anomaly_tile
+                tile_sums, tile_counts, tile_sums_sq = moments(tile)
+                tile_sums = tile_sums[0, min_y:max_y + 1, min_x:max_x + 1]
+                tile_counts = tile_counts[0, min_y:max_y + 1, min_x:max_x + 1]
+
+                if rollup == DAY:
+                    # subtract x_bar from each valid value, then square it
+                    data_anomaly_tile = np.where(tile_counts > 0, tile_sums - x_bar, 0.0)
+                    data_anomaly_squared_tile += data_anomaly_tile * data_anomaly_tile
+                else:
+                    # sum of (x - x_bar)^2 over the values of the period, from their moments
+                    tile_sums_sq = tile_sums_sq[0, min_y:max_y + 1, min_x:max_x + 1]
+                    data_anomaly_squared_tile += tile_sums_sq - 2 * x_bar * tile_sums + tile_counts * x_bar * x_bar
 
-                # Taking the opposite of the value of the bool of mask - add 0 if it's a masked value
-                cnt_tile += (~tile.data.mask[0, min_y:max_y + 1, min_x:max_x + 1]).astype(np.uint8)
+                cnt_tile += tile_counts.astype(np.uint32)
             t_start = t_end + 1
 
         return (min_lat, max_lat, min_lon, max_lon), (data_anomaly_squared_tile, cnt_tile)
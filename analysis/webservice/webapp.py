@@ -23,22 +23,38 @@ import traceback
 
 import matplotlib
 import pkg_resources
+import tornado.httpclient
+import tornado.httpserver
+import tornado.httputil
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 from tornado.options import define, options, parse_command_line
 
-from webservice import NexusHandler
+from webservice import HandlerManifest, NexusHandler
+from webservice.RequestScheduler import client_id, create_request_scheduler
+from webservice.ResultCache import create_result_cache, result_cache_key
+from webservice.SingleFlight import SingleFlight
 from webservice.webmodel import NexusRequestObject, NexusProcessingException
 
 matplotlib.use('Agg')
 
 
+def is_streamed(body):
+    return body is not None and not isinstance(body, basestring)
+
+
 class ContentTypes(object):
     CSV = "CSV"
     JSON = "JSON"
+    JSON_COLUMNAR = "JSON_COLUMNAR"
     XML = "XML"
     PNG = "PNG"
     NETCDF = "NETCDF"
     ZIP = "ZIP"
+    ARROW = "ARROW"
+    NPZ = "NPZ"
 
 
 class BaseHandler(tornado.web.RequestHandler):
@@ -47,11 +63,16 @@ class BaseHandler(tornado.web.RequestHandler):
     def initialize(self, thread_pool):
         self.logger = logging.getLogger('nexus')
         self.executor = thread_pool
+        self.io_loop = tornado.ioloop.IOLoop.current()
 
     @tornado.gen.coroutine
     def get(self):
         self.logger.info("Received request %s" % self._request_summary())
-        yield self.run()
+        try:
+            yield self.run()
+        except NexusProcessingException as e:
+            # Rejected by the request scheduler before run() started
+            self.async_onerror_callback(e.reason, e.code)
 
     @tornado.concurrent.run_on_executor
     def run(self):
@@ -67,6 +88,12 @@ class BaseHandler(tornado.web.RequestHandler):
     def async_onerror_callback(self, reason, code=500):
         self.logger.error("Error processing request", exc_info=True)
 
+        if self._headers_written:
+            # Part of a streamed response has been sent already; closing the connection is the only way left to
+            # tell the client it is incomplete
+            self.io_loop.add_callback(self.request.connection.close)
+            return
+
         self.set_header("Content-Type", "application/json")
         self.set_status(code)
 
@@ -94,62 +121,223 @@ class BaseHandler(tornado.web.RequestHandler):
 
 
 class ModularNexusHandlerWrapper(BaseHandler):
-    def initialize(self, thread_pool, clazz=None, algorithm_config=None, sc=None):
+    def initialize(self, thread_pool, clazz=None, algorithm_config=None, sc=None, result_cache=None,
+                   in_flight=None, request_queue=None):
+        if request_queue is not None:
+            thread_pool = request_queue.executor(client_id(self.request))
         BaseHandler.initialize(self, thread_pool)
         self.__algorithm_config = algorithm_config
         self.__clazz = clazz
         self.__sc = sc
+        self.__result_cache = result_cache
+        self.__in_flight = in_flight
+
+    @tornado.gen.coroutine
+    def get(self):
+        if not getattr(self.__clazz.clazz(), 'asynchronous', False):
+            yield super(ModularNexusHandlerWrapper, self).get()
+            return
+
+        self.logger.info("Received request %s" % self._request_summary())
+        try:
+            result = yield self.do_get_async(NexusRequestObject(self))
+            self.async_callback(result)
+        except NexusProcessingException as e:
+            self.async_onerror_callback(e.reason, e.code)
+        except Exception as e:
+            self.async_onerror_callback(str(e), 500)
+
+    @tornado.gen.coroutine
+    def do_get_async(self, request):
+        """
+        Coroutine counterpart of do_get for handlers whose calc runs on the IOLoop. Identical requests are not
+        coalesced here because waiting on SingleFlight would block the loop.
+        """
+        use_cache = self.__result_cache is not None and self.__result_cache.is_cacheable(self.request.path) \
+                    and not request.get_boolean_arg("nocached", default=False)
+
+        request_key = None
+        if use_cache:
+            request_key = result_cache_key(self.request.path, self.request.arguments)
+            entry = self.__result_cache.get(request_key)
+            if entry is not None:
+                self.logger.info("Serving cached result for %s" % self._request_summary())
+                self.write_response(entry['status'], entry['headers'], entry['body'])
+                raise tornado.gen.Return(None)
+
+        instance = self.__clazz.instance(algorithm_config=self.__algorithm_config, sc=self.__sc)
+
+        results = yield instance.calc(request)
+
+        try:
+            status = results.status_code
+        except AttributeError:
+            status = 200
+
+        # Serializing large results is CPU bound so keep it off the IOLoop
+        headers, body = yield self.executor.submit(self.serialize, request, results)
+
+        body = yield self.executor.submit(self.write_response, status, headers, body, use_cache)
+
+        if use_cache and status == 200 and body is not None:
+            self.__result_cache.put(request_key, status, headers, body)
+
+        raise tornado.gen.Return(results)
 
     def do_get(self, request):
+        use_cache = self.__result_cache is not None and self.__result_cache.is_cacheable(self.request.path) \
+                    and not request.get_boolean_arg("nocached", default=False)
+
+        request_key = None
+        if use_cache or self.__in_flight is not None:
+            request_key = result_cache_key(self.request.path, self.request.arguments)
+
+        if use_cache:
+            entry = self.__result_cache.get(request_key)
+            if entry is not None:
+                self.logger.info("Serving cached result for %s" % self._request_summary())
+                self.write_response(entry['status'], entry['headers'], entry['body'])
+                return None
+
+        shared = False
+        if self.__in_flight is not None:
+            # Identical requests arriving while this one computes share its serialized response
+            (results, status, headers, body), shared = self.__in_flight.do(request_key,
+                                                                          lambda: self.compute(request))
+            if shared:
+                self.logger.info("Sharing in-flight result for %s" % self._request_summary())
+                if is_streamed(body):
+                    # The leader consumes its own chunk generator, so serialize the shared results again
+                    headers, body = self.serialize(request, results)
+                results = None
+        else:
+            results, status, headers, body = self.compute(request)
+
+        body = self.write_response(status, headers, body, collect=use_cache and not shared)
+
+        if use_cache and not shared and status == 200 and body is not None:
+            self.__result_cache.put(request_key, status, headers, body)
+
+        return results
+
+    def compute(self, request):
+        """
+        Run the algorithm and serialize its results.
+        :return: (results, status code, list of (header name, value), response body)
+        """
         instance = self.__clazz.instance(algorithm_config=self.__algorithm_config, sc=self.__sc)
 
         results = instance.calc(request)
 
         try:
-            self.set_status(results.status_code)
+            status = results.status_code
         except AttributeError:
-            pass
-
+            status = 200
+
+        headers, body = self.serialize(request, results)
+        return results, status, headers, body
+
+    def write_response(self, status, headers, body, collect=False):
+        """
+        Write the response. A streamed body is sent chunk by chunk with chunked transfer encoding.
+        :param collect: join a streamed body so that it can be cached
+        :return: the response body as a string
+        """
+        self.set_status(status)
+        for name, value in headers:
+            self.set_header(name, value)
+
+        if not is_streamed(body):
+            if body is not None:
+                self.write(body)
+            return body
+
+        sent = [] if collect else None
+        for chunk in body:
+            self.write_chunk(chunk)
+            if collect:
+                sent.append(chunk)
+
+        return ''.join(sent) if collect else None
+
+    def write_chunk(self, chunk):
+        """
+        Write and flush a chunk from a request thread, waiting until it has been handed to the socket so that
+        slow clients hold back serialization instead of letting it buffer.
+        """
+        flushed = tornado.concurrent.futures.Future()
+
+        def write_and_flush():
+            self.write(chunk)
+            tornado.concurrent.chain_future(self.flush(), flushed)
+
+        self.io_loop.add_callback(write_and_flush)
+        flushed.result()
+
+    def serialize(self, request, results):
+        """
+        Render results in the requested output format.
+        :return: (list of (header name, value), response body)
+        """
         if request.get_content_type() == ContentTypes.JSON:
-            self.set_header("Content-Type", "application/json")
+            if hasattr(results, 'toJsonChunks'):
+                return [("Content-Type", "application/json")], results.toJsonChunks()
             try:
-                self.write(results.toJson())
+                return [("Content-Type", "application/json")], results.toJson()
             except AttributeError:
                 traceback.print_exc(file=sys.stdout)
-                self.write(json.dumps(results, indent=4))
+                return [("Content-Type", "application/json")], json.dumps(results, indent=4)
+        elif request.get_content_type() == ContentTypes.JSON_COLUMNAR:
+            if not hasattr(results, 'toJsonColumnar'):
+                raise NexusProcessingException(reason="Columnar JSON output is not available for this result type.",
+                                               code=400)
+            return [("Content-Type", "application/json")], results.toJsonColumnar()
         elif request.get_content_type() == ContentTypes.PNG:
-            self.set_header("Content-Type", "image/png")
             try:
-                self.write(results.toImage())
+                return [("Content-Type", "image/png")], results.toImage()
             except AttributeError:
                 traceback.print_exc(file=sys.stdout)
                 raise NexusProcessingException(reason="Unable to convert results to an Image.")
         elif request.get_content_type() == ContentTypes.CSV:
-            self.set_header("Content-Type", "text/csv")
-            self.set_header("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.csv"))
+            headers = [("Content-Type", "text/csv"),
+                       ("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.csv"))]
+            if hasattr(results, 'toCSVChunks'):
+                return headers, results.toCSVChunks()
             try:
-                self.write(results.toCSV())
+                return headers, results.toCSV()
             except:
                 traceback.print_exc(file=sys.stdout)
                 raise NexusProcessingException(reason="Unable to convert results to CSV.")
         elif request.get_content_type() == ContentTypes.NETCDF:
-            self.set_header("Content-Type", "application/x-netcdf")
-            self.set_header("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.nc"))
+            headers = [("Content-Type", "application/x-netcdf"),
+                       ("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.nc"))]
             try:
-                self.write(results.toNetCDF())
+                return headers, results.toNetCDF()
             except:
                 traceback.print_exc(file=sys.stdout)
                 raise NexusProcessingException(reason="Unable to convert results to NetCDF.")
+        elif request.get_content_type() == ContentTypes.ARROW:
+            if not hasattr(results, 'toArrow'):
+                raise NexusProcessingException(reason="Arrow output is not available for this result type.", code=400)
+            headers = [("Content-Type", "application/vnd.apache.arrow.stream"),
+                       ("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.arrow"))]
+            return headers, results.toArrow()
+        elif request.get_content_type() == ContentTypes.NPZ:
+            if not hasattr(results, 'toNpz'):
+                raise NexusProcessingException(reason="NPZ output is not available for this result type.", code=400)
+            headers = [("Content-Type", "application/octet-stream"),
+                       ("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.npz"))]
+            return headers, results.toNpz()
         elif request.get_content_type() == ContentTypes.ZIP:
-            self.set_header("Content-Type", "application/zip")
-            self.set_header("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.zip"))
+            headers = [("Content-Type", "application/zip"),
+                       ("Content-Disposition", "filename=\"%s\"" % request.get_argument('filename', "download.zip"))]
             try:
-                self.write(results.toZip())
+                return headers, results.toZip()
             except:
                 traceback.print_exc(file=sys.stdout)
                 raise NexusProcessingException(reason="Unable to convert results to Zip.")
 
-        return results
+        return [], None
 
     def async_callback(self, result):
         super(ModularNexusHandlerWrapper, self).async_callback(result)
@@ -157,6 +345,59 @@ class ModularNexusHandlerWrapper(BaseHandler):
             result.cleanup()
 
 
+class SparkProxyHandler(tornado.web.RequestHandler):
+    """
+    Forwards a request for a Spark handler to the process that owns the SparkContext. Used by the workers of a
+    pre-forked webapp, which do not run Spark themselves.
+    """
+    relayed_headers = frozenset(['content-type', 'content-disposition'])
+
+    def initialize(self, spark_url, http_client, request_timeout):
+        self.logger = logging.getLogger('nexus')
+        self.spark_url = spark_url
+        self.http_client = http_client
+        self.request_timeout = request_timeout
+
+    @tornado.gen.coroutine
+    def get(self):
+        self.logger.info("Forwarding request %s to the Spark process" % self._request_summary())
+        # The connect timeout also bounds the time a request waits for one of the client's max_clients connections,
+        # so a request queued behind busy Spark requests waits as long as it may run instead of failing after 20 s
+        # Pass the client on so the Spark process schedules the request as the client's rather than this worker's
+        forwarded_for = ', '.join(address for address in (self.request.headers.get("X-Forwarded-For"),
+                                                          self.request.remote_ip) if address)
+        response = yield self.http_client.fetch(self.spark_url + self.request.uri,
+                                                headers={"X-Forwarded-For": forwarded_for},
+                                                connect_timeout=self.request_timeout,
+                                                request_timeout=self.request_timeout,
+                                                header_callback=self._relay_header,
+                                                streaming_callback=self._relay_chunk, raise_error=False)
+
+        if response.error is not None and response.code == 599:
+            self.logger.error("Error forwarding request to the Spark process: %s" % response.error)
+            if self._headers_written:
+                # Part of the response has been relayed already; closing the connection is the only way left to tell
+                # the client it is incomplete
+                self.request.connection.close()
+                return
+
+            self.set_header("Content-Type", "application/json")
+            self.set_status(502)
+            self.write(json.dumps({"error": "Spark process unavailable", "code": 502}, indent=5))
+
+    def _relay_header(self, line):
+        if line.startswith("HTTP/"):
+            self.set_status(tornado.httputil.parse_response_start_line(line.strip()).code)
+        elif ':' in line:
+            name, value = line.split(':', 1)
+            if name.strip().lower() in self.relayed_headers:
+                self.set_header(name.strip(), value.strip())
+
+    def _relay_chunk(self, chunk):
+        self.write(chunk)
+        self.flush()
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.DEBUG,
@@ -174,12 +415,19 @@ if __name__ == "__main__":
     define("debug", default=False, help="run in debug mode")
     define("port", default=webconfig.get("global", "server.socket_port"), help="run on the given port", type=int)
     define("address", default=webconfig.get("global", "server.socket_host"), help="Bind to the given address")
+    define("handler_manifest",
+           default=webconfig.get("modules", "manifest") if webconfig.has_option("modules", "manifest") else "",
+           help="Register handlers from this manifest and load each one on its first request")
     parse_command_line()
 
-    moduleDirs = webconfig.get("modules", "module_dirs").split(",")
-    for moduleDir in moduleDirs:
-        log.info("Loading modules from %s" % moduleDir)
-        importlib.import_module(moduleDir)
+    if options.handler_manifest:
+        log.info("Registering algorithm modules from %s" % options.handler_manifest)
+        HandlerManifest.load_manifest(HandlerManifest.read_manifest(options.handler_manifest))
+    else:
+        moduleDirs = webconfig.get("modules", "module_dirs").split(",")
+        for moduleDir in moduleDirs:
+            log.info("Loading modules from %s" % moduleDir)
+            importlib.import_module(moduleDir)
 
     staticDir = webconfig.get("static", "static_dir")
     staticEnabled = webconfig.get("static", "static_enabled") == "true"
@@ -197,13 +445,79 @@ if __name__ == "__main__":
     log.info("Running Nexus Initializers")
     NexusHandler.executeInitializers(algorithm_config)
 
+    spark_handlers = [clazzWrapper for clazzWrapper in NexusHandler.AVAILABLE_HANDLERS if clazzWrapper.is_spark()]
+
+    num_processes = webconfig.getint("global", "server.num_processes") \
+        if webconfig.has_option("global", "server.num_processes") else 1
+    if num_processes <= 0:
+        num_processes = tornado.process.cpu_count()
+
+    # A single process serves every handler itself
+    is_worker = False
+    is_spark_driver = False
+    if num_processes > 1:
+        if options.debug:
+            log.warning("Debug mode reloads the code in place and is ignored when running multiple processes")
+            options.debug = False
+
+        # Bind before forking so that every worker accepts from the same socket. Spark handlers are served by one
+        # extra process that owns the SparkContext, listening on a local port the workers forward to.
+        sockets = tornado.netutil.bind_sockets(options.port, address=options.address)
+        spark_sockets = []
+        if spark_handlers:
+            spark_port = webconfig.getint("global", "server.spark_driver_port")
+            spark_sockets = tornado.netutil.bind_sockets(spark_port, address="127.0.0.1")
+
+        log.info("Forking %s worker processes" % num_processes)
+        task_id = tornado.process.fork_processes(num_processes + (1 if spark_handlers else 0))
+
+        is_spark_driver = bool(spark_handlers) and task_id == 0
+        is_worker = not is_spark_driver
+        for sock in (sockets if is_spark_driver else spark_sockets):
+            sock.close()
+        if is_spark_driver:
+            sockets = spark_sockets
+            log.info("Process %s runs the Spark handlers" % task_id)
+
+    # Everything below is per process, created after the fork
+
     max_request_threads = webconfig.getint("global", "server.max_simultaneous_requests")
     log.info("Initializing request ThreadPool to %s" % max_request_threads)
     request_thread_pool = tornado.concurrent.futures.ThreadPoolExecutor(max_request_threads)
 
+    request_scheduler = create_request_scheduler(webconfig)
+    if request_scheduler is not None:
+        log.info("Scheduling requests in cost classes %s" % ', '.join(sorted(request_scheduler.queues)))
+
+    def request_queue(clazzWrapper):
+        if request_scheduler is None:
+            return None
+        return request_scheduler.queue_for(clazzWrapper.path(), spark=clazzWrapper.is_spark())
+
+    in_flight = None
+    if not webconfig.has_option("global", "server.coalesce_requests") or webconfig.getboolean(
+            "global", "server.coalesce_requests"):
+        log.info("Coalescing identical in-flight requests")
+        in_flight = SingleFlight()
+
+    result_cache = create_result_cache(webconfig)
+    if result_cache is not None:
+        log.info("Caching results of %s" % (', '.join(sorted(result_cache.paths)) if result_cache.paths else "all handlers"))
+
+    spark_proxy_client = None
+    if is_worker and spark_handlers:
+        spark_proxy_client = tornado.httpclient.AsyncHTTPClient(max_clients=max_request_threads)
+        spark_proxy_timeout = webconfig.getint("global", "server.spark_driver_timeout") \
+            if webconfig.has_option("global", "server.spark_driver_timeout") else 3600
+
     spark_context = None
     for clazzWrapper in NexusHandler.AVAILABLE_HANDLERS:
-        if issubclass(clazzWrapper.clazz(), NexusHandler.SparkHandler):
+        if clazzWrapper in spark_handlers and is_worker:
+            handlers.append(
+                (clazzWrapper.path(), SparkProxyHandler,
+                 dict(spark_url="http://127.0.0.1:%s" % spark_port, http_client=spark_proxy_client,
+                      request_timeout=spark_proxy_timeout)))
+        elif clazzWrapper in spark_handlers:
             if spark_context is None:
                 from pyspark import SparkConf
                 from pyspark.sql import SparkSession
@@ -214,11 +528,13 @@ if __name__ == "__main__":
             handlers.append(
                 (clazzWrapper.path(), ModularNexusHandlerWrapper,
                  dict(clazz=clazzWrapper, algorithm_config=algorithm_config, sc=spark_context,
-                      thread_pool=request_thread_pool)))
-        else:
+                      thread_pool=request_thread_pool, result_cache=result_cache, in_flight=in_flight,
+                      request_queue=request_queue(clazzWrapper))))
+        elif not is_spark_driver:
             handlers.append(
                 (clazzWrapper.path(), ModularNexusHandlerWrapper,
-                 dict(clazz=clazzWrapper, algorithm_config=algorithm_config, thread_pool=request_thread_pool)))
+                 dict(clazz=clazzWrapper, algorithm_config=algorithm_config, thread_pool=request_thread_pool,
+                      result_cache=result_cache, in_flight=in_flight, request_queue=request_queue(clazzWrapper))))
 
 
     class VersionHandler(tornado.web.RequestHandler):
@@ -228,6 +544,15 @@ if __name__ == "__main__":
 
     handlers.append((r"/version", VersionHandler))
 
+    if request_scheduler is not None:
+        class SchedulerStatsHandler(tornado.web.RequestHandler):
+            def get(self):
+                self.set_header("Content-Type", "application/json")
+                self.write(json.dumps(request_scheduler.stats(), indent=4))
+
+
+        handlers.append((r"/schedulerStats", SchedulerStatsHandler))
+
     if staticEnabled:
         handlers.append(
             (r'/(.*)', tornado.web.StaticFileHandler, {'path': staticDir, "default_filename": "index.html"}))
@@ -237,7 +562,11 @@ if __name__ == "__main__":
         default_host=options.address,
         debug=options.debug
     )
-    app.listen(options.port)
+    if num_processes > 1:
+        server = tornado.httpserver.HTTPServer(app)
+        server.add_sockets(sockets)
+    else:
+        app.listen(options.port)
 
     log.info("Starting HTTP listener...")
     tornado.ioloop.IOLoop.current().start()
@@ -17,7 +17,10 @@
 import hashlib
 import inspect
 import json
+import os
 import re
+import StringIO
+import tempfile
 import time
 from datetime import datetime
 from decimal import Decimal
@@ -25,6 +28,12 @@ from decimal import Decimal
 import numpy as np
 from pytz import UTC, timezone
 from shapely.geometry import Polygon
+from tornado.concurrent import is_future
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
@@ -439,6 +448,144 @@ class NexusResults:
         raise Exception("Not implemented for this result type")
 
 
+class NexusGridResults(NexusResults):
+    """
+    Results on a regular lat/lon grid. Every variable is a 2D array indexed [lat, lon] and is only expanded into the
+    per-cell dicts of results() when a format needs them.
+    """
+
+    def __init__(self, lats, lons, variables, meta=None, stats=None, computeOptions=None, status_code=200, **args):
+        """
+        :param lats: 1D array of the grid latitudes
+        :param lons: 1D array of the grid longitudes
+        :param variables: list of (name, 2D array) pairs, in output order
+        """
+        NexusResults.__init__(self, results=None, meta=meta, stats=stats, computeOptions=computeOptions,
+                              status_code=status_code, **args)
+        self.lats = np.asarray(lats)
+        self.lons = np.asarray(lons)
+        self.variables = variables
+        self.__results = None
+
+    def results(self):
+        if self.__results is None:
+            self.__results = [[dict([(name, values[y, x]) for name, values in self.variables],
+                                    lat=self.lats[y], lon=self.lons[x])
+                               for x in range(len(self.lons))] for y in range(len(self.lats))]
+        return self.__results
+
+    def toJson(self):
+        data = {
+            'meta': self.meta(),
+            'data': self.results(),
+            'stats': self.stats()
+        }
+        return json.dumps(data, indent=4, cls=CustomEncoder)
+
+    def toJsonColumnar(self):
+        """
+        Compact JSON: the lat and lon vectors plus one flat, row-major value array per variable. Masked and NaN
+        values are written as null.
+        """
+        data = {
+            'meta': self.meta(),
+            'stats': self.stats(),
+            'shape': [len(self.lats), len(self.lons)],
+            'lat': self.lats.tolist(),
+            'lon': self.lons.tolist(),
+            'data': dict((name, _json_column(values)) for name, values in self.variables)
+        }
+        # Everything large is a plain list by now so the C encoder does the work
+        return json.dumps(data, cls=CustomEncoder)
+
+    def toNetCDF(self):
+        """
+        NetCDF4 file with lat and lon dimensions and one variable per grid variable. netCDF4 can only write to a
+        path, so the file goes through a temporary file that is removed once read.
+        """
+        from netCDF4 import Dataset
+
+        fd, path = tempfile.mkstemp(prefix="nexus_", suffix=".nc")
+        os.close(fd)
+        try:
+            rootgrp = Dataset(path, "w", format="NETCDF4")
+            try:
+                rootgrp.createDimension("lat", len(self.lats))
+                rootgrp.createDimension("lon", len(self.lons))
+                lats = rootgrp.createVariable("lat", "f4", dimensions=("lat",))
+                lons = rootgrp.createVariable("lon", "f4", dimensions=("lon",))
+                lats[:] = self.lats
+                lons[:] = self.lons
+                lats.units = "degrees north"
+                lons.units = "degrees east"
+                for name, values in self.variables:
+                    datatype = "f4" if values.dtype.kind == 'f' else values.dtype
+                    variable = rootgrp.createVariable(name, datatype, dimensions=("lat", "lon",))
+                    variable[:, :] = values
+            finally:
+                rootgrp.close()
+
+            with open(path, 'rb') as nc_file:
+                return nc_file.read()
+        finally:
+            os.remove(path)
+
+    def toArrow(self):
+        """
+        Arrow IPC stream with one row per grid cell: lat, lon and then the grid variables. Masked and NaN values
+        are null.
+        """
+        if pyarrow is None:
+            raise NexusProcessingException(reason="Arrow output requires pyarrow to be installed", code=501)
+
+        lons, lats = np.meshgrid(self.lons, self.lats)
+        columns = [pyarrow.array(lats.ravel()), pyarrow.array(lons.ravel())]
+        for name, values in self.variables:
+            values = np.ma.ravel(values)
+            if values.dtype.kind == 'f':
+                values = np.ma.masked_invalid(values)
+            columns.append(pyarrow.array(np.ma.getdata(values), mask=np.ma.getmaskarray(values)))
+
+        batch = pyarrow.RecordBatch.from_arrays(columns, ['lat', 'lon'] + [name for name, _ in self.variables])
+        sink = pyarrow.BufferOutputStream()
+        writer = pyarrow.RecordBatchStreamWriter(sink, batch.schema)
+        writer.write_batch(batch)
+        writer.close()
+        return sink.getvalue().to_pybytes()
+
+    def toNpz(self):
+        """
+        numpy .npz archive holding the lat and lon vectors and each grid variable as a 2D array. Masked variables
+        also get a boolean <name>_mask array.
+        """
+        arrays = {'lat': self.lats, 'lon': self.lons}
+        for name, values in self.variables:
+            arrays[name] = np.ma.getdata(values)
+            if np.ma.is_masked(values):
+                arrays[name + '_mask'] = np.ma.getmaskarray(values)
+
+        npz_file = StringIO.StringIO()
+        try:
+            np.savez(npz_file, **arrays)
+            return npz_file.getvalue()
+        finally:
+            npz_file.close()
+
+
+def _json_column(values):
+    values = np.ma.ravel(values)
+    if values.dtype.kind == 'f':
+        values = np.ma.masked_invalid(values)
+
+    mask = np.ma.getmaskarray(values)
+    if not mask.any():
+        return np.ma.getdata(values).tolist()
+
+    column = np.ma.getdata(values).astype(object)
+    column[mask] = None
+    return column.tolist()
+
+
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         """If input object is an ndarray it will be converted into a dict
@@ -483,6 +630,34 @@ class CustomEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def join_chunks(pieces, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Group an iterable of small strings into chunks of at least chunk_size bytes (the last one may be shorter).
+    """
+    buffered = []
+    buffered_size = 0
+    for piece in pieces:
+        buffered.append(piece)
+        buffered_size += len(piece)
+        if buffered_size >= chunk_size:
+            yield ''.join(buffered)
+            buffered = []
+            buffered_size = 0
+
+    if buffered:
+        yield ''.join(buffered)
+
+
+def json_chunks(obj, cls=CustomEncoder, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encode obj as json.dumps(obj, indent=4, cls=cls) would, but yield the document in chunks as it is encoded.
+    """
+    return join_chunks(cls(indent=4).iterencode(obj), chunk_size=chunk_size)
+
+
 __CACHE = {}
 
 
@@ -513,6 +688,17 @@ def cached(ttl=60000):
                     "result": result
                 }
 
+                if is_future(result):
+                    # Coroutine handlers return a future; do not keep serving it if it fails
+                    def _evict_failed(future, entry=__CACHE[hash]):
+                        if future.exception() is not None and __CACHE.get(hash) is entry:
+                            del __CACHE[hash]
+
+                    if result.done():
+                        _evict_failed(result)
+                    else:
+                        result.add_done_callback(_evict_failed)
+
             return __CACHE[hash]["result"]
 
         return func_wrapper
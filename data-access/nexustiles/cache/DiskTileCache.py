@@ -0,0 +1,197 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+CACHE_LOCK = Lock()
+DISK_TILE_CACHES = {}
+
+ARRAY_NAMES = ['latitudes', 'longitudes', 'times', 'data']
+META_PREFIX = 'meta.'
+MASK_SUFFIX = '.mask'
+
+
+def get_disk_tile_cache(path, max_bytes):
+    """
+    Return the process-wide disk tile cache rooted at path, creating it on first use.
+    :param path: Local directory to store decoded tiles in
+    :param max_bytes: Maximum number of bytes of tile files to keep on disk
+    :return: DiskTileCache
+    """
+    with CACHE_LOCK:
+        if path not in DISK_TILE_CACHES:
+            DISK_TILE_CACHES[path] = DiskTileCache(path, max_bytes)
+
+        return DISK_TILE_CACHES[path]
+
+
+def _save_array(directory, name, array):
+    nbytes = 0
+    with open(os.path.join(directory, name + '.npy'), 'wb') as f:
+        np.save(f, np.ma.getdata(array))
+        nbytes += f.tell()
+    if np.ma.isMaskedArray(array):
+        with open(os.path.join(directory, name + MASK_SUFFIX + '.npy'), 'wb') as f:
+            np.save(f, np.ma.getmaskarray(array))
+            nbytes += f.tell()
+    return nbytes
+
+
+def _load_array(directory, name):
+    # Copy-on-write mapping: pages are read lazily from the file and any in-place change stays private to the caller
+    data = np.load(os.path.join(directory, name + '.npy'), mmap_mode='c')
+    mask_file = os.path.join(directory, name + MASK_SUFFIX + '.npy')
+    if os.path.exists(mask_file):
+        return np.ma.masked_array(data, mask=np.load(mask_file, mmap_mode='c'))
+    return data
+
+
+def _directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+
+class DiskTileCache(object):
+    """
+    LRU cache of decoded tiles stored as .npy files in a local directory, one sub-directory per tile id. Reads are
+    memory mapped so that repeat requests for a tile on the same host skip both the network and protobuf decoding.
+
+    The directory may be shared by several processes (e.g. the python workers of a Spark executor). Each process keeps
+    its own LRU index, seeded from the directory modification times when the cache is opened, and a tile removed by
+    another process is simply treated as a miss.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.log = logging.getLogger(__name__)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self.__load_index()
+
+    def __load_index(self):
+        existing = []
+        for tile_id in os.listdir(self.path):
+            tile_dir = os.path.join(self.path, tile_id)
+            if tile_id.startswith('.') or not os.path.isdir(tile_dir):
+                continue
+            try:
+                existing.append((os.path.getmtime(tile_dir), tile_id, _directory_size(tile_dir)))
+            except OSError:
+                pass
+
+        for _, tile_id, nbytes in sorted(existing):
+            self.__entries[tile_id] = nbytes
+            self.current_bytes += nbytes
+
+        self.__evict()
+
+    def __tile_dir(self, tile_id):
+        return os.path.join(self.path, tile_id)
+
+    def __evict(self):
+        while self.current_bytes > self.max_bytes and len(self.__entries) > 0:
+            tile_id, nbytes = self.__entries.popitem(last=False)
+            shutil.rmtree(self.__tile_dir(tile_id), ignore_errors=True)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    def get(self, tile_id):
+        tile_dir = self.__tile_dir(tile_id)
+        try:
+            lats, lons, times, data = [_load_array(tile_dir, name) for name in ARRAY_NAMES]
+            meta = {}
+            for file_name in os.listdir(tile_dir):
+                if file_name.startswith(META_PREFIX) and not file_name.endswith(MASK_SUFFIX + '.npy'):
+                    name = file_name[:-len('.npy')]
+                    meta[name[len(META_PREFIX):]] = _load_array(tile_dir, name)
+            # Touch the directory so the LRU order survives process restarts
+            os.utime(tile_dir, None)
+        except (IOError, OSError, ValueError):
+            with self.__lock:
+                self.misses += 1
+                if tile_id in self.__entries:
+                    self.current_bytes -= self.__entries.pop(tile_id)
+            return None
+
+        with self.__lock:
+            self.hits += 1
+            if tile_id in self.__entries:
+                self.__entries[tile_id] = self.__entries.pop(tile_id)
+
+        return lats, lons, times, data, meta
+
+    def put(self, tile_id, entry):
+        # Every meta data array is written (and therefore decoded) so later requests can read any of them
+        lats, lons, times, data, meta = entry
+        tile_dir = self.__tile_dir(tile_id)
+        if os.path.isdir(tile_dir):
+            return
+
+        # Write into a temporary directory then rename it into place so readers never see a partial tile
+        tmp_dir = tempfile.mkdtemp(prefix='.%s.' % tile_id, dir=self.path)
+        try:
+            nbytes = 0
+            for name, array in zip(ARRAY_NAMES, [lats, lons, times, data]):
+                nbytes += _save_array(tmp_dir, name, array)
+            for name, array in meta.iteritems():
+                nbytes += _save_array(tmp_dir, META_PREFIX + name, array)
+            os.rename(tmp_dir, tile_dir)
+        except (IOError, OSError) as e:
+            # Another process may have written the same tile first; a full disk should not fail the request either
+            self.log.debug("Unable to write tile %s to disk cache: %s" % (tile_id, e))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self.__lock:
+            self.__entries[tile_id] = nbytes
+            self.current_bytes += nbytes
+            self.__evict()
+
+    def __contains__(self, tile_id):
+        return tile_id in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'entries': len(self.__entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
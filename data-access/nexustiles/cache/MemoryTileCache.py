@@ -0,0 +1,140 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+from nexustiles.model.nexusmodel import LazyMetaData
+
+CACHE_LOCK = Lock()
+MEMORY_TILE_CACHE = None
+
+
+def get_memory_tile_cache(max_bytes):
+    """
+    Return the process-wide memory tile cache, creating it on first use. Subsequent calls return the same cache
+    regardless of max_bytes so that every NexusTileService in the process (and every Spark task run by a reused
+    python worker) shares one bounded cache.
+    :param max_bytes: Maximum number of bytes of decoded tile arrays to keep in memory
+    :return: MemoryTileCache
+    """
+    global MEMORY_TILE_CACHE
+    with CACHE_LOCK:
+        if MEMORY_TILE_CACHE is None:
+            MEMORY_TILE_CACHE = MemoryTileCache(max_bytes)
+
+        return MEMORY_TILE_CACHE
+
+
+def _array_nbytes(array):
+    nbytes = array.nbytes
+    mask = np.ma.getmask(array)
+    if mask is not np.ma.nomask:
+        nbytes += mask.nbytes
+    return nbytes
+
+
+def entry_nbytes(entry):
+    lats, lons, times, data, meta = entry
+    nbytes = sum(_array_nbytes(a) for a in [lats, lons, times, data])
+    if isinstance(meta, LazyMetaData):
+        return nbytes + meta.nbytes
+    return nbytes + sum(_array_nbytes(a) for a in meta.values())
+
+
+def copy_entry(entry):
+    lats, lons, times, data, meta = entry
+    if isinstance(meta, LazyMetaData):
+        # Lazy meta data is shared in encoded form, every copy decodes (into new arrays) on first access
+        meta = meta.copy()
+    else:
+        meta = {name: a.copy() for name, a in meta.iteritems()}
+    return lats.copy(), lons.copy(), times.copy(), data.copy(), meta
+
+
+class MemoryTileCache(object):
+    """
+    Thread safe LRU cache of decoded tiles keyed by tile id. Each entry is the (latitudes, longitudes, times, data,
+    meta_data) tuple returned by NexusTileData.get_lat_lon_time_data_meta.
+
+    Tiles never change once ingested so entries do not expire. Arrays are copied on the way in and on the way out so
+    callers are free to modify the arrays they receive without corrupting the cache.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, tile_id):
+        with self.__lock:
+            try:
+                entry, nbytes = self.__entries.pop(tile_id)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # Re-insert to mark the entry as most recently used
+            self.__entries[tile_id] = (entry, nbytes)
+            self.hits += 1
+
+        return copy_entry(entry)
+
+    def put(self, tile_id, entry):
+        nbytes = entry_nbytes(entry)
+        if nbytes > self.max_bytes:
+            return
+
+        entry = copy_entry(entry)
+        with self.__lock:
+            if tile_id in self.__entries:
+                self.current_bytes -= self.__entries.pop(tile_id)[1]
+
+            self.__entries[tile_id] = (entry, nbytes)
+            self.current_bytes += nbytes
+
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.__entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, tile_id):
+        return tile_id in self.__entries
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'entries': len(self.__entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,176 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+from ConfigParser import NoOptionError
+
+import pysolr
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+
+from SolrProxy import SolrProxy
+
+
+class AsyncSolrProxy(SolrProxy):
+    """
+    SolrProxy whose queries run on the Tornado IOLoop through an AsyncHTTPClient instead of blocking a thread.
+
+    do_query_raw, do_query and do_query_all are coroutines, so every SolrProxy method that only builds a query and
+    returns the do_query_all result (find_all_tiles_in_box_sorttimeasc, find_all_tiles_in_polygon,
+    find_all_tiles_by_metadata, ...) returns a Future as well. The methods that post-process a response are overridden
+    below as coroutines. Other SolrProxy methods must not be used on this class. Streaming and columnar queries are not
+    supported.
+    """
+
+    def __init__(self, config):
+        SolrProxy.__init__(self, config)
+
+        try:
+            self.max_clients = config.getint("solr", "pool_size")
+        except NoOptionError:
+            self.max_clients = 16
+
+        self.__http_client = None
+
+    @property
+    def http_client(self):
+        # Created on first use so that it binds to the IOLoop the queries run on
+        if self.__http_client is None:
+            self.__http_client = AsyncHTTPClient(force_instance=True, max_clients=self.max_clients)
+        return self.__http_client
+
+    @gen.coroutine
+    def do_query_raw(self, *args, **params):
+
+        self._prepare_query_params(args, params)
+        params['q'] = args[0]
+        params['wt'] = 'json'
+
+        connect_timeout, request_timeout = self.solrcon.timeout
+        response = yield self.http_client.fetch('%s/select' % self.solrcon.url, method='POST',
+                                                body=pysolr.safe_urlencode(params, True),
+                                                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                                connect_timeout=connect_timeout, request_timeout=request_timeout)
+
+        raise gen.Return(self.solrcon.results_cls(self.solrcon.decoder.decode(response.body)))
+
+    @gen.coroutine
+    def do_query(self, *args, **params):
+
+        response = yield self.do_query_raw(*args, **params)
+
+        raise gen.Return((response.docs, response.raw_response['response']['start'], response.hits))
+
+    @gen.coroutine
+    def do_query_all(self, *args, **params):
+        if params.pop('stream', False) or params.pop('columnar', False):
+            raise ValueError("Streaming and columnar queries are not supported by AsyncSolrProxy")
+
+        params.pop('start', None)
+        params['sort'] = self._cursor_sort(args, params)
+        limit = params.get('limit', float('inf'))
+
+        results = []
+        cursor_mark = '*'
+        while len(results) < limit:
+            params['cursorMark'] = cursor_mark
+            response = yield self.do_query_raw(*args, **params)
+
+            results.extend(response.docs[:int(min(len(response.docs), limit - len(results)))])
+
+            # Stop on a short page or once every hit has been read, see SolrProxy._do_query_pages_by_cursor
+            if len(response.docs) < int(params.get('rows', 0)) or len(results) >= response.hits:
+                break
+            if response.nextCursorMark is None or response.nextCursorMark == cursor_mark:
+                break
+            cursor_mark = response.nextCursorMark
+
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def find_tile_by_id(self, tile_id):
+
+        results, start, found = yield self.do_query(*('id:%s' % tile_id, None, None, True, None), rows=1, level=None,
+                                                    rollup=None)
+
+        assert len(results) == 1, "Found %s results, expected exactly 1" % len(results)
+        raise gen.Return([results[0]])
+
+    @gen.coroutine
+    def find_tiles_by_id(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._tiles_by_id_query(tile_ids, ds, **kwargs)
+
+        results = yield self.do_query_all(*args, **additionalparams)
+
+        raise gen.Return(self._check_tiles_by_id(results, tile_ids, additionalparams))
+
+    @gen.coroutine
+    def find_min_date_from_tiles(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._date_from_tiles_query(tile_ids, ds, 'tile_min_time_dt', 'asc', **kwargs)
+
+        results, start, found = yield self.do_query(*args, **additionalparams)
+
+        raise gen.Return(self.convert_iso_to_datetime(results[0]['tile_min_time_dt']))
+
+    @gen.coroutine
+    def find_max_date_from_tiles(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._date_from_tiles_query(tile_ids, ds, 'tile_max_time_dt', 'desc', **kwargs)
+
+        results, start, found = yield self.do_query(*args, **additionalparams)
+
+        raise gen.Return(self.convert_iso_to_datetime(results[0]['tile_max_time_dt']))
+
+    @gen.coroutine
+    def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
+        args, additionalparams = self._days_in_range_query(min_lat, max_lat, min_lon, max_lon, ds, start_time,
+                                                           end_time, **kwargs)
+
+        response = yield self.do_query_raw(*args, **additionalparams)
+
+        raise gen.Return(self._parse_days_in_range(response))
+
+    @gen.coroutine
+    def get_data_series_list_simple(self):
+        args, params = self._data_series_list_query()
+
+        response = yield self.do_query_raw(*args, **params)
+
+        raise gen.Return(self._parse_data_series_list(response))
+
+    @gen.coroutine
+    def get_data_series_list(self):
+
+        datasets = yield self.get_data_series_list_simple()
+
+        # The min and max date queries of every dataset run concurrently
+        min_dates, max_dates = yield [
+            [self.find_min_date_from_tiles([], ds=dataset['title']) for dataset in datasets],
+            [self.find_max_date_from_tiles([], ds=dataset['title']) for dataset in datasets]
+        ]
+        for dataset, min_date, max_date in zip(datasets, min_dates, max_dates):
+            self._set_data_series_dates(dataset, min_date, max_date)
+
+        raise gen.Return(datasets)
+
+    @gen.coroutine
+    def ping(self):
+        solrAdminPing = 'http://%s/solr/%s/admin/ping?wt=json' % (self.solrUrl, self.solrCore)
+        try:
+            response = yield self.http_client.fetch(solrAdminPing)
+            results = json.loads(response.body)
+        except Exception:
+            results = None
+
+        raise gen.Return(results)
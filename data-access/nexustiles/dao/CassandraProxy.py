@@ -18,12 +18,14 @@ from ConfigParser import NoOptionError
 from multiprocessing.synchronize import Lock
 
 import nexusproto.DataTile_pb2 as nexusproto
-import numpy as np
+from cassandra.concurrent import execute_concurrent_with_args
 from cassandra.cqlengine import columns, connection, CQLEngineException
 from cassandra.cqlengine.models import Model
 from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
 from nexusproto.serialization import from_shaped_array
 
+from TileDecoder import decode_lat_lon_time_data_meta
+
 INIT_LOCK = Lock()
 
 
@@ -49,102 +51,8 @@ class NexusTileData(Model):
 
         return from_shaped_array(the_tile_data.variable_data)
 
-    def get_lat_lon_time_data_meta(self):
-        if self._get_nexus_tile().HasField('grid_tile'):
-            grid_tile = self._get_nexus_tile().grid_tile
-
-            grid_tile_data = np.ma.masked_invalid(from_shaped_array(grid_tile.variable_data))
-            latitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.latitude))
-            longitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.longitude))
-
-            if len(grid_tile_data.shape) == 2:
-                grid_tile_data = grid_tile_data[np.newaxis, :]
-
-            # Extract the meta data
-            meta_data = {}
-            for meta_data_obj in grid_tile.meta_data:
-                name = meta_data_obj.name
-                meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-                if len(meta_array.shape) == 2:
-                    meta_array = meta_array[np.newaxis, :]
-                meta_data[name] = meta_array
-
-            return latitude_data, longitude_data, np.array([grid_tile.time]), grid_tile_data, meta_data
-        elif self._get_nexus_tile().HasField('swath_tile'):
-            swath_tile = self._get_nexus_tile().swath_tile
-
-            latitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.latitude)).reshape(-1)
-            longitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.longitude)).reshape(-1)
-            time_data = np.ma.masked_invalid(from_shaped_array(swath_tile.time)).reshape(-1)
-
-            # Simplify the tile if the time dimension is the same value repeated
-            if np.all(time_data == np.min(time_data)):
-                time_data = np.array([np.min(time_data)])
-
-            swath_tile_data = np.ma.masked_invalid(from_shaped_array(swath_tile.variable_data))
-
-            tile_data = self._to_standard_index(swath_tile_data,
-                                                (len(time_data), len(latitude_data), len(longitude_data)))
-
-            # Extract the meta data
-            meta_data = {}
-            for meta_data_obj in swath_tile.meta_data:
-                name = meta_data_obj.name
-                actual_meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-                reshaped_meta_array = self._to_standard_index(actual_meta_array, tile_data.shape)
-                meta_data[name] = reshaped_meta_array
-
-            return latitude_data, longitude_data, time_data, tile_data, meta_data
-        elif self._get_nexus_tile().HasField('time_series_tile'):
-            time_series_tile = self._get_nexus_tile().time_series_tile
-
-            time_series_tile_data = np.ma.masked_invalid(from_shaped_array(time_series_tile.variable_data))
-            time_data = np.ma.masked_invalid(from_shaped_array(time_series_tile.time)).reshape(-1)
-            latitude_data = np.ma.masked_invalid(from_shaped_array(time_series_tile.latitude))
-            longitude_data = np.ma.masked_invalid(from_shaped_array(time_series_tile.longitude))
-
-            reshaped_array = np.ma.masked_all((len(time_data), len(latitude_data), len(longitude_data)))
-            idx = np.arange(len(latitude_data))
-            reshaped_array[:, idx, idx] = time_series_tile_data
-            tile_data = reshaped_array
-            # Extract the meta data
-            meta_data = {}
-            for meta_data_obj in time_series_tile.meta_data:
-                name = meta_data_obj.name
-                meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-
-                reshaped_meta_array = np.ma.masked_all((len(time_data), len(latitude_data), len(longitude_data)))
-                idx = np.arange(len(latitude_data))
-                reshaped_meta_array[:, idx, idx] = meta_array
-
-                meta_data[name] = reshaped_meta_array
-
-            return latitude_data, longitude_data, time_data, tile_data, meta_data
-        else:
-            raise NotImplementedError("Only supports grid_tile, swath_tile, and time_series_tile")
-
-    @staticmethod
-    def _to_standard_index(data_array, desired_shape):
-
-        if desired_shape[0] == 1:
-            reshaped_array = np.ma.masked_all((desired_shape[1], desired_shape[2]))
-            row, col = np.indices(data_array.shape)
-
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
-            reshaped_array = reshaped_array[np.newaxis, :]
-        else:
-            reshaped_array = np.ma.masked_all(desired_shape)
-            row, col = np.indices(data_array.shape)
-
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
-
-        return reshaped_array
+    def get_lat_lon_time_data_meta(self, sparse=False):
+        return decode_lat_lon_time_data_meta(self._get_nexus_tile(), sparse=sparse)
 
 
 class CassandraProxy(object):
@@ -158,6 +66,13 @@ class CassandraProxy(object):
             self.__cass_port = config.getint("cassandra", "port")
         except NoOptionError:
             self.__cass_port = 9042
+        try:
+            self.__cass_fetch_concurrency = config.getint("cassandra", "fetch_concurrency")
+        except NoOptionError:
+            self.__cass_fetch_concurrency = 100
+
+        self.__fetch_statement = None
+        self.__save_statement = None
 
         with INIT_LOCK:
             try:
@@ -173,14 +88,75 @@ class CassandraProxy(object):
                          protocol_version=self.__cass_protocol_version, load_balancing_policy=token_policy,
                          port=self.__cass_port)
 
+    def __get_fetch_statement(self, session):
+        if self.__fetch_statement is None:
+            self.__fetch_statement = session.prepare(
+                "SELECT tile_id, tile_blob FROM %s WHERE tile_id=?" % NexusTileData.column_family_name())
+
+        return self.__fetch_statement
+
+    def __get_save_statement(self, session):
+        if self.__save_statement is None:
+            self.__save_statement = session.prepare(
+                "INSERT INTO %s (tile_id, tile_blob) VALUES (?, ?)" % NexusTileData.column_family_name())
+
+        return self.__save_statement
+
+    @property
+    def fetch_concurrency(self):
+        return self.__cass_fetch_concurrency
+
     def fetch_nexus_tiles(self, *tile_ids):
-        tile_ids = [uuid.UUID(str(tile_id)) for tile_id in tile_ids if
-                    (isinstance(tile_id, str) or isinstance(tile_id, unicode))]
+        tile_ids = self.__to_uuids(tile_ids)
+
+        if len(tile_ids) == 0:
+            return []
+
+        session = connection.get_session()
+        statement = self.__get_fetch_statement(session)
+
+        # One prepared, token-aware query per tile with up to fetch_concurrency requests in flight at once
+        results = execute_concurrent_with_args(session, statement, [(tile_id,) for tile_id in tile_ids],
+                                               concurrency=self.__cass_fetch_concurrency,
+                                               raise_on_first_error=True)
 
         res = []
-        for tile_id in tile_ids:
-            filterResults = NexusTileData.objects.filter(tile_id=tile_id)
-            if len(filterResults) > 0:
-                res.append(filterResults[0])
+        for success, rows in results:
+            res.extend(self.tile_data_from_rows(rows))
 
         return res
+
+    def save_nexus_tiles(self, blobs_by_id):
+        """
+        Store serialized nexusproto TileData messages, overwriting tiles with the same id.
+        :param blobs_by_id: dict of tile id to serialized TileData
+        """
+        session = connection.get_session()
+        statement = self.__get_save_statement(session)
+
+        execute_concurrent_with_args(session, statement,
+                                     [(uuid.UUID(str(tile_id)), blob) for tile_id, blob in
+                                      blobs_by_id.iteritems()],
+                                     concurrency=self.__cass_fetch_concurrency, raise_on_first_error=True)
+
+    def start_fetch_nexus_tiles(self, *tile_ids):
+        """
+        Start fetching the given tiles without waiting for them. The caller is responsible for bounding the number of
+        requests in flight (see fetch_concurrency).
+        :return: One cassandra.cluster.ResponseFuture per valid tile id, its rows can be turned into NexusTileData
+        with tile_data_from_rows
+        """
+        session = connection.get_session()
+        statement = self.__get_fetch_statement(session)
+
+        return [session.execute_async(statement, (tile_id,)) for tile_id in self.__to_uuids(tile_ids)]
+
+    @staticmethod
+    def tile_data_from_rows(rows):
+        row = next(iter(rows), None)
+        return [NexusTileData(tile_id=row['tile_id'], tile_blob=row['tile_blob'])] if row is not None else []
+
+    @staticmethod
+    def __to_uuids(tile_ids):
+        return [uuid.UUID(str(tile_id)) for tile_id in tile_ids if
+                (isinstance(tile_id, str) or isinstance(tile_id, unicode))]
@@ -13,11 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 import uuid
+from ConfigParser import NoOptionError
+
 import nexusproto.DataTile_pb2 as nexusproto
 from nexusproto.serialization import from_shaped_array
-import numpy as np
 import boto3
+from botocore.config import Config
+
+from FetchPool import fetch_all
+from TileDecoder import decode_lat_lon_time_data_meta
+
+# Maximum number of keys DynamoDB accepts in a single BatchGetItem request
+BATCH_GET_MAX_KEYS = 100
 
 class NexusTileData(object):
     __nexus_tile = None
@@ -45,77 +54,8 @@ class NexusTileData(object):
 
         return from_shaped_array(the_tile_data.variable_data)
 
-    def get_lat_lon_time_data_meta(self):
-        if self._get_nexus_tile().HasField('grid_tile'):
-            grid_tile = self._get_nexus_tile().grid_tile
-
-            grid_tile_data = np.ma.masked_invalid(from_shaped_array(grid_tile.variable_data))
-            latitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.latitude))
-            longitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.longitude))
-
-            if len(grid_tile_data.shape) == 2:
-                grid_tile_data = grid_tile_data[np.newaxis, :]
-
-            # Extract the meta data
-            meta_data = {}
-            for meta_data_obj in grid_tile.meta_data:
-                name = meta_data_obj.name
-                meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-                if len(meta_array.shape) == 2:
-                    meta_array = meta_array[np.newaxis, :]
-                meta_data[name] = meta_array
-
-            return latitude_data, longitude_data, np.array([grid_tile.time]), grid_tile_data, meta_data
-        elif self._get_nexus_tile().HasField('swath_tile'):
-            swath_tile = self._get_nexus_tile().swath_tile
-
-            latitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.latitude)).reshape(-1)
-            longitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.longitude)).reshape(-1)
-            time_data = np.ma.masked_invalid(from_shaped_array(swath_tile.time)).reshape(-1)
-
-            # Simplify the tile if the time dimension is the same value repeated
-            if np.all(time_data == np.min(time_data)):
-                time_data = np.array([np.min(time_data)])
-
-            swath_tile_data = np.ma.masked_invalid(from_shaped_array(swath_tile.variable_data))
-
-            tile_data = self._to_standard_index(swath_tile_data,
-                                                (len(time_data), len(latitude_data), len(longitude_data)))
-
-            # Extract the meta data
-            meta_data = {}
-            for meta_data_obj in swath_tile.meta_data:
-                name = meta_data_obj.name
-                actual_meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-                reshaped_meta_array = self._to_standard_index(actual_meta_array, tile_data.shape)
-                meta_data[name] = reshaped_meta_array
-
-            return latitude_data, longitude_data, time_data, tile_data, meta_data
-        else:
-            raise NotImplementedError("Only supports grid_tile and swath_tile")
-
-    @staticmethod
-    def _to_standard_index(data_array, desired_shape):
-
-        if desired_shape[0] == 1:
-            reshaped_array = np.ma.masked_all((desired_shape[1], desired_shape[2]))
-            row, col = np.indices(data_array.shape)
-
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
-            reshaped_array = reshaped_array[np.newaxis, :]
-        else:
-            reshaped_array = np.ma.masked_all(desired_shape)
-            row, col = np.indices(data_array.shape)
-
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
-
-        return reshaped_array
+    def get_lat_lon_time_data_meta(self, sparse=False):
+        return decode_lat_lon_time_data_meta(self._get_nexus_tile(), sparse=sparse)
 
 
 class DynamoProxy(object):
@@ -123,24 +63,65 @@ class DynamoProxy(object):
         self.config = config
         self.__dynamo_tablename = config.get("dynamo", "table")
         self.__dynamo_region = config.get("dynamo", "region")
-        self.__dynamo = boto3.resource('dynamodb', region_name=self.__dynamo_region)
-        self.__dynamo_table = self.__dynamo.Table(self.__dynamo_tablename)
+        try:
+            self.__fetch_workers = config.getint("dynamo", "fetch_workers")
+        except NoOptionError:
+            self.__fetch_workers = 8
+        try:
+            self.__max_retries = config.getint("dynamo", "max_retries")
+        except NoOptionError:
+            self.__max_retries = 8
+        self.__dynamo = boto3.client('dynamodb', region_name=self.__dynamo_region,
+                                     config=Config(max_pool_connections=self.__fetch_workers))
         self.__nexus_tile = None
 
+    def __batch_get_tiles(self, tile_ids):
+        keys = [{'tile_id': {'S': tile_id}} for tile_id in tile_ids]
+        res = []
+        attempt = 0
+        while len(keys) > 0:
+            response = self.__dynamo.batch_get_item(
+                RequestItems={
+                    self.__dynamo_tablename: {
+                        'Keys': keys
+                    }
+                }
+            )
+            for item in response['Responses'].get(self.__dynamo_tablename, []):
+                res.append(NexusTileData(item['data']['B'], item['tile_id']['S']))
+
+            keys = response.get('UnprocessedKeys', {}).get(self.__dynamo_tablename, {}).get('Keys', [])
+            if len(keys) > 0:
+                attempt += 1
+                if attempt > self.__max_retries:
+                    raise Exception("Unable to fetch %d tile(s) from %s after %d retries"
+                                    % (len(keys), self.__dynamo_tablename, self.__max_retries))
+                # Unprocessed keys mean the table is throttling us; back off exponentially before retrying
+                time.sleep(min(0.05 * 2 ** attempt, 5))
+
+        return res
+
+    def __save_nexus_tile(self, item):
+        tile_id, blob = item
+        self.__dynamo.put_item(TableName=self.__dynamo_tablename,
+                               Item={'tile_id': {'S': str(uuid.UUID(str(tile_id)))}, 'data': {'B': blob}})
+
+    def save_nexus_tiles(self, blobs_by_id):
+        """
+        Store serialized nexusproto TileData messages, overwriting tiles with the same id.
+        :param blobs_by_id: dict of tile id to serialized TileData
+        """
+        fetch_all(self.__save_nexus_tile, list(blobs_by_id.iteritems()), self.__fetch_workers)
+
     def fetch_nexus_tiles(self, *tile_ids):
 
-        tile_ids = [uuid.UUID(str(tile_id)) for tile_id in tile_ids if
+        tile_ids = [str(uuid.UUID(str(tile_id))) for tile_id in tile_ids if
                     (isinstance(tile_id, str) or isinstance(tile_id, unicode))]
+
+        batches = [tile_ids[i:i + BATCH_GET_MAX_KEYS] for i in xrange(0, len(tile_ids), BATCH_GET_MAX_KEYS)]
+
         res = []
-        for tile_id in tile_ids:
-            response = self.__dynamo_table.get_item(
-                Key = {
-                    'tile_id': str(tile_id)
-                }
-            )
-            item = response['Item']
-            data = item['data'].__str__()
-            nexus_tile = NexusTileData(data, str(tile_id))
-            res.append(nexus_tile)
+        for batch_tiles in fetch_all(self.__batch_get_tiles, batches, self.__fetch_workers):
+            res.extend(batch_tiles)
 
-        return res
\ No newline at end of file
+        return res
@@ -0,0 +1,46 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+POOL_LOCK = Lock()
+FETCH_POOLS = {}
+
+
+def get_fetch_pool(workers):
+    """
+    Return the process-wide thread pool with the given number of workers, creating it on first use. Pools are shared
+    so that short-lived proxies do not each start (and leak) their own threads.
+    :param workers: Number of worker threads in the pool
+    :return: multiprocessing.pool.ThreadPool
+    """
+    with POOL_LOCK:
+        if workers not in FETCH_POOLS:
+            FETCH_POOLS[workers] = ThreadPool(workers)
+
+        return FETCH_POOLS[workers]
+
+
+def fetch_all(fetch_func, items, workers):
+    """
+    Apply fetch_func to every item using at most `workers` threads. Results are returned in the order of items.
+    """
+    if len(items) == 0:
+        return []
+    if workers <= 1 or len(items) == 1:
+        return [fetch_func(item) for item in items]
+
+    return get_fetch_pool(workers).map(fetch_func, items)
@@ -15,22 +15,68 @@
 
 import json
 import logging
+import re
 import threading
 import time
 from datetime import datetime
 from pytz import timezone, UTC
 
+import numpy as np
 import requests
 import pysolr
+from ConfigParser import NoOptionError
+from requests.adapters import HTTPAdapter
 from shapely import wkt
 
-SOLR_CON_LOCK = threading.Lock()
-thread_local = threading.local()
+SESSION_LOCK = threading.Lock()
+SOLR_SESSIONS = {}
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 ISO_8601 = '%Y-%m-%dT%H:%M:%S%z'
 
+# Matches the id and error entries of a streaming expression response without decoding the whole body
+EXPORT_ID_PATTERN = re.compile(r'"id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+EXPORT_EXCEPTION_PATTERN = re.compile(r'"EXCEPTION"\s*:\s*"((?:[^"\\]|\\.)*)"')
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Numeric fields whose names carry no dynamic field type suffix
+COLUMNAR_FLOAT_FIELDS = {'tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon'}
+
+# Overview tiles (see nexustiles.pyramid) are indexed with their level in this field, full resolution tiles have none
+LEVEL_FIELD = 'level_i'
+
+# Temporal rollup tiles (see nexustiles.rollup) are indexed with their period ('month' or 'year') in this field, the
+# original daily tiles have none and are the ones queried by default, with rollup=DAILY (nexustiles.rollup.DAY)
+ROLLUP_FIELD = 'rollup_s'
+DAILY = 'day'
+
+# Fields holding the partial statistics of a tile, in the order of the TileAggregates fields
+TILE_AGGREGATE_FIELDS = ('tile_weighted_sum_d', 'tile_weight_sum_d', 'tile_sum_d', 'tile_sum_sq_d',
+                         'tile_min_val_d', 'tile_max_val_d', 'tile_count_i')
+
+
+def get_solr_session(url, pool_size):
+    """
+    Return the process-wide requests.Session used for the Solr at url, creating it on first use. The session keeps up
+    to pool_size keep-alive connections and blocks callers when they are all in use, so every thread can query Solr
+    concurrently without opening an unbounded number of sockets.
+    :param url: Solr core URL
+    :param pool_size: Maximum number of connections to Solr
+    :return: requests.Session
+    """
+    with SESSION_LOCK:
+        key = (url, pool_size)
+        if key not in SOLR_SESSIONS:
+            session = requests.Session()
+            session.stream = False
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            SOLR_SESSIONS[key] = session
+
+        return SOLR_SESSIONS[key]
+
 
 class SolrProxy(object):
     def __init__(self, config):
@@ -38,20 +84,36 @@ class SolrProxy(object):
         self.solrCore = config.get("solr", "core")
         self.logger = logging.getLogger('nexus')
 
-        with SOLR_CON_LOCK:
-            solrcon = getattr(thread_local, 'solrcon', None)
-            if solrcon is None:
-                solrcon = pysolr.Solr('http://%s/solr/%s' % (self.solrUrl, self.solrCore))
-                thread_local.solrcon = solrcon
+        try:
+            pool_size = config.getint("solr", "pool_size")
+        except NoOptionError:
+            pool_size = 16
+        try:
+            connect_timeout = config.getfloat("solr", "connect_timeout")
+        except NoOptionError:
+            connect_timeout = 10
+        try:
+            read_timeout = config.getfloat("solr", "read_timeout")
+        except NoOptionError:
+            read_timeout = 60
+        try:
+            self.unique_key = config.get("solr", "unique_key")
+        except NoOptionError:
+            self.unique_key = 'solr_id_s'
 
-            self.solrcon = solrcon
+        url = 'http://%s/solr/%s' % (self.solrUrl, self.solrCore)
+        # pysolr.Solr keeps no per-request state, so one instance over a pooled session is shared by all threads
+        self.solrcon = pysolr.Solr(url, timeout=(connect_timeout, read_timeout))
+        self.solrcon.session = get_solr_session(url, pool_size)
 
     def find_tile_by_id(self, tile_id):
 
         search = 'id:%s' % tile_id
 
         params = {
-            'rows': 1
+            'rows': 1,
+            'level': None,
+            'rollup': None
         }
 
         results, start, found = self.do_query(*(search, None, None, True, None), **params)
@@ -60,6 +122,16 @@ class SolrProxy(object):
         return [results[0]]
 
     def find_tiles_by_id(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._tiles_by_id_query(tile_ids, ds, **kwargs)
+
+        results = self.do_query_all(*args, **additionalparams)
+
+        if additionalparams.get('stream', False):
+            return results
+
+        return self._check_tiles_by_id(results, tile_ids, additionalparams)
+
+    def _tiles_by_id_query(self, tile_ids, ds=None, **kwargs):
 
         if ds is not None:
             search = 'dataset_s:%s' % ds
@@ -69,39 +141,132 @@ class SolrProxy(object):
         additionalparams = {
             'fq': [
                 "{!terms f=id}%s" % ','.join(tile_ids)
-            ]
+            ],
+            'level': None,
+            'rollup': None
         }
 
         self._merge_kwargs(additionalparams, **kwargs)
 
-        results = self.do_query_all(*(search, None, None, False, None), **additionalparams)
+        return (search, None, None, False, None), additionalparams
 
-        assert len(results) == len(tile_ids), "Found %s results, expected exactly %s" % (len(results), len(tile_ids))
+    @staticmethod
+    def _check_tiles_by_id(results, tile_ids, additionalparams):
+        found = len(next(results.itervalues())) if additionalparams.get('columnar', False) else len(results)
+        assert found == len(tile_ids), "Found %s results, expected exactly %s" % (found, len(tile_ids))
         return results
 
-    def find_min_date_from_tiles(self, tile_ids, ds=None, **kwargs):
+    def update_tile_aggregates(self, aggregates_by_id, ds=None, commit=False):
+        """
+        Store the partial statistics of existing tiles with atomic updates, leaving their other fields untouched.
+        :param aggregates_by_id: dict of tile id to TileAggregates (or any sequence in TILE_AGGREGATE_FIELDS order)
+        :param ds: The dataset name of the tiles, if known
+        :param commit: Whether to commit after the update, also when there is nothing to update
+        """
+        if not aggregates_by_id:
+            if commit:
+                self.solrcon.commit()
+            return
+
+        docs = self.find_tiles_by_id(list(aggregates_by_id.keys()), ds=ds, fl=['id', self.unique_key],
+                                     rows=len(aggregates_by_id))
+
+        updates = []
+        for doc in docs:
+            update = {self.unique_key: doc[self.unique_key]}
+            for field, value in zip(TILE_AGGREGATE_FIELDS, aggregates_by_id[doc['id']]):
+                # Tiles without valid values have no min or max
+                if not (isinstance(value, float) and np.isnan(value)):
+                    update[field] = value
+            updates.append(update)
+
+        self.solrcon.add(updates, fieldUpdates=dict((field, 'set') for field in TILE_AGGREGATE_FIELDS), commit=commit)
+
+    def find_overview_levels(self, ds):
+        """
+        :return: dict of overview level to its cell size in degrees, for the levels built for ds
+        """
+        params = {
+            'rows': 0,
+            'fq': '%s:[1 TO *]' % LEVEL_FIELD,
+            'level': None,
+            'json.facet': json.dumps({
+                'levels': {
+                    'type': 'terms',
+                    'field': LEVEL_FIELD,
+                    'limit': -1,
+                    'facet': {'cell_size': 'min(tile_cell_size_d)'}
+                }
+            })
+        }
 
-        if ds is not None:
-            search = 'dataset_s:%s' % ds
-        else:
-            search = '*:*'
+        response = self.do_query_raw(*('dataset_s:%s' % ds, None, None, False, None), **params)
 
-        kwargs['rows'] = 1
-        kwargs['fl'] = 'tile_min_time_dt'
-        kwargs['sort'] = ['tile_min_time_dt asc']
-        additionalparams = {
-            'fq': [
-                "{!terms f=id}%s" % ','.join(tile_ids) if len(tile_ids) > 0 else ''
-            ]
+        buckets = response.raw_response.get('facets', {}).get('levels', {}).get('buckets', [])
+        return dict((bucket['val'], bucket['cell_size']) for bucket in buckets)
+
+    def find_rollup_periods(self, ds):
+        """
+        :return: dict of rollup ('month' or 'year') to the set of period start times, in seconds since EPOCH, built
+                 for ds
+        """
+        params = {
+            'rows': 0,
+            'fq': '%s:[* TO *]' % ROLLUP_FIELD,
+            'rollup': None,
+            'json.facet': json.dumps({
+                'rollups': {
+                    'type': 'terms',
+                    'field': ROLLUP_FIELD,
+                    'limit': -1,
+                    'facet': {
+                        'periods': {
+                            'type': 'terms',
+                            'field': 'tile_min_time_dt',
+                            'limit': -1
+                        }
+                    }
+                }
+            })
         }
 
-        self._merge_kwargs(additionalparams, **kwargs)
+        response = self.do_query_raw(*('dataset_s:%s' % ds, None, None, False, None), **params)
 
-        results, start, found = self.do_query(*(search, None, None, True, None), **additionalparams)
+        buckets = response.raw_response.get('facets', {}).get('rollups', {}).get('buckets', [])
+        return dict((bucket['val'], set(long((datetime.strptime(period['val'], SOLR_FORMAT) -
+                                              datetime.utcfromtimestamp(0)).total_seconds())
+                                         for period in bucket['periods']['buckets']))
+                    for bucket in buckets)
+
+    def add_tiles(self, solr_docs, commit=False):
+        """
+        Index new tiles, e.g. overview tiles built by nexustiles.pyramid or rollup tiles built by nexustiles.rollup.
+        Docs without the unique key get the compositeId '<dataset>!<id>' so that they are routed to the shard of their
+        dataset.
+        """
+        for doc in solr_docs:
+            doc.setdefault(self.unique_key, '%s!%s' % (doc['dataset_s'], doc['id']))
+
+        if solr_docs:
+            self.solrcon.add(solr_docs, commit=commit)
+        elif commit:
+            self.solrcon.commit()
+
+    def find_min_date_from_tiles(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._date_from_tiles_query(tile_ids, ds, 'tile_min_time_dt', 'asc', **kwargs)
+
+        results, start, found = self.do_query(*args, **additionalparams)
 
         return self.convert_iso_to_datetime(results[0]['tile_min_time_dt'])
 
     def find_max_date_from_tiles(self, tile_ids, ds=None, **kwargs):
+        args, additionalparams = self._date_from_tiles_query(tile_ids, ds, 'tile_max_time_dt', 'desc', **kwargs)
+
+        results, start, found = self.do_query(*args, **additionalparams)
+
+        return self.convert_iso_to_datetime(results[0]['tile_max_time_dt'])
+
+    def _date_from_tiles_query(self, tile_ids, ds, field, order, **kwargs):
 
         if ds is not None:
             search = 'dataset_s:%s' % ds
@@ -109,19 +274,19 @@ class SolrProxy(object):
             search = '*:*'
 
         kwargs['rows'] = 1
-        kwargs['fl'] = 'tile_max_time_dt'
-        kwargs['sort'] = ['tile_max_time_dt desc']
+        kwargs['fl'] = field
+        kwargs['sort'] = ['%s %s' % (field, order)]
         additionalparams = {
             'fq': [
                 "{!terms f=id}%s" % ','.join(tile_ids) if len(tile_ids) > 0 else ''
-            ]
+            ],
+            'level': None,
+            'rollup': None
         }
 
         self._merge_kwargs(additionalparams, **kwargs)
 
-        results, start, found = self.do_query(*(search, None, None, True, None), **additionalparams)
-
-        return self.convert_iso_to_datetime(results[0]['tile_max_time_dt'])
+        return (search, None, None, True, None), additionalparams
 
     def find_min_max_date_from_granule(self, ds, granule_name, **kwargs):
         search = 'dataset_s:%s' % ds
@@ -160,14 +325,26 @@ class SolrProxy(object):
         for dataset in datasets:
             min_date = self.find_min_date_from_tiles([], ds=dataset['title'])
             max_date = self.find_max_date_from_tiles([], ds=dataset['title'])
-            dataset['start'] = (min_date - EPOCH).total_seconds()
-            dataset['end'] = (max_date - EPOCH).total_seconds()
-            dataset['iso_start'] = min_date.strftime(ISO_8601)
-            dataset['iso_end'] = max_date.strftime(ISO_8601)
+            self._set_data_series_dates(dataset, min_date, max_date)
 
         return datasets
 
+    @staticmethod
+    def _set_data_series_dates(dataset, min_date, max_date):
+        dataset['start'] = (min_date - EPOCH).total_seconds()
+        dataset['end'] = (max_date - EPOCH).total_seconds()
+        dataset['iso_start'] = min_date.strftime(ISO_8601)
+        dataset['iso_end'] = max_date.strftime(ISO_8601)
+
     def get_data_series_list_simple(self):
+        args, params = self._data_series_list_query()
+
+        response = self.do_query_raw(*args, **params)
+
+        return self._parse_data_series_list(response)
+
+    @staticmethod
+    def _data_series_list_query():
         search = "*:*"
         params = {
             'rows': 0,
@@ -177,7 +354,10 @@ class SolrProxy(object):
             "facet.limit": "-1"
         }
 
-        response = self.do_query_raw(*(search, None, None, False, None), **params)
+        return (search, None, None, False, None), params
+
+    @staticmethod
+    def _parse_data_series_list(response):
         l = []
         for g, v in zip(*[iter(response.facets["facet_fields"]["dataset_s"])]*2):
             l.append({
@@ -239,6 +419,14 @@ class SolrProxy(object):
         return [results[0]]
 
     def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
+        args, additionalparams = self._days_in_range_query(min_lat, max_lat, min_lon, max_lon, ds, start_time,
+                                                           end_time, **kwargs)
+
+        response = self.do_query_raw(*args, **additionalparams)
+
+        return self._parse_days_in_range(response)
+
+    def _days_in_range_query(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
 
         search = 'dataset_s:%s' % ds
 
@@ -261,8 +449,10 @@ class SolrProxy(object):
 
         self._merge_kwargs(additionalparams, **kwargs)
 
-        response = self.do_query_raw(*(search, None, None, False, None), **additionalparams)
+        return (search, None, None, False, None), additionalparams
 
+    @staticmethod
+    def _parse_days_in_range(response):
         daysinrangeasc = sorted(
             [(datetime.strptime(a_date, SOLR_FORMAT) - datetime.utcfromtimestamp(0)).total_seconds() for a_date
              in response.facets['facet_fields']['tile_min_time_dt'][::2]])
@@ -366,6 +556,84 @@ class SolrProxy(object):
             *(search, None, None, False, None),
             **additionalparams)
 
+    def export_tile_ids(self, bounding_polygon, ds, start_time=0, end_time=-1, **kwargs):
+        """
+        Generator over the ids of every tile in ds intersecting bounding_polygon within the time range. Ids are read
+        from Solr's /export handler through a streaming expression, which sorts on docValues and streams results
+        across all shards, so memory use does not grow with the number of tiles.
+        :param sort: Optional list of sort clauses on docValues fields, defaults to 'id asc'
+        """
+        search = 'dataset_s:%s' % ds
+
+        fq = [
+            "{!field f=geo}Intersects(%s)" % bounding_polygon.wkt,
+            "tile_count_i:[1 TO *]"
+        ]
+
+        if 0 < start_time <= end_time:
+            search_start_s = datetime.utcfromtimestamp(start_time).strftime(SOLR_FORMAT)
+            search_end_s = datetime.utcfromtimestamp(end_time).strftime(SOLR_FORMAT)
+
+            time_clause = "(" \
+                          "tile_min_time_dt:[%s TO %s] " \
+                          "OR tile_max_time_dt:[%s TO %s] " \
+                          "OR (tile_min_time_dt:[* TO %s] AND tile_max_time_dt:[%s TO *])" \
+                          ")" % (
+                              search_start_s, search_end_s,
+                              search_start_s, search_end_s,
+                              search_start_s, search_end_s
+                          )
+            fq.append(time_clause)
+
+        try:
+            fq.extend(kwargs['fq'] if isinstance(kwargs['fq'], list) else list(kwargs['fq']))
+        except KeyError:
+            pass
+
+        fq.extend(self._tile_kind_clauses(kwargs.get('level', 0), kwargs.get('rollup', DAILY)))
+
+        sort = kwargs.get('sort', None) or ['id asc']
+        if isinstance(sort, basestring):
+            sort = [sort]
+
+        return self.do_export_ids(search, fq, ', '.join(sort))
+
+    def do_export_ids(self, search, fq, sort):
+        """
+        Stream the ids matching search and the filter queries in sort order. The response is scanned for ids chunk by
+        chunk instead of being decoded as a whole.
+        """
+        expression = 'search(%s, q=%s, %s fl="id", sort=%s, qt="/export")' % (
+            self.solrCore, self._quote_expression_param(search),
+            ''.join('fq=%s, ' % self._quote_expression_param(query) for query in fq),
+            self._quote_expression_param(sort))
+
+        response = self.solrcon.get_session().post('%s/stream' % self.solrcon.url, data={'expr': expression},
+                                                   stream=True, timeout=self.solrcon.timeout)
+        try:
+            response.raise_for_status()
+
+            remainder = ''
+            for chunk in response.iter_content(chunk_size=EXPORT_CHUNK_SIZE):
+                remainder += chunk
+                consumed = 0
+                for match in EXPORT_ID_PATTERN.finditer(remainder):
+                    yield json.loads('"%s"' % match.group(1))
+                    consumed = match.end()
+
+                error = EXPORT_EXCEPTION_PATTERN.search(remainder)
+                if error is not None:
+                    raise pysolr.SolrError("Tile id export failed: %s" % json.loads('"%s"' % error.group(1)))
+
+                # Keep the tail, it may hold the start of an id split across chunks
+                remainder = remainder[consumed:]
+        finally:
+            response.close()
+
+    @staticmethod
+    def _quote_expression_param(value):
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
     def find_distinct_bounding_boxes_in_polygon(self, bounding_polygon, ds, start_time=0, end_time=-1, **kwargs):
 
         search = 'dataset_s:%s' % ds
@@ -618,9 +886,25 @@ class SolrProxy(object):
 
     def do_query_raw(self, *args, **params):
 
+        self._prepare_query_params(args, params)
+
+        response = self.solrcon.search(args[0], **params)
+
+        return response
+
+    @classmethod
+    def _prepare_query_params(cls, args, params):
+
         if 'fl' not in params.keys() and args[1]:
             params['fl'] = args[1]
 
+        # Every query is restricted to full resolution daily tiles unless it asks for an overview level or a rollup
+        # period, or for any of them with level=None and rollup=None
+        tile_kind_clauses = cls._tile_kind_clauses(params.pop('level', 0), params.pop('rollup', DAILY))
+        if tile_kind_clauses:
+            fq = params.get('fq', [])
+            params['fq'] = (fq if isinstance(fq, list) else [fq]) + tile_kind_clauses
+
         if 'sort' not in params.keys() and args[4]:
             params['sort'] = args[4]
 
@@ -630,28 +914,139 @@ class SolrProxy(object):
             ds = args[0].split(':')[-1]
             params['shard_keys'] = ds + '!'
 
-        with SOLR_CON_LOCK:
-            response = self.solrcon.search(args[0], **params)
-
-        return response
+    @staticmethod
+    def _tile_kind_clauses(level, rollup):
+        clauses = []
+        if level == 0:
+            clauses.append('-%s:[1 TO *]' % LEVEL_FIELD)
+        elif level is not None:
+            clauses.append('%s:%d' % (LEVEL_FIELD, level))
+
+        if rollup == DAILY:
+            clauses.append('-%s:[* TO *]' % ROLLUP_FIELD)
+        elif rollup is not None:
+            clauses.append('%s:%s' % (ROLLUP_FIELD, rollup))
+        return clauses
 
     def do_query_all(self, *args, **params):
+        """
+        Run the query and return every matching doc. Results are paged with a Solr cursorMark (which requires a sort on
+        the unique key, so '<unique_key> asc' is appended as a tie breaker) unless the caller asked for a specific
+        'start'.
+
+        If params contains stream=True, a generator yielding one page (list of docs) at a time is returned instead of
+        a list so that callers can start working on the first page while the next one is fetched. If it contains
+        columnar=True, the result of do_query_all_columns is returned instead.
+        """
+        if params.pop('stream', False):
+            return self.do_query_pages(*args, **params)
+
+        if params.pop('columnar', False):
+            return self.do_query_all_columns(*args, **params)
 
         results = []
+        for page in self.do_query_pages(*args, **params):
+            results.extend(page)
+
+        return results
+
+    def do_query_all_columns(self, *args, **params):
+        """
+        Run the query and return the requested fields as a dict of field name to numpy array, one entry per doc, in
+        result order. Only plain field names in fl are supported. Date fields (*_dt) are returned as int64 seconds
+        since epoch, *_i/*_l fields as int64 (float64 with nan if some docs lack the field), *_d/*_f fields and the
+        tile bounds as float64 and everything else as a string array. No Tile objects are built and no per-doc dates
+        are parsed with strptime.
+        """
+        fl = params.get('fl', None) or args[1]
+        if not fl:
+            raise ValueError("A columnar query needs the fields to return in fl")
+        if not isinstance(fl, basestring):
+            fl = ','.join(fl)
+        fields = [field.strip() for field in fl.split(',') if field.strip()]
+        params['fl'] = ','.join(fields)
+
+        values = dict((field, []) for field in fields)
+        for page in self.do_query_pages(*args, **params):
+            for field in fields:
+                values[field].extend(doc.get(field) for doc in page)
 
+        return dict((field, self._to_column(field, values[field])) for field in fields)
+
+    @staticmethod
+    def _to_column(field, values):
+        if field.endswith('_dt'):
+            if None in values:
+                raise ValueError("Field %s is missing from some docs" % field)
+            # Solr dates are always UTC, drop the trailing Z to let numpy parse them without a timezone warning
+            return np.array([value[:-1] for value in values], dtype='datetime64[s]').astype(np.int64)
+
+        if field.endswith('_i') or field.endswith('_l'):
+            return np.array(values, dtype=np.float64 if None in values else np.int64)
+
+        if field.endswith('_d') or field.endswith('_f') or field in COLUMNAR_FLOAT_FIELDS:
+            return np.array(values, dtype=np.float64)
+
+        return np.array([u'' if value is None else value for value in values], dtype=np.unicode_)
+
+    def do_query_pages(self, *args, **params):
+        if 'start' in params:
+            pages = self._do_query_pages_by_offset(*args, **params)
+        else:
+            pages = self._do_query_pages_by_cursor(*args, **params)
+
+        for page in pages:
+            yield page
+
+    def _do_query_pages_by_offset(self, *args, **params):
         response = self.do_query_raw(*args, **params)
-        results.extend(response.docs)
+        yield response.docs
+        num_results = len(response.docs)
 
         limit = min(params.get('limit', float('inf')), response.hits)
 
-        while len(results) < limit:
-            params['start'] = len(results)
+        while num_results < limit:
+            params['start'] = num_results
             response = self.do_query_raw(*args, **params)
-            results.extend(response.docs)
+            yield response.docs
+            num_results += len(response.docs)
 
-        assert len(results) == limit
+        assert num_results == limit
 
-        return results
+    def _do_query_pages_by_cursor(self, *args, **params):
+        params['sort'] = self._cursor_sort(args, params)
+
+        limit = params.get('limit', float('inf'))
+        num_results = 0
+        cursor_mark = '*'
+        while num_results < limit:
+            params['cursorMark'] = cursor_mark
+            response = self.do_query_raw(*args, **params)
+
+            docs = response.docs[:int(min(len(response.docs), limit - num_results))]
+            if len(docs) > 0:
+                yield docs
+            num_results += len(docs)
+
+            # A short page or the hit count tells the last page apart without asking Solr for an empty one. Solr also
+            # returns the cursor it was given once every doc has been seen.
+            if len(response.docs) < int(params.get('rows', 0)) or num_results >= response.hits:
+                break
+            if response.nextCursorMark is None or response.nextCursorMark == cursor_mark:
+                break
+            cursor_mark = response.nextCursorMark
+
+    def _cursor_sort(self, args, params):
+        sort = params.pop('sort', None) or args[4]
+        if sort is None:
+            sort = []
+        elif isinstance(sort, basestring):
+            sort = [clause.strip() for clause in sort.split(',')]
+        else:
+            sort = list(sort)
+        if not any(clause.split()[0] == self.unique_key for clause in sort):
+            sort.append('%s asc' % self.unique_key)
+        return ', '.join(sort)
 
     def convert_iso_to_datetime(self, date):
         return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=UTC)
@@ -692,6 +1087,26 @@ class SolrProxy(object):
         except KeyError:
             pass
 
+        try:
+            additionalparams['stream'] = kwargs['stream']
+        except KeyError:
+            pass
+
+        try:
+            additionalparams['columnar'] = kwargs['columnar']
+        except KeyError:
+            pass
+
+        try:
+            additionalparams['level'] = kwargs['level']
+        except KeyError:
+            pass
+
+        try:
+            additionalparams['rollup'] = kwargs['rollup']
+        except KeyError:
+            pass
+
         try:
             kwfq = kwargs['fq'] if isinstance(kwargs['fq'], list) else list(kwargs['fq'])
         except KeyError:
@@ -0,0 +1,176 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Decoding of nexusproto TileData messages into the (latitudes, longitudes, times, data, meta_data) arrays used by
+nexustiles.model.nexusmodel.Tile. Shared by every datastore proxy.
+"""
+
+import ast
+import struct
+from functools import partial
+from io import BytesIO
+
+import numpy as np
+
+from nexustiles.model.nexusmodel import LazyMetaData, SparseTileArray
+
+NPY_MAGIC = b'\x93NUMPY'
+
+
+def from_shaped_array(shaped_array):
+    """
+    Return the array stored in a nexusproto ShapedArray, copied once into a writable buffer.
+    """
+    return from_npy_bytes(shaped_array.array_data)
+
+
+def from_npy_bytes(array_data):
+    """
+    Return the array serialized (in .npy format) in array_data. The bytes are copied once into a bytearray so that the
+    array is writable, like the arrays served from the tile caches, without the extra copies of np.load.
+    """
+    if array_data[:len(NPY_MAGIC)] != NPY_MAGIC:
+        return np.load(BytesIO(array_data))
+
+    major_version = ord(array_data[6:7])
+    if major_version == 1:
+        header_length, = struct.unpack('<H', array_data[8:10])
+        header_start = 10
+    else:
+        header_length, = struct.unpack('<I', array_data[8:12])
+        header_start = 12
+
+    header = ast.literal_eval(array_data[header_start:header_start + header_length].decode('latin1'))
+    dtype = np.dtype(header['descr'])
+    if dtype.hasobject:
+        return np.load(BytesIO(array_data))
+
+    shape = header['shape']
+    count = int(np.prod(shape)) if len(shape) > 0 else 1
+    array = np.frombuffer(bytearray(array_data), dtype=dtype, count=count, offset=header_start + header_length)
+
+    return array.reshape(shape, order='F' if header['fortran_order'] else 'C')
+
+
+def masked_invalid(array):
+    """
+    Same as np.ma.masked_invalid but without copying the data.
+    """
+    return np.ma.masked_array(array, mask=~np.isfinite(array), copy=False)
+
+
+def _swath_indices(num_times, num_points):
+    points = np.arange(num_points)
+    if num_times == 1:
+        return np.zeros(num_points, dtype=points.dtype), points, points
+    return points, points, points
+
+
+def _time_series_indices(num_times, num_points):
+    points = np.tile(np.arange(num_points), num_times)
+    return np.repeat(np.arange(num_times), num_points), points, points
+
+
+def _sparse_or_dense(shape, indices, values, sparse):
+    sparse_array = SparseTileArray(shape, indices, values)
+    return sparse_array if sparse else sparse_array.todense()
+
+
+def _decode_grid_meta(array_data):
+    meta_array = masked_invalid(from_npy_bytes(array_data))
+    if len(meta_array.shape) == 2:
+        meta_array = meta_array[np.newaxis, :]
+    return meta_array
+
+
+def _decode_indexed_meta(array_data, shape, indices, sparse):
+    return _sparse_or_dense(shape, indices, masked_invalid(from_npy_bytes(array_data)).reshape(-1), sparse)
+
+
+def _lazy_meta_data(meta_data_objs, decode_meta):
+    # Only the encoded bytes of each meta array are kept, not the whole tile
+    loaders = {}
+    nbytes = 0
+    for meta_data_obj in meta_data_objs:
+        array_data = meta_data_obj.meta_data.array_data
+        loaders[meta_data_obj.name] = partial(decode_meta, array_data)
+        nbytes += len(array_data)
+    return LazyMetaData(loaders, nbytes)
+
+
+def decode_lat_lon_time_data_meta(nexus_tile, sparse=False):
+    """
+    Decode a nexusproto TileData into latitudes, longitudes, times, data and meta data. Meta data is returned as a
+    LazyMetaData so that each meta array is only decoded when an algorithm reads it.
+
+    :param nexus_tile: nexusproto.TileData
+    :param sparse: If True, data and meta data of swath and time series tiles are returned as SparseTileArray instead
+    of dense time x latitude x longitude masked arrays that are empty everywhere but on the diagonal
+    :return: latitude_data, longitude_data, time_data, tile_data, meta_data
+    """
+    if nexus_tile.HasField('grid_tile'):
+        grid_tile = nexus_tile.grid_tile
+
+        grid_tile_data = masked_invalid(from_shaped_array(grid_tile.variable_data))
+        latitude_data = masked_invalid(from_shaped_array(grid_tile.latitude))
+        longitude_data = masked_invalid(from_shaped_array(grid_tile.longitude))
+
+        if len(grid_tile_data.shape) == 2:
+            grid_tile_data = grid_tile_data[np.newaxis, :]
+
+        meta_data = _lazy_meta_data(grid_tile.meta_data, _decode_grid_meta)
+
+        return latitude_data, longitude_data, np.array([grid_tile.time]), grid_tile_data, meta_data
+    elif nexus_tile.HasField('swath_tile'):
+        swath_tile = nexus_tile.swath_tile
+
+        latitude_data = masked_invalid(from_shaped_array(swath_tile.latitude)).reshape(-1)
+        longitude_data = masked_invalid(from_shaped_array(swath_tile.longitude)).reshape(-1)
+        time_data = masked_invalid(from_shaped_array(swath_tile.time)).reshape(-1)
+
+        # Simplify the tile if the time dimension is the same value repeated
+        if np.all(time_data == np.min(time_data)):
+            time_data = np.array([np.min(time_data)])
+
+        shape = (len(time_data), len(latitude_data), len(longitude_data))
+        indices = _swath_indices(len(time_data), len(latitude_data))
+
+        swath_tile_data = masked_invalid(from_shaped_array(swath_tile.variable_data)).reshape(-1)
+        tile_data = _sparse_or_dense(shape, indices, swath_tile_data, sparse)
+
+        meta_data = _lazy_meta_data(swath_tile.meta_data,
+                                    partial(_decode_indexed_meta, shape=shape, indices=indices, sparse=sparse))
+
+        return latitude_data, longitude_data, time_data, tile_data, meta_data
+    elif nexus_tile.HasField('time_series_tile'):
+        time_series_tile = nexus_tile.time_series_tile
+
+        time_data = masked_invalid(from_shaped_array(time_series_tile.time)).reshape(-1)
+        latitude_data = masked_invalid(from_shaped_array(time_series_tile.latitude))
+        longitude_data = masked_invalid(from_shaped_array(time_series_tile.longitude))
+
+        shape = (len(time_data), len(latitude_data), len(longitude_data))
+        indices = _time_series_indices(len(time_data), len(latitude_data))
+
+        time_series_tile_data = masked_invalid(from_shaped_array(time_series_tile.variable_data)).reshape(-1)
+        tile_data = _sparse_or_dense(shape, indices, time_series_tile_data, sparse)
+
+        meta_data = _lazy_meta_data(time_series_tile.meta_data,
+                                    partial(_decode_indexed_meta, shape=shape, indices=indices, sparse=sparse))
+
+        return latitude_data, longitude_data, time_data, tile_data, meta_data
+    else:
+        raise NotImplementedError("Only supports grid_tile, swath_tile, and time_series_tile")
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import namedtuple
+from collections import namedtuple, Mapping
 
 import numpy as np
 
@@ -22,6 +22,196 @@ BBox = namedtuple('BBox', 'min_lat max_lat min_lon max_lon')
 TileStats = namedtuple('TileStats', 'min max mean count')
 
 
+class TileAggregates(namedtuple('TileAggregates', 'weighted_sum weight_sum sum sum_of_squares min max count')):
+    """
+    Additive partial statistics of the valid values of one tile, or of several tiles merged together. Values are
+    weighted by the cosine of their latitude for the mean, the standard deviation is unweighted.
+    """
+    __slots__ = ()
+
+    @property
+    def mean(self):
+        return self.weighted_sum / self.weight_sum
+
+    @property
+    def std(self):
+        mean = self.sum / self.count
+        return np.sqrt(np.maximum(self.sum_of_squares / self.count - mean * mean, 0.0))
+
+    @classmethod
+    def of_values(cls, values, weights):
+        """
+        :param values: Flat array of valid values
+        :param weights: Flat array of the weights of the values
+        :return: TileAggregates whose fields are arrays with one entry per value, see reduce_aggregates
+        """
+        return cls(values * weights, weights, values, values * values, values, values,
+                   np.ones(values.shape, dtype=np.int64))
+
+    def merge(self, other):
+        return TileAggregates(self.weighted_sum + other.weighted_sum, self.weight_sum + other.weight_sum,
+                              self.sum + other.sum, self.sum_of_squares + other.sum_of_squares,
+                              np.fmin(self.min, other.min), np.fmax(self.max, other.max), self.count + other.count)
+
+
+EMPTY_AGGREGATES = TileAggregates(0.0, 0.0, 0.0, 0.0, np.nan, np.nan, 0)
+
+
+def reduce_aggregates(groups, n_groups, aggregates):
+    """
+    Merge many TileAggregates at once, grouped by index, in a single pass over each field.
+    :param groups: Integer array, the group in [0, n_groups) of every element of the fields of aggregates
+    :param n_groups: Number of groups
+    :param aggregates: TileAggregates whose fields are arrays with one entry per element
+    :return: TileAggregates whose fields are arrays with one entry per group. The fields of empty groups are those of
+             EMPTY_AGGREGATES.
+    """
+    groups = np.asarray(groups, dtype=np.intp)
+
+    def total(field):
+        return np.bincount(groups, weights=np.asarray(field, dtype=np.float64), minlength=n_groups)
+
+    mins = np.full(n_groups, np.nan)
+    maxes = np.full(n_groups, np.nan)
+    if groups.size > 0:
+        # reduceat needs each group to be one run of elements, and NaN (no value) is ignored as in merge
+        order = np.argsort(groups, kind='mergesort')
+        sorted_groups = groups[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+        present = sorted_groups[starts]
+        mins[present] = np.fmin.reduceat(np.asarray(aggregates.min, dtype=np.float64)[order], starts)
+        maxes[present] = np.fmax.reduceat(np.asarray(aggregates.max, dtype=np.float64)[order], starts)
+
+    return TileAggregates(total(aggregates.weighted_sum), total(aggregates.weight_sum), total(aggregates.sum),
+                          total(aggregates.sum_of_squares), mins, maxes,
+                          np.bincount(groups, weights=aggregates.count, minlength=n_groups).astype(np.int64))
+
+
+class LazyMetaData(Mapping):
+    """
+    Read-only mapping of meta data name to array that only decodes an array the first time it is accessed. Iterating
+    over the names, len() and `in` do not decode anything.
+    """
+
+    def __init__(self, loaders, nbytes=0):
+        """
+        :param loaders: dict of meta data name to a function without arguments that returns the decoded array
+        :param nbytes: Number of bytes of encoded data held by the loaders
+        """
+        self.__loaders = loaders
+        self.__arrays = {}
+        self.nbytes = nbytes
+
+    def __getitem__(self, name):
+        try:
+            return self.__arrays[name]
+        except KeyError:
+            array = self.__loaders[name]()
+            self.__arrays[name] = array
+            return array
+
+    def __contains__(self, name):
+        return name in self.__loaders
+
+    def __iter__(self):
+        return iter(self.__loaders)
+
+    def __len__(self):
+        return len(self.__loaders)
+
+    def __repr__(self):
+        return "LazyMetaData(%s)" % sorted(self.__loaders.keys())
+
+    def __reduce__(self):
+        # Loaders are closures over the encoded tile, pickle (e.g. when shipped between Spark workers) as a plain dict
+        return dict, (dict(self.iteritems()),)
+
+    def is_decoded(self, name):
+        return name in self.__arrays
+
+    def copy(self):
+        """
+        :return: A new LazyMetaData sharing the loaders (but not the decoded arrays) of this one
+        """
+        return LazyMetaData(self.__loaders, self.nbytes)
+
+    def subset(self, names):
+        """
+        :param names: Meta data names to keep, names not present are ignored
+        :return: A new LazyMetaData restricted to the given names
+        """
+        return LazyMetaData({name: self.__loaders[name] for name in names if name in self.__loaders},
+                            self.nbytes if any(name in self.__loaders for name in names) else 0)
+
+
+class SparseTileArray(object):
+    """
+    Compact (coordinate list) representation of a time x latitude x longitude tile array in which only a few cells
+    hold values, e.g. the diagonal of a swath or time series tile. Only the populated cells are stored, in C order of
+    their (time, latitude, longitude) index.
+    """
+
+    def __init__(self, shape, indices, values):
+        """
+        :param shape: Shape of the equivalent dense array
+        :param indices: Tuple of (time_index, latitude_index, longitude_index) integer arrays
+        :param values: 1-d masked array with the value of each (time, latitude, longitude) index
+        """
+        self.shape = shape
+        self.indices = indices
+        self.values = values
+        self.__positions = None
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        # Index arrays are shared between dimensions where possible, count each only once
+        unique_indices = {id(i): i for i in self.indices}.values()
+        return sum(i.nbytes for i in unique_indices) + self.values.nbytes + np.ma.getmaskarray(self.values).nbytes
+
+    def __getitem__(self, index):
+        """
+        :param index: (time_index, latitude_index, longitude_index) of a single cell
+        :return: The value of the cell, masked if the cell holds no value
+        """
+        if self.__positions is None:
+            self.__positions = {cell: position for position, cell in
+                                enumerate(zip(*[i.tolist() for i in self.indices]))}
+        position = self.__positions.get(tuple(int(i) for i in index))
+        return np.ma.masked if position is None else self.values[position]
+
+    def count(self):
+        """
+        :return: Number of unmasked values
+        """
+        return np.ma.count(self.values)
+
+    def masked_where(self, time_mask, latitude_mask, longitude_mask):
+        """
+        :param time_mask: Boolean array of the times to mask
+        :param latitude_mask: Boolean array of the latitudes to mask
+        :param longitude_mask: Boolean array of the longitudes to mask
+        :return: A new SparseTileArray with the values at a masked time, latitude or longitude masked
+        """
+        time_index, latitude_index, longitude_index = self.indices
+        mask = time_mask[time_index] | latitude_mask[latitude_index] | longitude_mask[longitude_index]
+        return SparseTileArray(self.shape, self.indices, np.ma.masked_where(mask, self.values))
+
+    def todense(self):
+        """
+        :return: The equivalent time x latitude x longitude float64 masked array, masked everywhere but on the
+                 populated cells
+        """
+        data = np.zeros(self.shape, dtype=np.float64)
+        mask = np.ones(self.shape, dtype=np.bool_)
+        data[self.indices] = np.ma.getdata(self.values)
+        mask[self.indices] = np.ma.getmaskarray(self.values)
+        return np.ma.masked_array(data, mask=mask, copy=False)
+
+
 class Tile(object):
     def __init__(self):
         self.tile_id = None
@@ -40,15 +230,37 @@ class Tile(object):
         self.latitudes = None  # This should be a 1-d ndarray
         self.longitudes = None  # This should be a 1-d ndarray
         self.times = None  # This should be a 1-d ndarray
-        self.data = None  # This should be an ndarray with shape len(times) x len(latitudes) x len(longitudes)
-
-        self.meta_data = None  # This should be a dict of the form { 'meta_data_name' : [[[ndarray]]] }. Each ndarray should be the same shape as data.
+        self.data = None  # This should be an ndarray (or SparseTileArray) with shape len(times) x len(latitudes) x len(longitudes)
+
+        self.meta_data = None  # This should be a dict (or LazyMetaData) of the form { 'meta_data_name' : [[[ndarray]]] }. Each ndarray should be the same shape as data.
+
+    @property
+    def data(self):
+        """
+        Data of this tile as a time x latitude x longitude masked array. Data fetched with sparse=True is only made dense
+        the first time it is read here.
+        """
+        if isinstance(self._data, SparseTileArray):
+            self._data = self._data.todense()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    @property
+    def sparse_data(self):
+        """
+        :return: The SparseTileArray holding the data of this tile, None if the data is dense
+        """
+        return self._data if isinstance(self._data, SparseTileArray) else None
 
     def __str__(self):
         return str(self.get_summary())
 
     def get_summary(self):
         summary = dict(self.__dict__)
+        del summary['_data']
 
         try:
             summary['latitudes'] = self.latitudes.shape
@@ -66,7 +278,7 @@ class Tile(object):
             summary['times'] = 'None'
 
         try:
-            summary['data'] = self.data.shape
+            summary['data'] = self._data.shape
         except AttributeError:
             summary['data'] = 'None'
 
@@ -86,6 +298,15 @@ class Tile(object):
                 data_val = self.data[index]
                 point = NexusPoint(lat, lon, None, time, index, data_val)
                 yield point
+        elif self.sparse_data is not None:
+            sparse_data = self.sparse_data
+            for position in np.ma.nonzero(sparse_data.values)[0]:
+                index = tuple(i[position] for i in sparse_data.indices)
+                time = self.times[index[0]]
+                lat = self.latitudes[index[1]]
+                lon = self.longitudes[index[2]]
+                point = NexusPoint(lat, lon, None, time, index, sparse_data.values[position])
+                yield point
         else:
             for index in np.transpose(np.ma.nonzero(self.data)):
                 index = tuple(index)
@@ -98,7 +319,10 @@ class Tile(object):
 
     def get_indices(self, include_nan=False):
         if include_nan:
-            return list(np.ndindex(self.data.shape))
+            return list(np.ndindex(self._data.shape))
+        elif self.sparse_data is not None:
+            valid = ~np.ma.getmaskarray(self.sparse_data.values)
+            return np.transpose([i[valid] for i in self.sparse_data.indices]).tolist()
         else:
             return np.transpose(np.where(np.ma.getmaskarray(self.data) == False)).tolist()
 
@@ -115,6 +339,33 @@ class Tile(object):
         t_count = self.data.size - np.count_nonzero(np.isnan(self.data))
         self.tile_stats = TileStats(t_min, t_max, t_mean, t_count)
 
+    def get_valid_values(self):
+        """
+        :return: (values, weights) flat float64 arrays of the unmasked, non NaN values of this tile and of the cosine of
+                 their latitude
+        """
+        cos_latitudes = np.cos(np.radians(np.ma.getdata(self.latitudes)))
+        if self.sparse_data is not None:
+            values = np.ma.masked_invalid(self.sparse_data.values)
+            valid = ~np.ma.getmaskarray(values)
+            return np.ma.getdata(values)[valid].astype(np.float64), cos_latitudes[self.sparse_data.indices[1][valid]]
+
+        data = np.ma.masked_invalid(self.data)
+        valid = ~np.ma.getmaskarray(data)
+        weights = np.broadcast_to(cos_latitudes[np.newaxis, :, np.newaxis], data.shape)[valid]
+        return np.ma.getdata(data)[valid].astype(np.float64), weights
+
+    def get_aggregates(self):
+        """
+        :return: TileAggregates of the unmasked, non NaN values of this tile
+        """
+        values, weights = self.get_valid_values()
+        if values.size == 0:
+            return EMPTY_AGGREGATES
+
+        return TileAggregates(np.dot(values, weights).item(), weights.sum().item(), values.sum().item(),
+                              np.dot(values, values).item(), values.min().item(), values.max().item(), values.size)
+
 
 def contains_point(latitudes, longitudes, lat, lon):
     minx, miny, maxx, maxy = np.ma.min(longitudes), np.ma.min(latitudes), np.ma.max(
@@ -15,6 +15,8 @@
 
 import ConfigParser
 import sys
+import threading
+import time
 from datetime import datetime
 from functools import wraps
 
@@ -25,43 +27,102 @@ import dao.CassandraProxy
 import dao.S3Proxy
 import dao.DynamoProxy
 import dao.SolrProxy
+import rollup
 from pytz import timezone, UTC
-from shapely.geometry import MultiPolygon, box
+from shapely.geometry import box
 
-from model.nexusmodel import Tile, BBox, TileStats
+from cache.DiskTileCache import get_disk_tile_cache
+from cache.MemoryTileCache import get_memory_tile_cache
+from model.nexusmodel import Tile, BBox, TileStats, TileAggregates, LazyMetaData
 
 EPOCH = timezone('UTC').localize(datetime(1970, 1, 1))
 
+SERVICE_LOCK = threading.Lock()
+TILE_SERVICES = {}
+
+# Seconds the overview levels and rollup periods of a dataset are remembered, so that newly built ones are picked up
+TILE_INDEX_TTL = 300
+
 
 def tile_data(default_fetch=True):
     def tile_data_decorator(func):
         @wraps(func)
         def fetch_data_for_func(*args, **kwargs):
-            if ('fetch_data' not in kwargs and not default_fetch) or (
-                            'fetch_data' in kwargs and not kwargs['fetch_data']):
-                solr_docs = func(*args, **kwargs)
-                tiles = args[0]._solr_docs_to_tiles(*solr_docs)
-                return tiles
-            else:
-                solr_docs = func(*args, **kwargs)
-                tiles = args[0]._solr_docs_to_tiles(*solr_docs)
-                if len(tiles) > 0:
-                    args[0].fetch_data_for_tiles(*tiles)
-                return tiles
+            fetch = kwargs.get('fetch_data', default_fetch)
+            solr_docs = func(*args, **kwargs)
+
+            if kwargs.get('columnar', False) or kwargs.get('export', False):
+                # A dict of field name to numpy array or an iterator of tile ids, there are no tiles to build
+                return solr_docs
+
+            if kwargs.get('stream', False):
+                return args[0]._stream_tiles(solr_docs, fetch, variables=kwargs.get('variables'),
+                                             use_cache=kwargs.get('use_cache', True),
+                                             sparse=kwargs.get('sparse', False))
+
+            tiles = args[0]._solr_docs_to_tiles(*solr_docs)
+            if fetch and len(tiles) > 0:
+                args[0].fetch_data_for_tiles(*tiles, variables=kwargs.get('variables'),
+                                             use_cache=kwargs.get('use_cache', True),
+                                             sparse=kwargs.get('sparse', False))
+            return tiles
 
         return fetch_data_for_func
 
     return tile_data_decorator
 
 
+def _mask_data_to_coordinates(tile):
+    time_mask = ma.getmaskarray(tile.times)
+    latitude_mask = ma.getmaskarray(tile.latitudes)
+    longitude_mask = ma.getmaskarray(tile.longitudes)
+
+    if tile.sparse_data is not None:
+        tile.data = tile.sparse_data.masked_where(time_mask, latitude_mask, longitude_mask)
+        return
+
+    # Or together the masks of the individual arrays to create the new mask
+    data_mask = time_mask[:, np.newaxis, np.newaxis] \
+                | latitude_mask[np.newaxis, :, np.newaxis] \
+                | longitude_mask[np.newaxis, np.newaxis, :]
+
+    tile.data = ma.masked_where(data_mask, tile.data)
+
+
+def _has_unmasked_data(tile):
+    if tile.sparse_data is not None:
+        return tile.sparse_data.count() > 0
+    return not tile.data.mask.all()
+
+
 class NexusTileServiceException(Exception):
     pass
 
 
+def get_tile_service(skipDatastore=False, skipMetadatastore=False):
+    """
+    Return the process-wide NexusTileService built from the packaged datastores.ini, creating it on first use. The
+    service is thread safe: its Solr session, Cassandra session and boto3 clients pool their connections, so every
+    handler and task in the process can share it instead of re-reading the config and reconnecting.
+    :return: NexusTileService
+    """
+    with SERVICE_LOCK:
+        key = (skipDatastore, skipMetadatastore)
+        if key not in TILE_SERVICES:
+            TILE_SERVICES[key] = NexusTileService(skipDatastore, skipMetadatastore)
+
+        return TILE_SERVICES[key]
+
+
 class NexusTileService(object):
     def __init__(self, skipDatastore=False, skipMetadatastore=False, config=None):
         self._datastore = None
         self._metadatastore = None
+        self._tile_cache = None
+        self._disk_tile_cache = None
+        self._overview_levels = {}
+        self._rollup_periods = {}
+        self._tile_index_lock = threading.Lock()
 
         if config is None:
             self._config = ConfigParser.RawConfigParser()
@@ -84,6 +145,18 @@ class NexusTileService(object):
         if not skipMetadatastore:
             self._metadatastore = dao.SolrProxy.SolrProxy(self._config)
 
+        if not skipDatastore and self._config.has_option("cache", "memory_max_mb"):
+            memory_max_mb = self._config.getint("cache", "memory_max_mb")
+            if memory_max_mb > 0:
+                self._tile_cache = get_memory_tile_cache(memory_max_mb * 1024 * 1024)
+
+        if not skipDatastore and self._config.has_option("cache", "disk_path"):
+            disk_path = self._config.get("cache", "disk_path")
+            disk_max_mb = self._config.getint("cache", "disk_max_mb") if self._config.has_option("cache",
+                                                                                                 "disk_max_mb") else 0
+            if disk_path and disk_max_mb > 0:
+                self._disk_tile_cache = get_disk_tile_cache(disk_path, disk_max_mb * 1024 * 1024)
+
     def get_dataseries_list(self, simple=False):
         if simple:
             return self._metadatastore.get_data_series_list_simple()
@@ -133,13 +206,55 @@ class NexusTileService(object):
 
         return tile
 
+    def get_overview_level(self, ds, resolution):
+        """
+        Pick the overview level (see nexustiles.pyramid) to read for an output of the given resolution.
+        :param ds: The dataset name
+        :param resolution: Size in degrees of the output cells
+        :return: The coarsest level of ds whose cells are no larger than resolution, 0 (full resolution) if none is
+        """
+        levels = self._tile_index(self._overview_levels, ds, self._metadatastore.find_overview_levels)
+
+        usable = [level for level, cell_size in levels.iteritems() if cell_size <= resolution]
+        return max(usable) if usable else 0
+
+    def plan_rollups(self, ds, start_time, end_time):
+        """
+        Plan the reads of a time range of ds over the temporal rollups (see nexustiles.rollup) built for it.
+        :param ds: The dataset name
+        :param start_time: Start of the range, in seconds since EPOCH
+        :param end_time: End of the range (included), in seconds since EPOCH
+        :return: list of (rollup, start time, end time) covering the range, rollup.DAY where daily tiles are to be read
+        """
+        periods = self._tile_index(self._rollup_periods, ds, self._metadatastore.find_rollup_periods)
+        return rollup.plan(start_time, end_time, periods)
+
+    def _tile_index(self, cache, ds, find):
+        # Overview levels and rollup periods only change when they are built, they are remembered for TILE_INDEX_TTL
+        now = time.time()
+        with self._tile_index_lock:
+            value, expires = cache.get(ds, (None, 0))
+        if now >= expires:
+            value = find(ds)
+            with self._tile_index_lock:
+                cache[ds] = (value, now + TILE_INDEX_TTL)
+        return value
+
+    def _resolve_level(self, ds, kwargs):
+        # The resolution option of the tile queries is turned into the overview level to search
+        resolution = kwargs.pop('resolution', None)
+        if resolution is not None and 'level' not in kwargs:
+            kwargs['level'] = self.get_overview_level(ds, resolution)
+
     @tile_data()
     def find_all_tiles_in_box_at_time(self, min_lat, max_lat, min_lon, max_lon, dataset, time, **kwargs):
+        self._resolve_level(dataset, kwargs)
         return self._metadatastore.find_all_tiles_in_box_at_time(min_lat, max_lat, min_lon, max_lon, dataset, time, rows=5000,
                                                         **kwargs)
 
     @tile_data()
     def find_all_tiles_in_polygon_at_time(self, bounding_polygon, dataset, time, **kwargs):
+        self._resolve_level(dataset, kwargs)
         return self._metadatastore.find_all_tiles_in_polygon_at_time(bounding_polygon, dataset, time, rows=5000,
                                                             **kwargs)
 
@@ -150,12 +265,20 @@ class NexusTileService(object):
             start_time = (start_time - EPOCH).total_seconds()
         if type(end_time) is datetime:
             end_time = (end_time - EPOCH).total_seconds()
+        self._resolve_level(ds, kwargs)
         return self._metadatastore.find_all_tiles_in_box_sorttimeasc(min_lat, max_lat, min_lon, max_lon, ds, start_time,
                                                             end_time, **kwargs)
 
     @tile_data()
     def find_tiles_in_polygon(self, bounding_polygon, ds=None, start_time=0, end_time=-1, **kwargs):
         # Find tiles that fall within the polygon in the Solr index
+        self._resolve_level(ds, kwargs)
+        if kwargs.get('export', False):
+            # Bulk id retrieval through the Solr export handler, returns an iterator of tile ids
+            if kwargs.get('fetch_data', True) or kwargs.get('fl') not in ('id', ['id']):
+                raise NexusTileServiceException("export=True requires fetch_data=False and fl='id'")
+            return self._metadatastore.export_tile_ids(bounding_polygon, ds, start_time, end_time, **kwargs)
+
         if 'sort' in kwargs.keys():
             tiles = self._metadatastore.find_all_tiles_in_polygon(bounding_polygon, ds, start_time, end_time, **kwargs)
         else:
@@ -206,8 +329,9 @@ class NexusTileService(object):
         :param kwargs: fetch_data: True/False = whether or not to retrieve tile data
         :return:
         """
+        self._resolve_level(ds, kwargs)
         tiles = self._metadatastore.find_tiles_by_exact_bounds(bounds[0], bounds[1], bounds[2], bounds[3], ds, start_time,
-                                                      end_time)
+                                                      end_time, **kwargs)
         return tiles
 
     @tile_data()
@@ -270,12 +394,10 @@ class NexusTileService(object):
         :param tile_ids: List of tile ids
         :return: shapely.geometry.Polygon that represents the smallest bounding box that encompasses all of the tiles
         """
-        tiles = self.find_tiles_by_id(tile_ids, fl=['tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon'],
-                                      fetch_data=False, rows=len(tile_ids))
-        polys = []
-        for tile in tiles:
-            polys.append(box(tile.bbox.min_lon, tile.bbox.min_lat, tile.bbox.max_lon, tile.bbox.max_lat))
-        return box(*MultiPolygon(polys).bounds)
+        bounds = self.find_tiles_by_id(tile_ids, fl=['tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon'],
+                                       fetch_data=False, rows=len(tile_ids), columnar=True)
+        return box(bounds['tile_min_lon'].min(), bounds['tile_min_lat'].min(),
+                   bounds['tile_max_lon'].max(), bounds['tile_max_lat'].max())
 
     def get_min_time(self, tile_ids, ds=None):
         """
@@ -297,7 +419,7 @@ class NexusTileService(object):
         max_time = self._metadatastore.find_max_date_from_tiles(tile_ids, ds=ds)
         return long((max_time - EPOCH).total_seconds())
 
-    def get_distinct_bounding_boxes_in_polygon(self, bounding_polygon, ds, start_time, end_time):
+    def get_distinct_bounding_boxes_in_polygon(self, bounding_polygon, ds, start_time, end_time, **kwargs):
         """
         Get a list of distinct tile bounding boxes from all tiles within the given polygon and time range.
         :param bounding_polygon: The bounding polygon of tiles to search for
@@ -306,7 +428,9 @@ class NexusTileService(object):
         :param end_time: The end time to search for tiles
         :return: A list of distinct bounding boxes (as shapely polygons) for tiles in the search polygon
         """
-        bounds = self._metadatastore.find_distinct_bounding_boxes_in_polygon(bounding_polygon, ds, start_time, end_time)
+        self._resolve_level(ds, kwargs)
+        bounds = self._metadatastore.find_distinct_bounding_boxes_in_polygon(bounding_polygon, ds, start_time, end_time,
+                                                                              **kwargs)
         return [box(*b) for b in bounds]
 
     def mask_tiles_to_bbox(self, min_lat, max_lat, min_lon, max_lon, tiles):
@@ -315,14 +439,9 @@ class NexusTileService(object):
             tile.latitudes = ma.masked_outside(tile.latitudes, min_lat, max_lat)
             tile.longitudes = ma.masked_outside(tile.longitudes, min_lon, max_lon)
 
-            # Or together the masks of the individual arrays to create the new mask
-            data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
-                        | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
-                        | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
+            _mask_data_to_coordinates(tile)
 
-            tile.data = ma.masked_where(data_mask, tile.data)
-
-        tiles[:] = [tile for tile in tiles if not tile.data.mask.all()]
+        tiles[:] = [tile for tile in tiles if _has_unmasked_data(tile)]
 
         return tiles
 
@@ -332,14 +451,9 @@ class NexusTileService(object):
             tile.latitudes = ma.masked_outside(tile.latitudes, min_lat, max_lat)
             tile.longitudes = ma.masked_outside(tile.longitudes, min_lon, max_lon)
 
-            # Or together the masks of the individual arrays to create the new mask
-            data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
-                        | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
-                        | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
-
-            tile.data = ma.masked_where(data_mask, tile.data)
+            _mask_data_to_coordinates(tile)
 
-        tiles[:] = [tile for tile in tiles if not tile.data.mask.all()]
+        tiles[:] = [tile for tile in tiles if _has_unmasked_data(tile)]
 
         return tiles
 
@@ -366,14 +480,9 @@ class NexusTileService(object):
             for tile in tiles:
                 tile.times = ma.masked_outside(tile.times, start_time, end_time)
 
-                # Or together the masks of the individual arrays to create the new mask
-                data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
-                            | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
-                            | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
-
-                tile.data = ma.masked_where(data_mask, tile.data)
+                _mask_data_to_coordinates(tile)
 
-            tiles[:] = [tile for tile in tiles if not tile.data.mask.all()]
+            tiles[:] = [tile for tile in tiles if _has_unmasked_data(tile)]
 
         return tiles
 
@@ -389,30 +498,156 @@ class NexusTileService(object):
         """
         return self._metadatastore.get_tile_count(ds, bounding_polygon, start_time, end_time, metadata, **kwargs)
 
-    def fetch_data_for_tiles(self, *tiles):
+    def find_tile_aggregates_in_polygon(self, bounding_polygon, ds, start_time=0, end_time=-1, **kwargs):
+        """
+        Return the bounds, start time and stored partial statistics of the tiles intersecting the polygon, without
+        fetching any tile data.
+        :return: dict of 'id', 'tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon', 'tile_min_time_dt'
+                 (seconds since epoch) and of every TileAggregates field name to a numpy array with one entry per tile.
+                 Aggregates of tiles without stored partials are nan.
+        """
+        fl = ['id', 'tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon', 'tile_min_time_dt'] + \
+             list(dao.SolrProxy.TILE_AGGREGATE_FIELDS)
+        columns = self.find_tiles_in_polygon(bounding_polygon, ds, start_time, end_time, fl=fl, fetch_data=False,
+                                             columnar=True, **kwargs)
+
+        for name, field in zip(TileAggregates._fields, dao.SolrProxy.TILE_AGGREGATE_FIELDS):
+            columns[name] = columns.pop(field).astype(np.float64)
+        return columns
+
+    def save_tiles(self, blobs_by_id, solr_docs, commit=False):
+        """
+        Store new tiles: their serialized nexusproto TileData in the data store, then their documents in Solr.
+        :param blobs_by_id: dict of tile id to serialized TileData
+        :param solr_docs: The Solr documents of the tiles
+        :param commit: Whether to commit Solr afterwards
+        """
+        if blobs_by_id:
+            self._datastore.save_nexus_tiles(blobs_by_id)
+        self._metadatastore.add_tiles(solr_docs, commit=commit)
+
+    def update_tile_aggregates(self, tiles, ds=None, commit=False):
+        """
+        Store the TileAggregates of the given tiles, which must have their data fetched, with the tile metadata.
+        """
+        self._metadatastore.update_tile_aggregates(dict((tile.tile_id, tile.get_aggregates()) for tile in tiles),
+                                                   ds=ds, commit=commit)
+
+    def fetch_data_for_tiles(self, *tiles, **kwargs):
+        """
+        Populate latitudes, longitudes, times, data and meta_data of the given tiles. Decoded tiles are served from the
+        process-wide memory cache, then from the local disk cache, when they are enabled in datastores.ini.
+        :param tiles: Tiles to fetch data for
+        :param kwargs: use_cache: True/False = whether or not to read from and populate the tile caches (default True)
+                       variables: List of meta data names the caller will read. Other meta data is left out of
+                       tile.meta_data. Defaults to None (all meta data, each decoded on first access)
+                       sparse: True/False = whether or not to keep the data and meta data of swath and time series
+                       tiles as SparseTileArray, for callers that only read the populated cells (default False).
+                       Tile.data is still dense when read. Sparse tiles are not added to the tile caches
+        :return: The tiles passed in
+        """
+        use_cache = kwargs.get('use_cache', True)
+        variables = kwargs.get('variables')
+        sparse = kwargs.get('sparse', False)
 
         nexus_tile_ids = set([tile.tile_id for tile in tiles])
-        matched_tile_data = self._datastore.fetch_nexus_tiles(*nexus_tile_ids)
 
+        decoded_by_id = self._get_cached_tiles(nexus_tile_ids) if use_cache else {}
+
+        ids_to_fetch = nexus_tile_ids.difference(decoded_by_id.keys())
+        if len(ids_to_fetch) > 0:
+            matched_tile_data = self._datastore.fetch_nexus_tiles(*ids_to_fetch)
+            decoded_by_id.update(self._decode_tile_data(ids_to_fetch, matched_tile_data, use_cache, sparse))
+
+        return self._set_tile_data(tiles, decoded_by_id, variables)
+
+    def _get_cached_tiles(self, tile_ids):
+        decoded_by_id = {}
+        for tile_id in tile_ids:
+            entry = self._get_cached_tile(tile_id)
+            if entry is not None:
+                decoded_by_id[tile_id] = entry
+        return decoded_by_id
+
+    def _decode_tile_data(self, ids_to_fetch, matched_tile_data, use_cache, sparse=False):
         tile_data_by_id = {str(a_tile_data.tile_id): a_tile_data for a_tile_data in matched_tile_data}
 
-        missing_data = nexus_tile_ids.difference(tile_data_by_id.keys())
+        missing_data = ids_to_fetch.difference(tile_data_by_id.keys())
         if len(missing_data) > 0:
             raise StandardError("Missing data for tile_id(s) %s." % missing_data)
 
+        decoded_by_id = {}
+        for tile_id, a_tile_data in tile_data_by_id.iteritems():
+            decoded_by_id[tile_id] = a_tile_data.get_lat_lon_time_data_meta(sparse=sparse)
+            # The caches hold dense arrays only
+            if use_cache and not sparse:
+                self._put_cached_tile(tile_id, decoded_by_id[tile_id])
+
+        return decoded_by_id
+
+    @staticmethod
+    def _set_tile_data(tiles, decoded_by_id, variables):
         for a_tile in tiles:
-            lats, lons, times, data, meta = tile_data_by_id[a_tile.tile_id].get_lat_lon_time_data_meta()
+            lats, lons, times, data, meta = decoded_by_id[a_tile.tile_id]
 
             a_tile.latitudes = lats
             a_tile.longitudes = lons
             a_tile.times = times
             a_tile.data = data
-            a_tile.meta_data = meta
+            if variables is None:
+                a_tile.meta_data = meta
+            elif isinstance(meta, LazyMetaData):
+                a_tile.meta_data = meta.subset(variables)
+            else:
+                a_tile.meta_data = {name: meta[name] for name in variables if name in meta}
 
-            del (tile_data_by_id[a_tile.tile_id])
+            del (decoded_by_id[a_tile.tile_id])
 
         return tiles
 
+    def _get_cached_tile(self, tile_id):
+        entry = None
+        if self._tile_cache is not None:
+            entry = self._tile_cache.get(tile_id)
+
+        if entry is None and self._disk_tile_cache is not None:
+            entry = self._disk_tile_cache.get(tile_id)
+            if entry is not None and self._tile_cache is not None:
+                self._tile_cache.put(tile_id, entry)
+
+        return entry
+
+    def _put_cached_tile(self, tile_id, entry):
+        if self._tile_cache is not None:
+            self._tile_cache.put(tile_id, entry)
+        if self._disk_tile_cache is not None:
+            self._disk_tile_cache.put(tile_id, entry)
+
+    def get_tile_cache_stats(self):
+        """
+        :return: dict with the stats (entries, bytes, max_bytes, hits, misses and evictions) of the 'memory' and 'disk'
+        tile caches. The stats of a disabled cache are None.
+        """
+        return {
+            'memory': self._tile_cache.stats() if self._tile_cache is not None else None,
+            'disk': self._disk_tile_cache.stats() if self._disk_tile_cache is not None else None
+        }
+
+    def _stream_tiles(self, solr_doc_pages, fetch_data, variables=None, use_cache=True, sparse=False):
+        """
+        Generator over the pages returned by a streaming (stream=True) metadata query. Each page of solr docs is
+        turned into a list of tiles (with data fetched if requested) and yielded before the next page is requested.
+        Pass use_cache=False to keep the tiles out of the tile caches, so that only the current page is held.
+        """
+        if isinstance(solr_doc_pages, list):
+            solr_doc_pages = [solr_doc_pages]
+
+        for solr_docs in solr_doc_pages:
+            tiles = self._solr_docs_to_tiles(*solr_docs)
+            if fetch_data and len(tiles) > 0:
+                self.fetch_data_for_tiles(*tiles, variables=variables, use_cache=use_cache, sparse=sparse)
+            yield tiles
+
     def _solr_docs_to_tiles(self, *solr_docs):
 
         tiles = []
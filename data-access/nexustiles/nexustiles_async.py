@@ -0,0 +1,219 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from datetime import datetime
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+import dao.AsyncSolrProxy
+import dao.CassandraProxy
+from nexustiles import NexusTileService, EPOCH, get_tile_service
+
+SERVICE_LOCK = threading.Lock()
+ASYNC_TILE_SERVICES = {}
+
+
+def get_async_tile_service(skipDatastore=False, skipMetadatastore=False):
+    """
+    Return the process-wide AsyncNexusTileService, creating it on first use. It wraps the service returned by
+    get_tile_service and its AsyncHTTPClient binds to the IOLoop of the first query, so it must only be used from
+    that IOLoop.
+    :return: AsyncNexusTileService
+    """
+    with SERVICE_LOCK:
+        key = (skipDatastore, skipMetadatastore)
+        if key not in ASYNC_TILE_SERVICES:
+            ASYNC_TILE_SERVICES[key] = AsyncNexusTileService(skipDatastore, skipMetadatastore)
+
+        return ASYNC_TILE_SERVICES[key]
+
+
+def _to_tornado_future(response_future):
+    """
+    Wrap a cassandra-driver ResponseFuture in a Tornado Future resolved on the current IOLoop. The driver calls back
+    from its own event thread, so the result is handed over with add_callback.
+    """
+    future = Future()
+    io_loop = IOLoop.current()
+
+    response_future.add_callbacks(lambda rows: io_loop.add_callback(future.set_result, rows),
+                                  lambda exc: io_loop.add_callback(future.set_exception, exc))
+
+    return future
+
+
+class AsyncNexusTileService(object):
+    """
+    Coroutine variant of NexusTileService for handlers running on the Tornado IOLoop. Solr queries go through an
+    AsyncHTTPClient and Cassandra reads through the driver's own futures, so waiting on I/O does not hold a thread.
+    Decoding and masking (NumPy work) run on the executor, as do reads from datastores without an asynchronous client
+    (S3, DynamoDB). The tile caches configured in datastores.ini are shared with NexusTileService.
+
+    All query methods are coroutines and accept the same arguments as their NexusTileService counterparts, except
+    stream, columnar and export which are not supported.
+    """
+
+    def __init__(self, skipDatastore=False, skipMetadatastore=False, config=None, executor=None):
+        if config is None:
+            self._service = get_tile_service(skipDatastore, True)
+        else:
+            self._service = NexusTileService(skipDatastore, True, config)
+        self._datastore = self._service._datastore
+        self._metadatastore = None
+        if not skipMetadatastore:
+            self._metadatastore = dao.AsyncSolrProxy.AsyncSolrProxy(self._service._config)
+
+        # None is the IOLoop's default executor
+        self._executor = executor
+
+    def _run_on_executor(self, func, *args):
+        return IOLoop.current().run_in_executor(self._executor, func, *args)
+
+    @gen.coroutine
+    def _to_tiles(self, solr_docs, fetch_data, variables=None):
+        tiles = self._service._solr_docs_to_tiles(*solr_docs)
+        if fetch_data and len(tiles) > 0:
+            yield self.fetch_data_for_tiles(*tiles, variables=variables)
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def get_dataseries_list(self, simple=False):
+        if simple:
+            datasets = yield self._metadatastore.get_data_series_list_simple()
+        else:
+            datasets = yield self._metadatastore.get_data_series_list()
+        raise gen.Return(datasets)
+
+    @gen.coroutine
+    def pingSolr(self):
+        status = yield self._metadatastore.ping()
+        raise gen.Return(bool(status and status["status"] == "OK"))
+
+    @gen.coroutine
+    def find_tile_by_id(self, tile_id, **kwargs):
+        solr_docs = yield self._metadatastore.find_tile_by_id(tile_id)
+        tiles = yield self._to_tiles(solr_docs, kwargs.get('fetch_data', True), kwargs.get('variables'))
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def find_tiles_by_id(self, tile_ids, ds=None, **kwargs):
+        solr_docs = yield self._metadatastore.find_tiles_by_id(tile_ids, ds=ds, **kwargs)
+        tiles = yield self._to_tiles(solr_docs, kwargs.get('fetch_data', True), kwargs.get('variables'))
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, dataset, start_time, end_time, **kwargs):
+        days = yield self._metadatastore.find_days_in_range_asc(min_lat, max_lat, min_lon, max_lon, dataset,
+                                                                start_time, end_time, **kwargs)
+        raise gen.Return(days)
+
+    @gen.coroutine
+    def find_tiles_in_box(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0, end_time=-1, **kwargs):
+        if type(start_time) is datetime:
+            start_time = (start_time - EPOCH).total_seconds()
+        if type(end_time) is datetime:
+            end_time = (end_time - EPOCH).total_seconds()
+        solr_docs = yield self._metadatastore.find_all_tiles_in_box_sorttimeasc(min_lat, max_lat, min_lon, max_lon, ds,
+                                                                                start_time, end_time, **kwargs)
+        tiles = yield self._to_tiles(solr_docs, kwargs.get('fetch_data', True), kwargs.get('variables'))
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def find_tiles_in_polygon(self, bounding_polygon, ds=None, start_time=0, end_time=-1, **kwargs):
+        if 'sort' in kwargs.keys():
+            solr_docs = yield self._metadatastore.find_all_tiles_in_polygon(bounding_polygon, ds, start_time, end_time,
+                                                                            **kwargs)
+        else:
+            solr_docs = yield self._metadatastore.find_all_tiles_in_polygon_sorttimeasc(bounding_polygon, ds,
+                                                                                        start_time, end_time, **kwargs)
+        tiles = yield self._to_tiles(solr_docs, kwargs.get('fetch_data', True), kwargs.get('variables'))
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def get_tiles_bounded_by_box(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0, end_time=-1,
+                                 **kwargs):
+        tiles = yield self.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs)
+        tiles = yield self._run_on_executor(self._service.mask_tiles_to_bbox, min_lat, max_lat, min_lon, max_lon,
+                                            tiles)
+        if 0 < start_time <= end_time:
+            tiles = yield self._run_on_executor(self._service.mask_tiles_to_time_range, start_time, end_time, tiles)
+
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def get_tiles_bounded_by_polygon(self, polygon, ds=None, start_time=0, end_time=-1, **kwargs):
+        tiles = yield self.find_tiles_in_polygon(polygon, ds, start_time, end_time, **kwargs)
+        tiles = yield self._run_on_executor(self._service.mask_tiles_to_polygon, polygon, tiles)
+        if 0 < start_time <= end_time:
+            tiles = yield self._run_on_executor(self._service.mask_tiles_to_time_range, start_time, end_time, tiles)
+
+        raise gen.Return(tiles)
+
+    @gen.coroutine
+    def fetch_data_for_tiles(self, *tiles, **kwargs):
+        """
+        Coroutine version of NexusTileService.fetch_data_for_tiles, accepting the same use_cache, variables and sparse
+        kwargs.
+        """
+        use_cache = kwargs.get('use_cache', True)
+        variables = kwargs.get('variables')
+        sparse = kwargs.get('sparse', False)
+
+        nexus_tile_ids = set([tile.tile_id for tile in tiles])
+
+        decoded_by_id = {}
+        if use_cache:
+            decoded_by_id = yield self._run_on_executor(self._service._get_cached_tiles, nexus_tile_ids)
+
+        ids_to_fetch = nexus_tile_ids.difference(decoded_by_id.keys())
+        if len(ids_to_fetch) > 0:
+            matched_tile_data = yield self._fetch_nexus_tiles(ids_to_fetch)
+            decoded = yield self._run_on_executor(self._service._decode_tile_data, ids_to_fetch, matched_tile_data,
+                                                  use_cache, sparse)
+            decoded_by_id.update(decoded)
+
+        raise gen.Return(self._service._set_tile_data(tiles, decoded_by_id, variables))
+
+    @gen.coroutine
+    def _fetch_nexus_tiles(self, tile_ids):
+        if not isinstance(self._datastore, dao.CassandraProxy.CassandraProxy):
+            matched_tile_data = yield self._run_on_executor(self._datastore.fetch_nexus_tiles, *tile_ids)
+            raise gen.Return(matched_tile_data)
+
+        tile_ids = list(tile_ids)
+        batch_size = self._datastore.fetch_concurrency
+        matched_tile_data = []
+        for start in xrange(0, len(tile_ids), batch_size):
+            rows_per_tile = yield [_to_tornado_future(response_future) for response_future in
+                                   self._datastore.start_fetch_nexus_tiles(*tile_ids[start:start + batch_size])]
+            for rows in rows_per_tile:
+                matched_tile_data.extend(self._datastore.tile_data_from_rows(rows))
+
+        raise gen.Return(matched_tile_data)
+
+    def mask_tiles_to_bbox(self, min_lat, max_lat, min_lon, max_lon, tiles):
+        return self._service.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles)
+
+    def mask_tiles_to_polygon(self, bounding_polygon, tiles):
+        return self._service.mask_tiles_to_polygon(bounding_polygon, tiles)
+
+    def mask_tiles_to_time_range(self, start_time, end_time, tiles):
+        return self._service.mask_tiles_to_time_range(start_time, end_time, tiles)
+
+    def get_tile_cache_stats(self):
+        return self._service.get_tile_cache_stats()
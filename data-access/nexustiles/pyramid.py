@@ -0,0 +1,299 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Multi-resolution overviews of gridded datasets. Overview level k of a dataset is a global grid whose cells are 2**k
+times the size of the dataset's cells, aligned on -90/-180 and cut into tiles of tile_size x tile_size cells, so the
+tiles of a level have the same coordinates at every time step. Each overview cell stores the sum and the count of the
+full resolution values inside it (meta data 'sum' and 'count'), which keeps averages computed from overviews exact,
+and their mean as tile data so that overview tiles can be read like any other tile.
+
+Overview tiles are indexed in Solr with their level in level_i and their cell size in tile_cell_size_d. Queries only
+return them when they ask for a level, see NexusTileService.get_overview_level and the resolution query option.
+"""
+
+import logging
+import uuid
+from datetime import datetime
+
+import numpy as np
+import nexusproto.DataTile_pb2 as nexusproto
+from nexusproto.serialization import to_metadata, to_shaped_array
+
+DEFAULT_TILE_SIZE = 32
+SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Meta data to request (with the variables keyword) to read the exact sums and counts of overview tiles
+OVERVIEW_VARIABLES = ['sum', 'count']
+
+# Overview tile ids are derived from the dataset, level, time and position so that rebuilding a level overwrites it
+OVERVIEW_NAMESPACE = uuid.UUID('8a3d29c2-5c43-4b9c-9e0f-3f6f2b8f7c51')
+
+log = logging.getLogger(__name__)
+
+
+class OverviewLevel(object):
+    """
+    Accumulates full resolution values of one time step into the cells of one overview level.
+    """
+
+    def __init__(self, level, native_lat_size, native_lon_size, tile_size=DEFAULT_TILE_SIZE):
+        self.level = level
+        self.lat_size = native_lat_size * 2 ** level
+        self.lon_size = native_lon_size * 2 ** level
+        self.tile_size = tile_size
+        self.nlats = int(np.ceil(180.0 / self.lat_size))
+        self.nlons = int(np.ceil(360.0 / self.lon_size))
+        # (tile row, tile column) -> (sums, counts), each tile_size x tile_size
+        self._tiles = {}
+
+    @property
+    def cell_size(self):
+        return max(self.lat_size, self.lon_size)
+
+    def add(self, latitudes, longitudes, values):
+        """
+        :param latitudes: 1-d array of the latitudes of values
+        :param longitudes: 1-d array of the longitudes of values
+        :param values: 2-d (latitude x longitude) masked array, masked and non finite values are skipped
+        """
+        values = np.ma.masked_invalid(values)
+        y, x = np.nonzero(~np.ma.getmaskarray(values))
+        if len(y) == 0:
+            return
+
+        lat_index = np.clip(np.floor((np.ma.getdata(latitudes)[y] + 90.0) / self.lat_size).astype(np.int64),
+                            0, self.nlats - 1)
+        lon_index = np.clip(np.floor(((np.ma.getdata(longitudes)[x] + 180.0) % 360.0) / self.lon_size).astype(np.int64),
+                            0, self.nlons - 1)
+        valid_values = np.ma.getdata(values)[y, x].astype(np.float64)
+
+        tile_keys = (lat_index // self.tile_size) * self.nlons + lon_index // self.tile_size
+        for tile_key in np.unique(tile_keys):
+            in_tile = tile_keys == tile_key
+            key = divmod(int(tile_key), self.nlons)
+            if key not in self._tiles:
+                self._tiles[key] = (np.zeros((self.tile_size, self.tile_size), dtype=np.float64),
+                                    np.zeros((self.tile_size, self.tile_size), dtype=np.int32))
+            sums, counts = self._tiles[key]
+            cells = (lat_index[in_tile] % self.tile_size, lon_index[in_tile] % self.tile_size)
+            np.add.at(sums, cells, valid_values[in_tile])
+            np.add.at(counts, cells, 1)
+
+    def tiles(self):
+        """
+        Return the accumulated overview tiles and start over.
+        :return: list of ((tile row, tile column), latitudes, longitudes, sums, counts)
+        """
+        tiles = []
+        for (row, column), (sums, counts) in sorted(self._tiles.iteritems()):
+            # Tiles on the last row and column of the grid are cut to the globe
+            lat_start = row * self.tile_size
+            lon_start = column * self.tile_size
+            nlats = min(self.tile_size, self.nlats - lat_start)
+            nlons = min(self.tile_size, self.nlons - lon_start)
+            tiles.append(((row, column),
+                          -90.0 + (np.arange(lat_start, lat_start + nlats) + 0.5) * self.lat_size,
+                          -180.0 + (np.arange(lon_start, lon_start + nlons) + 0.5) * self.lon_size,
+                          sums[:nlats, :nlons], counts[:nlats, :nlons]))
+        self._tiles = {}
+        return tiles
+
+
+def native_cell_size(tile):
+    """
+    :return: (latitude, longitude) cell size of a grid tile, None if the tile is too small to tell
+    """
+    latitudes, longitudes = np.ma.getdata(tile.latitudes), np.ma.getdata(tile.longitudes)
+    if len(latitudes) < 2 or len(longitudes) < 2:
+        return None
+    return abs(float(latitudes[1] - latitudes[0])), abs(float(longitudes[1] - longitudes[0]))
+
+
+def sum_count(tile):
+    """
+    :return: (sums, counts) shaped like tile.data. For an overview tile (read with OVERVIEW_VARIABLES) these are its
+             stored sums and counts, for a full resolution tile its values and one per valid value. Masked cells count
+             zero.
+    """
+    mask = np.ma.getmaskarray(tile.data)
+    meta_data = tile.meta_data if tile.meta_data is not None else {}
+    if 'sum' in meta_data and 'count' in meta_data:
+        sums = np.ma.getdata(meta_data['sum'])
+        counts = np.ma.filled(meta_data['count'], 0)
+    else:
+        sums = np.ma.getdata(tile.data)
+        counts = np.ones(mask.shape, dtype=np.int32)
+
+    return np.where(mask, 0.0, np.nan_to_num(sums)), np.where(mask, 0, counts)
+
+
+class WindowSum(object):
+    """
+    Running float64 sums and counts of the valid values of a window of a tile footprint, folded in one tile at a time.
+    Tiles are read in place: cells outside the bounds or masked are skipped with the where argument of np.add, no
+    masked copy of the tile is made. Sums and counts are taken as in sum_count.
+    """
+
+    def __init__(self, min_lat, max_lat, min_lon, max_lon, min_y, max_y, min_x, max_x):
+        """
+        :param min_lat, max_lat, min_lon, max_lon: Bounds of the values to add
+        :param min_y, max_y, min_x, max_x: Window of the tiles to add, indexes included
+        """
+        self.min_lat, self.max_lat, self.min_lon, self.max_lon = min_lat, max_lat, min_lon, max_lon
+        self.rows = slice(min_y, max_y + 1)
+        self.columns = slice(min_x, max_x + 1)
+        self.sums = np.zeros((max_y - min_y + 1, max_x - min_x + 1), dtype=np.float64)
+        self.counts = np.zeros(self.sums.shape, dtype=np.uint32)
+
+    def add(self, tile):
+        """
+        Add the values of the first time step of tile inside the window and the bounds.
+        """
+        window = (0, self.rows, self.columns)
+        latitudes = tile.latitudes[self.rows]
+        longitudes = tile.longitudes[self.columns]
+        valid = ~np.ma.getmaskarray(tile.data[window])
+        valid &= ~np.ma.getmaskarray(np.ma.masked_outside(latitudes, self.min_lat, self.max_lat))[:, np.newaxis]
+        valid &= ~np.ma.getmaskarray(np.ma.masked_outside(longitudes, self.min_lon, self.max_lon))[np.newaxis, :]
+        if valid.shape != self.sums.shape:
+            # A tile of a neighbouring footprint touching the bounds, smaller than the window
+            return
+
+        meta_data = tile.meta_data if tile.meta_data is not None else {}
+        if 'sum' in meta_data and 'count' in meta_data:
+            sums = np.ma.getdata(meta_data['sum'])[window]
+            counts = np.ma.filled(meta_data['count'][window], 0)
+        else:
+            sums = np.ma.getdata(tile.data)[window]
+            counts = 1
+
+        np.add(self.sums, sums, out=self.sums, where=valid & ~np.isnan(sums))
+        np.add(self.counts, counts, out=self.counts, where=valid, casting='unsafe')
+
+
+def overview_tile_id(ds, level, time, row, column):
+    return str(uuid.uuid5(OVERVIEW_NAMESPACE, '%s/%s/%s/%s/%s' % (ds, level, time, row, column)))
+
+
+def to_tile_data(tile_id, latitudes, longitudes, time, sums, counts, **meta_data):
+    """
+    :param meta_data: Additional meta data arrays, by name
+    :return: The serialized nexusproto TileData of an overview tile
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+
+    tile_data = nexusproto.TileData()
+    tile_data.tile_id = tile_id
+    grid_tile = tile_data.grid_tile
+    grid_tile.latitude.CopyFrom(to_shaped_array(latitudes.astype(np.float32)))
+    grid_tile.longitude.CopyFrom(to_shaped_array(longitudes.astype(np.float32)))
+    grid_tile.time = int(time)
+    grid_tile.variable_data.CopyFrom(to_shaped_array(means))
+    grid_tile.meta_data.extend([to_metadata('sum', sums), to_metadata('count', counts)])
+    grid_tile.meta_data.extend([to_metadata(name, array) for name, array in sorted(meta_data.iteritems())])
+
+    return tile_data.SerializeToString()
+
+
+def bbox_wkt(min_lat, max_lat, min_lon, max_lon):
+    """
+    :return: The WKT indexed in geo and geo_s for a tile with the given bounds
+    """
+    if min_lat == max_lat and min_lon == max_lon:
+        return 'POINT(%s %s)' % (min_lon, min_lat)
+    elif min_lat == max_lat or min_lon == max_lon:
+        return 'LINESTRING(%s %s, %s %s)' % (min_lon, min_lat, max_lon, max_lat)
+    return 'POLYGON((%s %s, %s %s, %s %s, %s %s, %s %s))' % (min_lon, min_lat, max_lon, min_lat, max_lon, max_lat,
+                                                            min_lon, max_lat, min_lon, min_lat)
+
+
+def to_solr_doc(tile_id, ds, overview, time, latitudes, longitudes, sums, counts):
+    """
+    :return: The Solr document of an overview tile. The unique key is filled in by SolrProxy.add_tiles.
+    """
+    min_lat, max_lat = float(latitudes[0]), float(latitudes[-1])
+    min_lon, max_lon = float(longitudes[0]), float(longitudes[-1])
+    geo = bbox_wkt(min_lat, max_lat, min_lon, max_lon)
+
+    valid = counts > 0
+    means = sums[valid] / counts[valid]
+    solr_time = datetime.utcfromtimestamp(time).strftime(SOLR_FORMAT)
+
+    return {
+        'id': tile_id,
+        'dataset_s': ds,
+        'granule_s': 'overview_level_%s' % overview.level,
+        'level_i': overview.level,
+        'tile_cell_size_d': overview.cell_size,
+        'geo': geo,
+        'geo_s': geo,
+        'tile_min_lat': min_lat,
+        'tile_max_lat': max_lat,
+        'tile_min_lon': min_lon,
+        'tile_max_lon': max_lon,
+        'tile_min_time_dt': solr_time,
+        'tile_max_time_dt': solr_time,
+        'tile_min_val_d': float(means.min()),
+        'tile_max_val_d': float(means.max()),
+        'tile_avg_val_d': float(sums.sum() / counts.sum()),
+        'tile_count_i': int(valid.sum())
+    }
+
+
+def build_overviews(tile_service, ds, levels, start_time=0, end_time=-1, tile_size=DEFAULT_TILE_SIZE, rows=500):
+    """
+    Build, or rebuild, overview levels 1 to levels of the gridded dataset ds. The full resolution tiles of each time
+    step are read once and accumulated into every level.
+    :param tile_service: NexusTileService
+    :return: Number of overview tiles written
+    """
+    overviews = None
+    written = 0
+    for time in tile_service.find_days_in_range_asc(-90, 90, -180, 180, ds, start_time, end_time):
+        for page in tile_service.find_tiles_in_box(-90, 90, -180, 180, ds, time, time, fetch_data=False, stream=True,
+                                                   rows=rows):
+            if not page:
+                continue
+            tiles = tile_service.fetch_data_for_tiles(*page, variables=[], use_cache=False)
+
+            if overviews is None:
+                cell_sizes = next((native_cell_size(tile) for tile in tiles if native_cell_size(tile) is not None), None)
+                if cell_sizes is None:
+                    log.warn("Skipping %s tiles too small to tell the cell size of %s" % (len(tiles), ds))
+                    continue
+                overviews = [OverviewLevel(level, cell_sizes[0], cell_sizes[1], tile_size)
+                             for level in xrange(1, levels + 1)]
+
+            for tile in tiles:
+                for time_index in np.flatnonzero(np.ma.getdata(tile.times) == time):
+                    for overview in overviews:
+                        overview.add(tile.latitudes, tile.longitudes, tile.data[time_index])
+
+        blobs_by_id = {}
+        solr_docs = []
+        for overview in overviews or []:
+            for (row, column), latitudes, longitudes, sums, counts in overview.tiles():
+                tile_id = overview_tile_id(ds, overview.level, time, row, column)
+                blobs_by_id[tile_id] = to_tile_data(tile_id, latitudes, longitudes, time, sums, counts)
+                solr_docs.append(to_solr_doc(tile_id, ds, overview, time, latitudes, longitudes, sums, counts))
+
+        tile_service.save_tiles(blobs_by_id, solr_docs)
+        written += len(solr_docs)
+        log.info("Wrote %s overview tiles of %s at %s" % (len(solr_docs), ds, time))
+
+    tile_service.save_tiles({}, [], commit=True)
+    return written
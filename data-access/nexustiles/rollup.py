@@ -0,0 +1,237 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Temporal rollups of gridded datasets. A rollup tile covers the footprint of the daily tiles with the same bounds over
+one calendar month or year. Each cell stores the sum, the count and the sum of squares of the valid daily values in the
+period (meta data 'sum', 'count' and 'sum_sq') and their mean as tile data, so a long-period average or variance reads
+one rollup tile per footprint and period instead of every daily tile.
+
+Rollup tiles are indexed in Solr with their period in rollup_s, the bounds of their footprint and the first and last
+second of the period as time range. Queries only return them when they ask for a rollup, see plan and
+NexusTileService.plan_rollups.
+"""
+
+import logging
+import time
+import uuid
+from calendar import timegm
+from datetime import datetime
+
+import numpy as np
+from shapely.geometry import box
+
+import pyramid
+
+DAY = 'day'
+MONTH = 'month'
+YEAR = 'year'
+
+# Meta data to request (with the variables keyword) to read the exact moments of rollup tiles
+ROLLUP_VARIABLES = ['sum', 'count', 'sum_sq']
+
+# Rollup tile ids are derived from the dataset, period and footprint so that rebuilding a period overwrites it
+ROLLUP_NAMESPACE = uuid.UUID('d0f1c6c4-3b1e-4f0a-8d55-6a2e4c9b7e13')
+
+SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+log = logging.getLogger(__name__)
+
+
+def period_start(rollup, t):
+    """
+    :return: Start, in seconds since EPOCH, of the month or year holding t
+    """
+    d = datetime.utcfromtimestamp(t)
+    return timegm((d.year, 1 if rollup == YEAR else d.month, 1, 0, 0, 0))
+
+
+def next_period(rollup, t):
+    """
+    :return: Start, in seconds since EPOCH, of the month or year following the one holding t
+    """
+    d = datetime.utcfromtimestamp(t)
+    if rollup == YEAR:
+        return timegm((d.year + 1, 1, 1, 0, 0, 0))
+    return timegm((d.year + d.month // 12, d.month % 12 + 1, 1, 0, 0, 0))
+
+
+def plan(start_time, end_time, periods):
+    """
+    Cover start_time to end_time (both included, in seconds since EPOCH) with the largest rollups built, and daily
+    tiles at the ragged edges and wherever no rollup has been built.
+    :param periods: dict of rollup to the set of period start times built, see SolrProxy.find_rollup_periods
+    :return: list of (rollup, start time, end time), rollup DAY for daily tiles. Consecutive parts read from the same
+             rollup are merged.
+    """
+    parts = []
+
+    def add(rollup, part_start, part_end):
+        if parts and parts[-1][0] == rollup:
+            parts[-1] = (rollup, parts[-1][1], part_end)
+        else:
+            parts.append((rollup, part_start, part_end))
+
+    t = start_time
+    while t <= end_time:
+        for rollup in (YEAR, MONTH):
+            if t == period_start(rollup, t) and t in periods.get(rollup, ()) and next_period(rollup, t) <= end_time + 1:
+                add(rollup, t, next_period(rollup, t) - 1)
+                t = next_period(rollup, t)
+                break
+        else:
+            part_end = min(next_period(MONTH, t) - 1, end_time)
+            add(DAY, t, part_end)
+            t = part_end + 1
+
+    return parts
+
+
+def moments(tile):
+    """
+    :return: (sums, counts, sums of squares) shaped like tile.data. For a rollup tile (read with ROLLUP_VARIABLES) these
+             are its stored moments, for a daily tile its values, one and the squared values per valid value. Masked
+             cells count zero.
+    """
+    sums, counts = pyramid.sum_count(tile)
+    meta_data = tile.meta_data if tile.meta_data is not None else {}
+    if 'sum_sq' in meta_data:
+        sums_sq = np.where(counts > 0, np.nan_to_num(np.ma.getdata(meta_data['sum_sq'])), 0.0)
+    else:
+        sums_sq = sums * sums
+
+    return sums, counts, sums_sq
+
+
+class Rollup(object):
+    """
+    Accumulates the daily tiles of one footprint over one month or year.
+    """
+
+    def __init__(self, rollup, start_time, tile):
+        self.rollup = rollup
+        self.start_time = start_time
+        self.end_time = next_period(rollup, start_time) - 1
+        self.bbox = tile.bbox
+        self.latitudes = np.ma.filled(tile.latitudes.astype(np.float32), np.nan)
+        self.longitudes = np.ma.filled(tile.longitudes.astype(np.float32), np.nan)
+        self.sums = np.zeros(tile.data.shape[1:], dtype=np.float64)
+        self.counts = np.zeros(tile.data.shape[1:], dtype=np.int32)
+        self.sums_sq = np.zeros(tile.data.shape[1:], dtype=np.float64)
+
+    def add(self, tile):
+        sums, counts, sums_sq = moments(tile)
+        self.sums += sums.sum(axis=0)
+        self.counts += counts.sum(axis=0).astype(np.int32)
+        self.sums_sq += sums_sq.sum(axis=0)
+
+    def tile_id(self, ds):
+        return str(uuid.uuid5(ROLLUP_NAMESPACE, '%s/%s/%s/%s' % (ds, self.rollup, self.start_time, tuple(self.bbox))))
+
+    def to_tile_data(self, tile_id):
+        """
+        :return: The serialized nexusproto TileData of the rollup tile
+        """
+        return pyramid.to_tile_data(tile_id, self.latitudes, self.longitudes, self.start_time, self.sums, self.counts,
+                                    sum_sq=self.sums_sq)
+
+    def to_solr_doc(self, tile_id, ds):
+        """
+        :return: The Solr document of the rollup tile. The unique key is filled in by SolrProxy.add_tiles.
+        """
+        valid = self.counts > 0
+        means = self.sums[valid] / self.counts[valid]
+        geo = pyramid.bbox_wkt(self.bbox.min_lat, self.bbox.max_lat, self.bbox.min_lon, self.bbox.max_lon)
+
+        return {
+            'id': tile_id,
+            'dataset_s': ds,
+            'granule_s': '%s_rollup_%s' % (self.rollup, datetime.utcfromtimestamp(self.start_time).strftime(
+                '%Y' if self.rollup == YEAR else '%Y-%m')),
+            'rollup_s': self.rollup,
+            'geo': geo,
+            'geo_s': geo,
+            'tile_min_lat': self.bbox.min_lat,
+            'tile_max_lat': self.bbox.max_lat,
+            'tile_min_lon': self.bbox.min_lon,
+            'tile_max_lon': self.bbox.max_lon,
+            'tile_min_time_dt': datetime.utcfromtimestamp(self.start_time).strftime(SOLR_FORMAT),
+            'tile_max_time_dt': datetime.utcfromtimestamp(self.end_time).strftime(SOLR_FORMAT),
+            'tile_min_val_d': float(means.min()),
+            'tile_max_val_d': float(means.max()),
+            'tile_avg_val_d': float(self.sums.sum() / self.counts.sum()),
+            'tile_count_i': int(valid.sum())
+        }
+
+
+def build_rollups(tile_service, ds, start_time=0, end_time=-1, rows=500):
+    """
+    Build, or rebuild, the monthly and yearly rollups of the gridded dataset ds for the periods lying entirely between
+    start_time and end_time (now if -1). Footprints are processed one at a time, reading their daily tiles once per
+    year, so memory stays bounded by a footprint's thirteen rollups.
+    :param tile_service: NexusTileService
+    :return: Number of rollup tiles written
+    """
+    if end_time < 0:
+        end_time = long(time.time())
+
+    days = tile_service.find_days_in_range_asc(-90, 90, -180, 180, ds, start_time, end_time)
+    if len(days) == 0:
+        return 0
+    footprints = tile_service.get_distinct_bounding_boxes_in_polygon(box(-180, -90, 180, 90), ds, start_time, end_time)
+
+    written = 0
+    blobs_by_id = {}
+    solr_docs = []
+    year = period_start(YEAR, days[0])
+    while year <= days[-1]:
+        year_end = next_period(YEAR, year) - 1
+        for footprint in footprints:
+            tiles = tile_service.find_tiles_by_exact_bounds(footprint.bounds, ds, max(year, start_time),
+                                                            min(year_end, end_time), fetch_data=False)
+            rollups = {}
+            for page_start in xrange(0, len(tiles), rows):
+                page = tile_service.fetch_data_for_tiles(*tiles[page_start:page_start + rows], variables=[],
+                                                         use_cache=False)
+                for tile in page:
+                    tile_time = long(np.ma.getdata(tile.times)[0])
+                    if not year <= tile_time <= year_end:
+                        continue
+                    keys = ((MONTH, period_start(MONTH, tile_time)), (YEAR, year))
+                    for key in keys:
+                        if key not in rollups:
+                            rollups[key] = Rollup(key[0], key[1], tile)
+                    if rollups[(YEAR, year)].sums.shape != tile.data.shape[1:]:
+                        log.warn("Skipping tile %s of %s, its shape differs from its footprint's" % (tile.tile_id, ds))
+                        continue
+                    for key in keys:
+                        rollups[key].add(tile)
+
+            for rollup in rollups.itervalues():
+                if start_time <= rollup.start_time and rollup.end_time <= end_time and rollup.counts.any():
+                    tile_id = rollup.tile_id(ds)
+                    blobs_by_id[tile_id] = rollup.to_tile_data(tile_id)
+                    solr_docs.append(rollup.to_solr_doc(tile_id, ds))
+
+            if len(solr_docs) >= rows:
+                tile_service.save_tiles(blobs_by_id, solr_docs)
+                written += len(solr_docs)
+                blobs_by_id, solr_docs = {}, []
+
+        log.info("Wrote rollups of %s for %s" % (ds, datetime.utcfromtimestamp(year).year))
+        year = year_end + 1
+
+    tile_service.save_tiles(blobs_by_id, solr_docs, commit=True)
+    return written + len(solr_docs)
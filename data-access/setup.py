@@ -31,7 +31,7 @@ setup(
     description="NEXUS API.",
     long_description=open('README.md').read(),
 
-    packages=['nexustiles', 'nexustiles.model', 'nexustiles.dao'],
+    packages=['nexustiles', 'nexustiles.model', 'nexustiles.dao', 'nexustiles.cache'],
     package_data={'nexustiles': ['config/datastores.ini']},
     platforms='any',
     python_requires='~=2.7',
@@ -0,0 +1,149 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ConfigParser
+import json
+
+import numpy as np
+import pkg_resources
+import tornado.web
+from shapely.geometry import box
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from nexustiles.dao.AsyncSolrProxy import AsyncSolrProxy
+from nexustiles.model.nexusmodel import Tile
+from nexustiles.nexustiles_async import AsyncNexusTileService, _to_tornado_future
+
+DOCS = [{'id': 'tile-%d' % i, 'solr_id_s': 'tile-%d' % i} for i in xrange(5)]
+
+
+class FakeSelectHandler(tornado.web.RequestHandler):
+    def post(self):
+        self.application.requests.append(self.request.body_arguments)
+
+        if self.get_body_argument('facet', None) == 'true':
+            response = {
+                'response': {'numFound': 2, 'start': 0, 'docs': []},
+                'facet_counts': {'facet_fields': {'tile_min_time_dt': ['1970-01-02T00:00:00Z', 3,
+                                                                       '1970-01-01T00:00:00Z', 2]}}
+            }
+        else:
+            rows = int(self.get_body_argument('rows', 10))
+            cursor = self.get_body_argument('cursorMark')
+            start = 0 if cursor == '*' else int(cursor)
+            docs = DOCS[start:start + rows]
+            response = {
+                'response': {'numFound': len(DOCS), 'start': 0, 'docs': docs},
+                'nextCursorMark': str(start + len(docs)) if docs else cursor
+            }
+
+        self.write(json.dumps(response))
+
+
+class FakeDatastore(object):
+    def __init__(self):
+        self.fetched = []
+
+    def fetch_nexus_tiles(self, *tile_ids):
+        self.fetched.extend(tile_ids)
+        return [FakeTileData(tile_id) for tile_id in tile_ids]
+
+
+class FakeTileData(object):
+    def __init__(self, tile_id):
+        self.tile_id = tile_id
+
+    def get_lat_lon_time_data_meta(self, sparse=False):
+        return np.arange(2.0), np.arange(3.0), np.array([0]), np.ma.zeros((1, 2, 3)), {}
+
+
+class FakeResponseFuture(object):
+    def add_callbacks(self, callback, errback):
+        self.callback = callback
+        self.errback = errback
+
+
+class TestAsyncSolrProxy(AsyncHTTPTestCase):
+    def get_app(self):
+        self.app = tornado.web.Application([(r'/solr/nexustiles/select', FakeSelectHandler)])
+        self.app.requests = []
+        return self.app
+
+    def setUp(self):
+        super(TestAsyncSolrProxy, self).setUp()
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+        config.set("solr", "host", "127.0.0.1:%d" % self.get_http_port())
+        self.proxy = AsyncSolrProxy(config)
+
+    @gen_test
+    def test_do_query_all_pages_with_cursor(self):
+        results = yield self.proxy.do_query_all(*('*:*', None, None, False, None), rows=2)
+
+        self.assertEqual(DOCS, results)
+        self.assertEqual(['solr_id_s asc'], self.app.requests[0]['sort'])
+        self.assertEqual(3, len(self.app.requests))
+
+    @gen_test
+    def test_do_query_all_shorter_than_a_page_takes_one_query(self):
+        results = yield self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10)
+
+        self.assertEqual(DOCS, results)
+        self.assertEqual(1, len(self.app.requests))
+
+    @gen_test
+    def test_find_days_in_range_asc(self):
+        days = yield self.proxy.find_days_in_range_asc(-10, 10, -10, 10, 'test_ds', 0, 86400 * 2)
+
+        self.assertEqual([0.0, 86400.0], days)
+        self.assertEqual(['test_ds!'], self.app.requests[0]['shard_keys'])
+
+    @gen_test
+    def test_query_methods_return_futures(self):
+        results = yield self.proxy.find_all_tiles_in_polygon(box(-10, -10, 10, 10), 'test_ds', rows=3)
+
+        self.assertEqual(DOCS, results)
+
+
+class TestAsyncNexusTileService(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([])
+
+    def setUp(self):
+        super(TestAsyncNexusTileService, self).setUp()
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+        self.service = AsyncNexusTileService(skipDatastore=True, config=config)
+        self.service._datastore = FakeDatastore()
+
+    @gen_test
+    def test_fetch_data_for_tiles(self):
+        tile = Tile()
+        tile.tile_id = 'tile-1'
+
+        tiles = yield self.service.fetch_data_for_tiles(tile, use_cache=False)
+
+        self.assertEqual(['tile-1'], self.service._datastore.fetched)
+        self.assertEqual((1, 2, 3), tiles[0].data.shape)
+
+    @gen_test
+    def test_driver_future_is_resolved_on_the_ioloop(self):
+        response_future = FakeResponseFuture()
+        future = _to_tornado_future(response_future)
+
+        response_future.callback([{'tile_id': 'a'}])
+
+        rows = yield future
+        self.assertEqual([{'tile_id': 'a'}], rows)
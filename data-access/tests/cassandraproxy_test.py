@@ -0,0 +1,192 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ConfigParser
+import threading
+import time
+import unittest
+import uuid
+from StringIO import StringIO
+
+from cassandra.cqlengine import models
+
+import nexustiles.dao.CassandraProxy as CassandraProxy
+
+
+class FakeStatement(object):
+    def __init__(self, query):
+        self.query = query
+
+
+class FakeResponseFuture(object):
+    """
+    Completes on another thread, like the driver's event loop does, after a delay.
+    """
+    has_more_pages = False
+
+    def __init__(self, session, outcome, delay):
+        self.session = session
+        self.outcome = outcome
+        self.delay = delay
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), callback_kwargs=None,
+                      errback_kwargs=None):
+        def complete():
+            time.sleep(self.delay)
+            self.session.complete()
+            if isinstance(self.outcome, Exception):
+                errback(self.outcome, *errback_args, **(errback_kwargs or {}))
+            else:
+                callback(self.outcome, *callback_args, **(callback_kwargs or {}))
+
+        threading.Thread(target=complete).start()
+
+    def clear_callbacks(self):
+        pass
+
+    def result(self):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+class FakeSession(object):
+    def __init__(self, blobs, errors=()):
+        """
+        :param blobs: dict of tile UUID to blob, ids not in it have no row
+        :param errors: tile UUIDs whose query fails
+        """
+        self.blobs = blobs
+        self.errors = set(errors)
+        self.prepared = []
+        self.queried = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def prepare(self, query):
+        self.prepared.append(query)
+        return FakeStatement(query)
+
+    def execute_async(self, statement, parameters, *args, **kwargs):
+        assert statement.query.startswith("SELECT tile_id, tile_blob FROM ")
+        tile_id, = parameters
+        with self.lock:
+            self.queried.append(tile_id)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        if tile_id in self.errors:
+            outcome = RuntimeError("Read timeout for %s" % tile_id)
+        elif tile_id in self.blobs:
+            outcome = [{'tile_id': tile_id, 'tile_blob': self.blobs[tile_id]}]
+        else:
+            outcome = []
+        # Later queries complete first, so results arrive out of order
+        return FakeResponseFuture(self, outcome, 0.001 * (20 - len(self.queried) % 20))
+
+    def complete(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+class FakeConnection(object):
+    def __init__(self, session):
+        self.session = session
+
+    def get_cluster(self):
+        return None
+
+    def get_session(self):
+        return self.session
+
+
+def _config(fetch_concurrency):
+    cp = ConfigParser.RawConfigParser()
+    cp.readfp(StringIO("""[cassandra]
+host=localhost
+keyspace=nexustiles
+local_datacenter=datacenter1
+protocol_version=3
+fetch_concurrency=%s""" % fetch_concurrency))
+    return cp
+
+
+class TestCassandraProxy(unittest.TestCase):
+    def setUp(self):
+        self.tile_ids = [str(uuid.uuid4()) for _ in range(30)]
+        self.blobs = {uuid.UUID(tile_id): "blob-%s" % tile_id for tile_id in self.tile_ids}
+        self._connection = CassandraProxy.connection
+        self._default_keyspace = models.DEFAULT_KEYSPACE
+        models.DEFAULT_KEYSPACE = 'nexustiles'
+
+    def tearDown(self):
+        CassandraProxy.connection = self._connection
+        models.DEFAULT_KEYSPACE = self._default_keyspace
+
+    def proxy(self, session, fetch_concurrency=4):
+        CassandraProxy.connection = FakeConnection(session)
+        return CassandraProxy.CassandraProxy(_config(fetch_concurrency))
+
+    def test_fetch_preserves_order(self):
+        session = FakeSession(self.blobs)
+        proxy = self.proxy(session)
+
+        tiles = proxy.fetch_nexus_tiles(*self.tile_ids)
+
+        self.assertEqual(self.tile_ids, [str(tile.tile_id) for tile in tiles])
+        self.assertEqual(["blob-%s" % tile_id for tile_id in self.tile_ids], [tile.tile_blob for tile in tiles])
+
+    def test_missing_rows_are_left_out(self):
+        missing = set(self.tile_ids[::3])
+        session = FakeSession({tile_id: blob for tile_id, blob in self.blobs.iteritems()
+                               if str(tile_id) not in missing})
+        proxy = self.proxy(session)
+
+        tiles = proxy.fetch_nexus_tiles(*self.tile_ids)
+
+        self.assertEqual([tile_id for tile_id in self.tile_ids if tile_id not in missing],
+                         [str(tile.tile_id) for tile in tiles])
+
+    def test_first_error_is_raised(self):
+        session = FakeSession(self.blobs, errors=[uuid.UUID(self.tile_ids[5])])
+        proxy = self.proxy(session)
+
+        with self.assertRaises(RuntimeError):
+            proxy.fetch_nexus_tiles(*self.tile_ids)
+
+    def test_fetch_concurrency_bounds_requests_in_flight(self):
+        session = FakeSession(self.blobs)
+        proxy = self.proxy(session, fetch_concurrency=3)
+
+        proxy.fetch_nexus_tiles(*self.tile_ids)
+        proxy.fetch_nexus_tiles(*self.tile_ids[:5])
+
+        self.assertEqual(3, proxy.fetch_concurrency)
+        self.assertLessEqual(session.max_in_flight, 3)
+        self.assertEqual(35, len(session.queried))
+        # The statement is prepared once and reused
+        self.assertEqual(1, len(session.prepared))
+
+    def test_invalid_ids_are_not_queried(self):
+        session = FakeSession(self.blobs)
+        proxy = self.proxy(session)
+
+        self.assertEqual([], proxy.fetch_nexus_tiles(None, 42))
+        self.assertEqual([], session.queried)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of the daily statistics of a time series partition (TimeSeriesSpark.calc_average_on_day without the
+tile queries). For synthetic partitions of masked grid tiles it reports the time to compute mean, std, min, max and
+count of every day with the previous implementation (np.hstack of the tiles of each day and separate np.ma
+reductions), with Tile.get_aggregates merged tile by tile, and with one reduce_aggregates over the whole partition.
+
+Usage: python tests/nexusmodel_benchmark.py [repeats]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from nexustiles.model.nexusmodel import Tile, TileAggregates, EMPTY_AGGREGATES, reduce_aggregates
+
+
+def make_partition(days=30, tiles_per_day=50, n=30):
+    tiles = []
+    for day in xrange(days):
+        for tile_index in xrange(tiles_per_day):
+            tile = Tile()
+            tile.latitudes = np.ma.array(np.linspace(-60, 60, n, dtype=np.float32))
+            tile.longitudes = np.ma.array(np.linspace(0, 10, n, dtype=np.float32))
+            tile.times = np.array([day * 86400])
+            data = np.random.rand(1, n, n).astype(np.float32)
+            data[np.random.rand(1, n, n) < 0.2] = np.nan
+            tile.data = np.ma.masked_invalid(data)
+            tiles.append(tile)
+    return [day * 86400 for day in xrange(days)], tiles
+
+
+def legacy_stats(timestamps, tiles):
+    """The per day reductions previously done by calc_average_on_day."""
+    tile_dict = dict((timeinseconds, []) for timeinseconds in timestamps)
+    for i, tile in enumerate(tiles):
+        tile_dict[tile.times[0]].append(i)
+
+    stats = []
+    for timeinseconds in timestamps:
+        cur_tile_list = tile_dict[timeinseconds]
+        data = np.ma.array(data=np.hstack([tiles[i].data.data.flatten() for i in cur_tile_list]),
+                           mask=np.hstack([tiles[i].data.mask.flatten() for i in cur_tile_list]))
+        lats = np.hstack([np.repeat(tiles[i].latitudes, len(tiles[i].longitudes)) for i in cur_tile_list])
+        stats.append((np.ma.min(data), np.ma.max(data), np.ma.average(data, weights=np.cos(np.radians(lats))),
+                      np.ma.count(data), np.ma.std(data)))
+    return stats
+
+
+def merged_stats(timestamps, tiles):
+    daily_aggregates = dict((timeinseconds, EMPTY_AGGREGATES) for timeinseconds in timestamps)
+    for tile in tiles:
+        timeinseconds = int(tile.times[0])
+        daily_aggregates[timeinseconds] = daily_aggregates[timeinseconds].merge(tile.get_aggregates())
+    return [(a.min, a.max, a.mean, a.count, a.std) for a in (daily_aggregates[t] for t in timestamps)]
+
+
+def grouped_stats(timestamps, tiles):
+    values, weights, times = [], [], []
+    for tile in tiles:
+        tile_values, tile_weights = tile.get_valid_values()
+        values.append(tile_values)
+        weights.append(tile_weights)
+        times.append(np.full(tile_values.size, int(tile.times[0]), dtype=np.int64))
+    days = np.array(timestamps, dtype=np.int64)
+    a = reduce_aggregates(np.searchsorted(days, np.concatenate(times)), len(days),
+                          TileAggregates.of_values(np.concatenate(values), np.concatenate(weights)))
+    return zip(a.min, a.max, a.mean, a.count, a.std)
+
+
+IMPLEMENTATIONS = [
+    ('legacy', legacy_stats),
+    ('merged', merged_stats),
+    ('grouped', grouped_stats),
+]
+
+
+def main(repeats=5):
+    print '%-6s %-6s %-8s %12s %10s' % ('days', 'tiles', 'impl', 'ms / part', 'speedup')
+    for days, tiles_per_day, n in [(10, 10, 30), (30, 50, 30), (90, 20, 100)]:
+        timestamps, tiles = make_partition(days, tiles_per_day, n)
+
+        expected = np.array(legacy_stats(timestamps, tiles), dtype=np.float64)
+        baseline = None
+        for name, implementation in IMPLEMENTATIONS:
+            np.testing.assert_allclose(expected, np.array(implementation(timestamps, tiles), dtype=np.float64),
+                                       rtol=1e-5)
+            seconds = timeit.timeit(lambda: implementation(timestamps, tiles), number=repeats) / repeats
+            baseline = baseline or seconds
+            print '%-6d %-6d %-8s %12.2f %9.1fx' % (days, days * tiles_per_day, name, seconds * 1000,
+                                                    baseline / seconds)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
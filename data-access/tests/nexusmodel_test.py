@@ -14,9 +14,11 @@
 # limitations under the License.
 
 
+import pickle
 import unittest
 import numpy as np
-from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon, Tile, BBox
+from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon, Tile, BBox, LazyMetaData, EMPTY_AGGREGATES, \
+    TileAggregates, reduce_aggregates, SparseTileArray
 
 
 class TestApproximateValueMethod(unittest.TestCase):
@@ -379,3 +381,181 @@ class TestMergeTilesMethod(unittest.TestCase):
         from nexustiles.model.nexusmodel import merge_tiles
 
         self.assertRaises(Exception, lambda _: merge_tiles([tile1, tile2]))
+
+
+class TestLazyMetaData(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def loader(name):
+            def load():
+                self.calls.append(name)
+                return np.ma.arange(4.0).reshape((1, 2, 2))
+            return load
+
+        self.meta = LazyMetaData({'wind_u': loader('wind_u'), 'wind_v': loader('wind_v')}, nbytes=64)
+
+    def test_names_do_not_decode(self):
+        self.assertItemsEqual(['wind_u', 'wind_v'], self.meta.keys())
+        self.assertTrue('wind_u' in self.meta)
+        self.assertEqual(2, len(self.meta))
+        self.assertEqual([], self.calls)
+
+    def test_decodes_once_on_access(self):
+        self.meta['wind_u']
+        self.meta['wind_u']
+
+        self.assertEqual(['wind_u'], self.calls)
+        self.assertTrue(self.meta.is_decoded('wind_u'))
+        self.assertFalse(self.meta.is_decoded('wind_v'))
+
+    def test_subset(self):
+        subset = self.meta.subset(['wind_v', 'missing'])
+
+        self.assertEqual(['wind_v'], list(subset))
+        self.assertEqual(0, self.meta.subset([]).nbytes)
+
+    def test_pickles_as_dict(self):
+        unpickled = pickle.loads(pickle.dumps(self.meta))
+
+        self.assertEqual(dict, type(unpickled))
+        self.assertItemsEqual(['wind_u', 'wind_v'], unpickled.keys())
+
+
+class TestSparseTile(unittest.TestCase):
+    def setUp(self):
+        # Single time swath: values on the diagonal of a 1 x 4 x 4 tile
+        points = np.arange(4)
+        values = np.ma.masked_invalid(np.array([1.0, np.nan, 0.0, 4.0], dtype=np.float32))
+        self.sparse = SparseTileArray((1, 4, 4), (np.zeros(4, dtype=points.dtype), points, points), values)
+
+        self.tile = Tile()
+        self.tile.latitudes = np.ma.array([0.0, 10.0, 20.0, 30.0])
+        self.tile.longitudes = np.ma.array([100.0, 110.0, 120.0, 130.0])
+        self.tile.times = np.array([1000])
+        self.tile.data = self.sparse
+
+    def dense_tile(self):
+        tile = Tile()
+        tile.latitudes, tile.longitudes, tile.times = self.tile.latitudes, self.tile.longitudes, self.tile.times
+        tile.data = self.sparse.todense()
+        return tile
+
+    def test_todense_is_float64(self):
+        dense = self.sparse.todense()
+
+        self.assertEqual(np.float64, dense.dtype)
+        self.assertEqual(3, np.ma.count(dense))
+        self.assertEqual(4.0, dense[0, 3, 3])
+
+    def test_point_lookup(self):
+        self.assertEqual(4.0, self.sparse[0, 3, 3])
+        self.assertIs(np.ma.masked, self.sparse[0, 1, 1])
+        self.assertIs(np.ma.masked, self.sparse[0, 0, 3])
+
+    def test_indices_and_points_do_not_densify(self):
+        indices = self.tile.get_indices()
+        points = list(self.tile.nexus_point_generator())
+        values, weights = self.tile.get_valid_values()
+
+        self.assertIs(self.sparse, self.tile.sparse_data)
+        self.assertEqual(self.dense_tile().get_indices(), indices)
+        self.assertEqual([(0.0, 100.0, (0, 0, 0), 1.0), (30.0, 130.0, (0, 3, 3), 4.0)],
+                         [(p.latitude, p.longitude, tuple(p.index), p.data_val) for p in points])
+        self.assertEqual([(p.latitude, p.longitude, tuple(p.index), p.data_val)
+                          for p in self.dense_tile().nexus_point_generator()],
+                         [(p.latitude, p.longitude, tuple(p.index), p.data_val) for p in points])
+        np.testing.assert_array_equal(self.dense_tile().get_valid_values()[0], values)
+        np.testing.assert_allclose(self.dense_tile().get_valid_values()[1], weights)
+
+    def test_data_densifies_on_read(self):
+        data = self.tile.data
+
+        self.assertIsNone(self.tile.sparse_data)
+        self.assertEqual((1, 4, 4), data.shape)
+        self.assertEqual(3, np.ma.count(data))
+
+    def test_masked_where(self):
+        masked = self.sparse.masked_where(np.array([False]), np.array([False, False, False, True]),
+                                          np.array([True, False, False, False]))
+
+        self.assertEqual(1, masked.count())
+        self.assertEqual(3, self.sparse.count())
+
+
+class TestTileAggregates(unittest.TestCase):
+    def setUp(self):
+        self.tile = Tile()
+        self.tile.latitudes = np.ma.masked_outside(np.array([0.0, 30.0, 60.0]), 0.0, 40.0)
+        self.tile.longitudes = np.array([10.0, 20.0])
+        self.tile.times = np.array([0])
+        data = np.array([[[1.0, 2.0], [np.nan, 4.0], [5.0, 6.0]]])
+        self.tile.data = np.ma.masked_where(np.ma.getmaskarray(self.tile.latitudes)[np.newaxis, :, np.newaxis]
+                                            .repeat(2, axis=2), data)
+
+    def test_matches_direct_statistics(self):
+        aggregates = self.tile.get_aggregates()
+
+        values = np.array([1.0, 2.0, 4.0])
+        weights = np.cos(np.radians([0.0, 0.0, 30.0]))
+        self.assertEqual(3, aggregates.count)
+        self.assertEqual(1.0, aggregates.min)
+        self.assertEqual(4.0, aggregates.max)
+        self.assertAlmostEqual(np.average(values, weights=weights), aggregates.mean)
+        self.assertAlmostEqual(np.std(values), aggregates.std)
+
+    def test_merge(self):
+        other = Tile()
+        other.latitudes = np.array([0.0])
+        other.longitudes = np.array([0.0])
+        other.times = np.array([0])
+        other.data = np.array([[[10.0]]])
+
+        merged = EMPTY_AGGREGATES.merge(self.tile.get_aggregates()).merge(other.get_aggregates())
+
+        values = np.array([1.0, 2.0, 4.0, 10.0])
+        weights = np.cos(np.radians([0.0, 0.0, 30.0, 0.0]))
+        self.assertEqual(4, merged.count)
+        self.assertEqual(1.0, merged.min)
+        self.assertEqual(10.0, merged.max)
+        self.assertAlmostEqual(np.average(values, weights=weights), merged.mean)
+        self.assertAlmostEqual(np.std(values), merged.std)
+
+    def test_empty_tile(self):
+        self.tile.data = np.ma.masked_all((1, 3, 2))
+
+        self.assertEqual(EMPTY_AGGREGATES, self.tile.get_aggregates())
+
+    def test_reduce_matches_merge(self):
+        other = Tile()
+        other.latitudes = np.array([0.0, 45.0])
+        other.longitudes = np.array([0.0])
+        other.times = np.array([0])
+        other.data = np.array([[[10.0], [-3.0]]])
+        values, weights = other.get_valid_values()
+
+        # Group 0 holds the stored aggregates of self.tile and the values of other, group 1 is empty and group 2 holds
+        # one more value
+        stored = self.tile.get_aggregates()
+        elements = TileAggregates(*[np.concatenate(([field], value_field))
+                                    for field, value_field in zip(stored, TileAggregates.of_values(
+                                        np.append(values, 7.0), np.append(weights, 1.0)))])
+        reduced = reduce_aggregates(np.array([0, 0, 0, 2]), 3, elements)
+
+        merged = stored.merge(other.get_aggregates())
+        for field in TileAggregates._fields:
+            self.assertAlmostEqual(getattr(merged, field), getattr(reduced, field)[0])
+        self.assertAlmostEqual(merged.mean, reduced.mean[0])
+        self.assertAlmostEqual(merged.std, reduced.std[0])
+
+        self.assertEqual(0, reduced.count[1])
+        self.assertTrue(np.isnan(reduced.min[1]) and np.isnan(reduced.max[1]))
+        self.assertEqual((1, 7.0, 7.0), (reduced.count[2], reduced.min[2], reduced.max[2]))
+
+    def test_reduce_nothing(self):
+        reduced = reduce_aggregates(np.array([], dtype=int), 2,
+                                    TileAggregates.of_values(np.empty(0), np.empty(0)))
+
+        self.assertEqual([0, 0], reduced.count.tolist())
+        self.assertEqual([0.0, 0.0], reduced.weight_sum.tolist())
+        self.assertTrue(np.isnan(reduced.min).all())
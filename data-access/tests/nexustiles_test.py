@@ -18,7 +18,7 @@ import time
 import unittest
 from StringIO import StringIO
 
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import NexusTileService, get_tile_service
 from shapely.geometry import box
 
 
@@ -82,6 +82,16 @@ store=cassandra""")
         for tile in tiles:
             print tile.get_summary()
 
+
+class TestTileServiceRegistry(unittest.TestCase):
+    def test_one_service_per_configuration(self):
+        service = get_tile_service(skipDatastore=True, skipMetadatastore=True)
+
+        self.assertIs(service, get_tile_service(skipDatastore=True, skipMetadatastore=True))
+        self.assertIsInstance(service, NexusTileService)
+        self.assertIsNot(service, get_tile_service(skipDatastore=True, skipMetadatastore=False))
+
+
 # from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon
 # import numpy as np
 #
@@ -0,0 +1,216 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import nexusproto.DataTile_pb2 as nexusproto
+import numpy as np
+
+from nexustiles.dao.TileDecoder import decode_lat_lon_time_data_meta
+from nexustiles.model.nexusmodel import Tile
+from nexustiles.nexustiles import NexusTileService
+from nexustiles.pyramid import OverviewLevel, WindowSum, build_overviews, sum_count, to_solr_doc, to_tile_data
+
+
+def native_tile(latitudes, longitudes, time, data):
+    tile = Tile()
+    tile.tile_id = 'native'
+    tile.latitudes = np.ma.masked_invalid(latitudes)
+    tile.longitudes = np.ma.masked_invalid(longitudes)
+    tile.times = np.array([time])
+    tile.data = np.ma.masked_invalid(data[np.newaxis, :, :])
+    return tile
+
+
+class TestOverviewLevel(unittest.TestCase):
+    def test_cells_hold_exact_sums_and_counts(self):
+        overview = OverviewLevel(1, 0.5, 0.5, tile_size=4)
+        data = np.array([[1.0, 2.0, 3.0], [4.0, np.nan, 6.0]])
+        overview.add(np.array([0.25, 0.75]), np.array([0.25, 0.75, 1.25]), data)
+
+        tiles = overview.tiles()
+
+        self.assertEqual(1, len(tiles))
+        (row, column), latitudes, longitudes, sums, counts = tiles[0]
+        # Cell (90, 180) of the 1 degree grid is cell (2, 0) of tile (22, 45)
+        self.assertEqual((22, 45), (row, column))
+        self.assertAlmostEqual(0.5, latitudes[2])
+        self.assertAlmostEqual(0.5, longitudes[0])
+        self.assertEqual((7.0, 3), (sums[2, 0], counts[2, 0]))
+        self.assertEqual((9.0, 2), (sums[2, 1], counts[2, 1]))
+        self.assertEqual(5, counts.sum())
+        self.assertEqual([], overview.tiles())
+
+    def test_tiles_are_cut_to_the_globe(self):
+        overview = OverviewLevel(2, 1.0, 1.0, tile_size=32)
+        overview.add(np.array([89.5]), np.array([179.5]), np.array([[1.0]]))
+
+        (row, column), latitudes, longitudes, sums, counts = overview.tiles()[0]
+
+        self.assertEqual((45, 90), (len(latitudes) + row * 32, len(longitudes) + column * 32))
+        self.assertAlmostEqual(88.0, latitudes[-1])
+        self.assertAlmostEqual(178.0, longitudes[-1])
+        self.assertEqual(1, counts[-1, -1])
+
+
+class TestOverviewTiles(unittest.TestCase):
+    def setUp(self):
+        self.overview = OverviewLevel(1, 0.5, 0.5, tile_size=2)
+        self.latitudes = np.array([0.5, 1.5])
+        self.longitudes = np.array([10.5, 11.5])
+        self.sums = np.array([[3.0, 0.0], [8.0, 1.0]])
+        self.counts = np.array([[2, 0], [4, 1]], dtype=np.int32)
+
+    def test_tile_data_round_trip(self):
+        blob = to_tile_data('overview', self.latitudes, self.longitudes, 1000, self.sums, self.counts)
+
+        latitudes, longitudes, times, data, meta_data = decode_lat_lon_time_data_meta(
+            nexusproto.TileData.FromString(blob))
+
+        np.testing.assert_array_equal(self.latitudes, latitudes)
+        self.assertEqual([1000], times.tolist())
+        self.assertEqual([[1.5, None], [2.0, 1.0]], data[0].tolist())
+
+        tile = native_tile(latitudes, longitudes, 1000, np.ma.getdata(data[0]))
+        tile.meta_data = meta_data
+        sums, counts = sum_count(tile)
+        np.testing.assert_array_equal(self.sums[np.newaxis], sums)
+        np.testing.assert_array_equal(self.counts[np.newaxis], counts)
+
+    def test_solr_doc(self):
+        doc = to_solr_doc('overview', 'ds', self.overview, 86400, self.latitudes, self.longitudes, self.sums,
+                          self.counts)
+
+        self.assertEqual(1, doc['level_i'])
+        self.assertEqual(1.0, doc['tile_cell_size_d'])
+        self.assertEqual('1970-01-02T00:00:00Z', doc['tile_min_time_dt'])
+        self.assertEqual('POLYGON((10.5 0.5, 11.5 0.5, 11.5 1.5, 10.5 1.5, 10.5 0.5))', doc['geo'])
+        self.assertEqual(3, doc['tile_count_i'])
+        self.assertEqual((1.0, 2.0), (doc['tile_min_val_d'], doc['tile_max_val_d']))
+        self.assertAlmostEqual(12.0 / 7, doc['tile_avg_val_d'])
+
+    def test_sum_count_of_native_tile(self):
+        tile = native_tile(self.latitudes, self.longitudes, 0, np.array([[1.0, np.nan], [2.0, 3.0]]))
+
+        sums, counts = sum_count(tile)
+
+        self.assertEqual([[[1.0, 0.0], [2.0, 3.0]]], sums.tolist())
+        self.assertEqual([[[1, 0], [1, 1]]], counts.tolist())
+
+
+class TestWindowSum(unittest.TestCase):
+    def setUp(self):
+        self.latitudes = np.array([0.5, 1.5, 2.5])
+        self.longitudes = np.array([10.5, 11.5, 12.5])
+        # Rows 1 to 2 and columns 0 to 2 of the tiles, the bounds leave out column 2
+        self.window_sum = WindowSum(1.0, 3.0, 10.0, 12.0, 1, 2, 0, 2)
+
+    def test_values_inside_window_and_bounds(self):
+        self.window_sum.add(native_tile(self.latitudes, self.longitudes, 0,
+                                        np.array([[9.0, 9.0, 9.0], [1.0, np.nan, 9.0], [2.0, 3.0, 9.0]])))
+        self.window_sum.add(native_tile(self.latitudes, self.longitudes, 86400,
+                                        np.array([[9.0, 9.0, 9.0], [4.0, 5.0, 9.0], [np.nan, 6.0, 9.0]])))
+
+        self.assertEqual([[5.0, 5.0, 0.0], [2.0, 9.0, 0.0]], self.window_sum.sums.tolist())
+        self.assertEqual([[2, 1, 0], [1, 2, 0]], self.window_sum.counts.tolist())
+
+    def test_stored_sums_and_counts(self):
+        tile = native_tile(self.latitudes, self.longitudes, 0, np.ones((3, 3)))
+        tile.meta_data = {'sum': np.full((1, 3, 3), 6.0), 'count': np.full((1, 3, 3), 3)}
+
+        self.window_sum.add(tile)
+
+        self.assertEqual([[6.0, 6.0, 0.0], [6.0, 6.0, 0.0]], self.window_sum.sums.tolist())
+        self.assertEqual([[3, 3, 0], [3, 3, 0]], self.window_sum.counts.tolist())
+
+    def test_smaller_neighbour_is_skipped(self):
+        self.window_sum.add(native_tile(np.array([3.0]), np.array([10.5]), 0, np.array([[1.0]])))
+
+        self.assertFalse(self.window_sum.counts.any())
+
+
+class FakeTileService(object):
+    def __init__(self, tiles_by_time):
+        self.tiles_by_time = tiles_by_time
+        self.saved = []
+
+    def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time):
+        return sorted(self.tiles_by_time)
+
+    def find_tiles_in_box(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
+        return iter([self.tiles_by_time[start_time], []])
+
+    def fetch_data_for_tiles(self, *tiles, **kwargs):
+        return tiles
+
+    def save_tiles(self, blobs_by_id, solr_docs, commit=False):
+        self.saved.append((blobs_by_id, solr_docs, commit))
+
+
+class TestBuildOverviews(unittest.TestCase):
+    def test_every_level_is_built_per_time_step(self):
+        latitudes = np.arange(-89.5, 90, 1.0)
+        longitudes = np.arange(-179.5, 180, 1.0)
+        data = np.ones((len(latitudes), len(longitudes)))
+        tiles_by_time = dict((time, [native_tile(latitudes, longitudes[:180], time, data[:, :180]),
+                                     native_tile(latitudes, longitudes[180:], time, data[:, 180:])])
+                             for time in [0, 86400])
+        tile_service = FakeTileService(tiles_by_time)
+
+        written = build_overviews(tile_service, 'ds', 2, tile_size=32)
+
+        # Level 1 is 90 x 180 cells in 3 x 6 tiles, level 2 45 x 90 cells in 2 x 3 tiles
+        self.assertEqual(2 * (18 + 6), written)
+        blobs_by_id, solr_docs, commit = tile_service.saved[0]
+        self.assertEqual(24, len(blobs_by_id))
+        for level, cells in [(1, 90 * 180), (2, 45 * 90)]:
+            self.assertEqual(cells, sum(doc['tile_count_i'] for doc in solr_docs if doc['level_i'] == level))
+        self.assertTrue(all(doc['tile_avg_val_d'] == 1.0 for doc in solr_docs))
+        self.assertEqual(({}, [], True), tile_service.saved[-1])
+
+
+class FakeMetadataStore(object):
+    def __init__(self, levels):
+        self.levels = levels
+        self.calls = 0
+
+    def find_overview_levels(self, ds):
+        self.calls += 1
+        return self.levels
+
+
+class TestOverviewLevelSelection(unittest.TestCase):
+    def setUp(self):
+        self.service = NexusTileService(skipDatastore=True, skipMetadatastore=True)
+        self.service._metadatastore = FakeMetadataStore({1: 0.5, 2: 1.0, 3: 2.0})
+
+    def test_coarsest_level_not_coarser_than_resolution(self):
+        self.assertEqual(2, self.service.get_overview_level('ds', 1.0))
+        self.assertEqual(3, self.service.get_overview_level('ds', 10.0))
+        self.assertEqual(0, self.service.get_overview_level('ds', 0.25))
+        self.assertEqual(1, self.service._metadatastore.calls)
+
+    def test_resolution_option_becomes_level(self):
+        kwargs = {'resolution': 1.5, 'fetch_data': False}
+        self.service._resolve_level('ds', kwargs)
+        self.assertEqual({'level': 2, 'fetch_data': False}, kwargs)
+
+        kwargs = {'resolution': 1.5, 'level': 0}
+        self.service._resolve_level('ds', kwargs)
+        self.assertEqual({'level': 0}, kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
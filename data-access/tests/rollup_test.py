@@ -0,0 +1,182 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from calendar import timegm
+
+import nexusproto.DataTile_pb2 as nexusproto
+import numpy as np
+from shapely.geometry import box
+
+from nexustiles.dao.TileDecoder import decode_lat_lon_time_data_meta
+from nexustiles.model.nexusmodel import Tile, BBox
+from nexustiles.nexustiles import NexusTileService
+from nexustiles.rollup import DAY, MONTH, YEAR, Rollup, build_rollups, moments, plan
+
+
+def day(year, month, day_of_month, hour=0):
+    return timegm((year, month, day_of_month, hour, 0, 0))
+
+
+def daily_tile(time, data):
+    tile = Tile()
+    tile.tile_id = 'daily-%s' % time
+    tile.bbox = BBox(0.5, 1.5, 10.5, 11.5)
+    tile.latitudes = np.ma.masked_invalid(np.array([0.5, 1.5]))
+    tile.longitudes = np.ma.masked_invalid(np.array([10.5, 11.5]))
+    tile.times = np.array([time])
+    tile.data = np.ma.masked_invalid(np.array(data, dtype=np.float64)[np.newaxis, :, :])
+    return tile
+
+
+class TestPlan(unittest.TestCase):
+    def test_no_rollups_reads_daily_tiles(self):
+        self.assertEqual([(DAY, day(2010, 3, 15), day(2012, 6, 1))], plan(day(2010, 3, 15), day(2012, 6, 1), {}))
+
+    def test_largest_rollups_with_ragged_edges(self):
+        periods = {
+            YEAR: {day(2011, 1, 1), day(2012, 1, 1)},
+            MONTH: set(day(y, m, 1) for y in (2010, 2011, 2012, 2013) for m in xrange(1, 13))
+        }
+
+        parts = plan(day(2010, 11, 15), day(2013, 2, 10, 12), periods)
+
+        self.assertEqual([(DAY, day(2010, 11, 15), day(2010, 12, 1) - 1),
+                          (MONTH, day(2010, 12, 1), day(2011, 1, 1) - 1),
+                          (YEAR, day(2011, 1, 1), day(2013, 1, 1) - 1),
+                          (MONTH, day(2013, 1, 1), day(2013, 2, 1) - 1),
+                          (DAY, day(2013, 2, 1), day(2013, 2, 10, 12))], parts)
+
+    def test_periods_not_built_are_read_daily(self):
+        periods = {MONTH: {day(2010, 1, 1), day(2010, 3, 1)}}
+
+        parts = plan(day(2010, 1, 1), day(2010, 4, 1) - 1, periods)
+
+        self.assertEqual([(MONTH, day(2010, 1, 1), day(2010, 2, 1) - 1),
+                          (DAY, day(2010, 2, 1), day(2010, 3, 1) - 1),
+                          (MONTH, day(2010, 3, 1), day(2010, 4, 1) - 1)], parts)
+
+    def test_partial_period_is_read_daily(self):
+        periods = {MONTH: {day(2010, 1, 1)}}
+
+        self.assertEqual([(DAY, day(2010, 1, 1), day(2010, 1, 31))], plan(day(2010, 1, 1), day(2010, 1, 31), periods))
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        self.tiles = [daily_tile(day(2010, 1, 1), [[1.0, np.nan], [2.0, 3.0]]),
+                      daily_tile(day(2010, 1, 2), [[3.0, np.nan], [np.nan, 5.0]])]
+        self.rollup = Rollup(MONTH, day(2010, 1, 1), self.tiles[0])
+        for tile in self.tiles:
+            self.rollup.add(tile)
+
+    def test_moments(self):
+        self.assertEqual([[4.0, 0.0], [2.0, 8.0]], self.rollup.sums.tolist())
+        self.assertEqual([[2, 0], [1, 2]], self.rollup.counts.tolist())
+        self.assertEqual([[10.0, 0.0], [4.0, 34.0]], self.rollup.sums_sq.tolist())
+
+    def test_tile_data_round_trip(self):
+        blob = self.rollup.to_tile_data('rollup')
+
+        latitudes, longitudes, times, data, meta_data = decode_lat_lon_time_data_meta(
+            nexusproto.TileData.FromString(blob))
+
+        self.assertEqual([day(2010, 1, 1)], times.tolist())
+        self.assertEqual([[2.0, None], [2.0, 4.0]], data[0].tolist())
+
+        tile = daily_tile(day(2010, 1, 1), np.ma.getdata(data[0]))
+        tile.meta_data = meta_data
+        sums, counts, sums_sq = moments(tile)
+        np.testing.assert_array_equal(self.rollup.sums[np.newaxis], sums)
+        np.testing.assert_array_equal(self.rollup.counts[np.newaxis], counts)
+        np.testing.assert_array_equal(self.rollup.sums_sq[np.newaxis], sums_sq)
+
+    def test_solr_doc(self):
+        doc = self.rollup.to_solr_doc('rollup', 'ds')
+
+        self.assertEqual('month', doc['rollup_s'])
+        self.assertEqual('2010-01-01T00:00:00Z', doc['tile_min_time_dt'])
+        self.assertEqual('2010-01-31T23:59:59Z', doc['tile_max_time_dt'])
+        self.assertEqual((0.5, 1.5, 10.5, 11.5), (doc['tile_min_lat'], doc['tile_max_lat'], doc['tile_min_lon'],
+                                                  doc['tile_max_lon']))
+        self.assertEqual(3, doc['tile_count_i'])
+        self.assertAlmostEqual(14.0 / 5, doc['tile_avg_val_d'])
+
+
+class FakeTileService(object):
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.saved = []
+
+    def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time):
+        return sorted(set(long(tile.times[0]) for tile in self.tiles))
+
+    def get_distinct_bounding_boxes_in_polygon(self, bounding_polygon, ds, start_time, end_time):
+        return [box(10.5, 0.5, 11.5, 1.5)]
+
+    def find_tiles_by_exact_bounds(self, bounds, ds, start_time, end_time, **kwargs):
+        return [tile for tile in self.tiles if start_time <= tile.times[0] <= end_time]
+
+    def fetch_data_for_tiles(self, *tiles, **kwargs):
+        return tiles
+
+    def save_tiles(self, blobs_by_id, solr_docs, commit=False):
+        self.saved.append((blobs_by_id, solr_docs, commit))
+
+
+class TestBuildRollups(unittest.TestCase):
+    def test_only_complete_periods_are_built(self):
+        tiles = [daily_tile(t, [[1.0, 2.0], [3.0, np.nan]])
+                 for t in xrange(day(2010, 12, 1), day(2012, 2, 10), 86400)]
+        tile_service = FakeTileService(tiles)
+
+        written = build_rollups(tile_service, 'ds', day(2010, 12, 15), day(2012, 2, 10))
+
+        # January 2011 to January 2012 and the year 2011
+        self.assertEqual(13 + 1, written)
+        blobs_by_id, solr_docs, commit = tile_service.saved[-1]
+        self.assertTrue(commit)
+        docs = dict(((doc['rollup_s'], doc['tile_min_time_dt']), doc) for doc in solr_docs)
+        self.assertEqual(3, docs[(YEAR, '2011-01-01T00:00:00Z')]['tile_count_i'])
+        self.assertEqual(2.0, docs[(YEAR, '2011-01-01T00:00:00Z')]['tile_avg_val_d'])
+        self.assertNotIn((MONTH, '2010-12-01T00:00:00Z'), docs)
+        self.assertIn((MONTH, '2012-01-01T00:00:00Z'), docs)
+        self.assertNotIn((MONTH, '2012-02-01T00:00:00Z'), docs)
+        self.assertEqual(14, len(set(blobs_by_id)))
+
+
+class FakeMetadataStore(object):
+    def __init__(self, periods):
+        self.periods = periods
+        self.calls = 0
+
+    def find_rollup_periods(self, ds):
+        self.calls += 1
+        return self.periods
+
+
+class TestPlanRollups(unittest.TestCase):
+    def test_rollup_periods_are_remembered(self):
+        service = NexusTileService(skipDatastore=True, skipMetadatastore=True)
+        service._metadatastore = FakeMetadataStore({YEAR: {day(2011, 1, 1)}})
+
+        self.assertEqual([(YEAR, day(2011, 1, 1), day(2012, 1, 1) - 1)],
+                         service.plan_rollups('ds', day(2011, 1, 1), day(2012, 1, 1) - 1))
+        service.plan_rollups('ds', day(2010, 1, 1), day(2012, 1, 1) - 1)
+        self.assertEqual(1, service._metadatastore.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ConfigParser
+import unittest
+import uuid
+from StringIO import StringIO
+
+import nexustiles.dao.DynamoProxy as DynamoProxy
+import nexustiles.dao.S3Proxy as S3Proxy
+
+
+class FakeS3Client(object):
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {'Body': StringIO(self.objects[Key])}
+
+
+class FakeDynamoClient(object):
+    def __init__(self, table, items, unprocessed_first_call=0):
+        self.table = table
+        self.items = items
+        self.unprocessed_first_call = unprocessed_first_call
+        self.calls = []
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.table]['Keys']
+        assert len(keys) <= DynamoProxy.BATCH_GET_MAX_KEYS
+        self.calls.append(len(keys))
+
+        # Simulate throttling by leaving some keys unprocessed on the first request only
+        skip = self.unprocessed_first_call if len(self.calls) == 1 else 0
+        processed, unprocessed = keys[skip:], keys[:skip]
+        response = {
+            'Responses': {
+                self.table: [{'tile_id': key['tile_id'], 'data': {'B': self.items[key['tile_id']['S']]}}
+                             for key in processed]
+            }
+        }
+        if len(unprocessed) > 0:
+            response['UnprocessedKeys'] = {self.table: {'Keys': unprocessed}}
+        return response
+
+
+def _config():
+    cp = ConfigParser.RawConfigParser()
+    cp.readfp(StringIO("""[s3]
+bucket=test-bucket
+region=us-west-2
+fetch_workers=4
+
+[dynamo]
+table=test-table
+region=us-west-2
+fetch_workers=4
+max_retries=3"""))
+    return cp
+
+
+class TestS3Proxy(unittest.TestCase):
+    def setUp(self):
+        self.tile_ids = [str(uuid.uuid4()) for _ in range(10)]
+        self.client = FakeS3Client({tile_id: "blob-%s" % tile_id for tile_id in self.tile_ids})
+        self._client = S3Proxy.boto3.client
+        S3Proxy.boto3.client = lambda *args, **kwargs: self.client
+
+    def tearDown(self):
+        S3Proxy.boto3.client = self._client
+
+    def test_fetch_preserves_order(self):
+        proxy = S3Proxy.S3Proxy(_config())
+
+        tiles = proxy.fetch_nexus_tiles(*self.tile_ids)
+
+        self.assertEqual(self.tile_ids, [tile.tile_id for tile in tiles])
+
+
+class TestDynamoProxy(unittest.TestCase):
+    def setUp(self):
+        self.tile_ids = [str(uuid.uuid4()) for _ in range(250)]
+        self.items = {tile_id: "blob-%s" % tile_id for tile_id in self.tile_ids}
+        self._client = DynamoProxy.boto3.client
+        self._sleep = DynamoProxy.time.sleep
+        DynamoProxy.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        DynamoProxy.boto3.client = self._client
+        DynamoProxy.time.sleep = self._sleep
+
+    def test_fetch_batches_of_100(self):
+        client = FakeDynamoClient('test-table', self.items)
+        DynamoProxy.boto3.client = lambda *args, **kwargs: client
+        proxy = DynamoProxy.DynamoProxy(_config())
+
+        tiles = proxy.fetch_nexus_tiles(*self.tile_ids)
+
+        self.assertItemsEqual(self.tile_ids, [tile.tile_id for tile in tiles])
+        self.assertItemsEqual([100, 100, 50], client.calls)
+
+    def test_fetch_retries_unprocessed_keys(self):
+        client = FakeDynamoClient('test-table', self.items, unprocessed_first_call=40)
+        DynamoProxy.boto3.client = lambda *args, **kwargs: client
+        proxy = DynamoProxy.DynamoProxy(_config())
+
+        tiles = proxy.fetch_nexus_tiles(*self.tile_ids[:100])
+
+        self.assertItemsEqual(self.tile_ids[:100], [tile.tile_id for tile in tiles])
+        self.assertEqual([100, 40], client.calls)
@@ -0,0 +1,132 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Concurrency benchmark for SolrProxy. Runs N parallel find_days_in_range_asc calls against a local fake Solr that
+answers every query after a fixed latency, once with every search serialized on a single lock (the previous
+SOLR_CON_LOCK behaviour) and once over the pooled session.
+
+Usage: python tests/solrproxy_benchmark.py [parallel_calls] [latency_ms]
+"""
+
+import ConfigParser
+import json
+import sys
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from multiprocessing.pool import ThreadPool
+
+from nexustiles.dao.SolrProxy import SolrProxy
+
+FACET_RESPONSE = json.dumps({
+    'responseHeader': {'status': 0},
+    'response': {'numFound': 2, 'start': 0, 'docs': []},
+    'facet_counts': {
+        'facet_fields': {'tile_min_time_dt': ['2016-01-01T00:00:00Z', 10, '2016-01-02T00:00:00Z', 10]}
+    }
+})
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(latency):
+    class FakeSolrHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(FACET_RESPONSE)))
+            self.end_headers()
+            self.wfile.write(FACET_RESPONSE)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeSolrHandler
+
+
+def make_proxy(port, pool_size):
+    config = ConfigParser.RawConfigParser()
+    config.add_section("solr")
+    config.set("solr", "host", "127.0.0.1:%d" % port)
+    config.set("solr", "core", "nexustiles")
+    config.set("solr", "pool_size", str(pool_size))
+    return SolrProxy(config)
+
+
+def serialize_searches(proxy):
+    lock = threading.Lock()
+    search = proxy.solrcon.search
+
+    def locked_search(*args, **kwargs):
+        with lock:
+            return search(*args, **kwargs)
+
+    proxy.solrcon.search = locked_search
+    return proxy
+
+
+def run(proxy, calls):
+    def query(i):
+        return proxy.find_days_in_range_asc(-10, 10, -10, 10, "ds_%d" % (i % 4), 0, 86400 * 365)
+
+    pool = ThreadPool(calls)
+    try:
+        # Warm up the connection pool before timing
+        pool.map(query, range(calls))
+        start = time.time()
+        results = pool.map(query, range(calls))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+
+    assert all(len(days) == 2 for days in results)
+    return elapsed
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000.0
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(latency))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    port = server.server_address[1]
+
+    locked_proxy = serialize_searches(make_proxy(port, calls))
+    pooled_proxy = make_proxy(port, calls)
+    try:
+        locked = run(locked_proxy, calls)
+        pooled = run(pooled_proxy, calls)
+    finally:
+        # Drop the keep-alive connections so the server threads can exit
+        pooled_proxy.solrcon.get_session().close()
+        server.shutdown()
+        server.server_close()
+
+    print "%d parallel find_days_in_range_asc calls, %.0f ms Solr latency" % (calls, latency * 1000)
+    print "%-20s %10.1f ms" % ("global lock", locked * 1000)
+    print "%-20s %10.1f ms" % ("pooled session", pooled * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import unittest
 import ConfigParser
 
@@ -20,7 +21,10 @@ import logging
 import pkg_resources
 import time
 
-from nexustiles.dao.SolrProxy import SolrProxy
+import numpy as np
+import pysolr
+
+from nexustiles.dao.SolrProxy import SolrProxy, get_solr_session
 from shapely.geometry import box
 
 
@@ -89,3 +93,303 @@ class TestQuery(unittest.TestCase):
 
     def test_find_days_in_range_asc(self):
         print(self.proxy.find_days_in_range_asc(-90, 90, -180, 180, 'AVHRR_OI_L4_GHRSST_NCEI', 1, time.time()))
+
+
+class FakeResults(object):
+    def __init__(self, docs, hits, next_cursor_mark=None):
+        self.docs = docs
+        self.hits = hits
+        self.nextCursorMark = next_cursor_mark
+
+
+class FakeSolr(object):
+    """
+    Serves num_docs docs page by page, either by cursorMark or by start offset, and records every request made.
+    """
+
+    def __init__(self, num_docs):
+        self.all_docs = [{'id': 'tile-%03d' % i} for i in xrange(num_docs)]
+        self.requests = []
+
+    def search(self, q, **params):
+        self.requests.append(dict(params))
+        rows = params.get('rows', 10)
+        if 'cursorMark' in params:
+            start = 0 if params['cursorMark'] == '*' else int(params['cursorMark'])
+            docs = self.all_docs[start:start + rows]
+            return FakeResults(docs, len(self.all_docs), str(start + len(docs)) if docs else params['cursorMark'])
+        start = params.get('start', 0)
+        return FakeResults(self.all_docs[start:start + rows], len(self.all_docs))
+
+
+class TestPaging(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+
+        self.proxy = SolrProxy(config)
+        self.proxy.solrcon = FakeSolr(25)
+
+    def test_cursor_paging_returns_all_docs(self):
+        results = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10)
+
+        self.assertEqual(self.proxy.solrcon.all_docs, results)
+        self.assertTrue(all('start' not in request for request in self.proxy.solrcon.requests))
+        self.assertEqual('*', self.proxy.solrcon.requests[0]['cursorMark'])
+
+    def test_cursor_paging_adds_unique_key_tie_breaker(self):
+        self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10, sort=['tile_min_time_dt asc'])
+        self.assertEqual('tile_min_time_dt asc, solr_id_s asc', self.proxy.solrcon.requests[0]['sort'])
+
+        self.proxy.do_query_all(*('*:*', None, None, False, 'solr_id_s desc'), rows=10)
+        self.assertEqual('solr_id_s desc', self.proxy.solrcon.requests[-1]['sort'])
+
+    def test_cursor_paging_respects_limit(self):
+        results = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10, limit=12)
+
+        self.assertEqual(self.proxy.solrcon.all_docs[:12], results)
+        self.assertEqual(2, len(self.proxy.solrcon.requests))
+
+    def test_result_shorter_than_a_page_takes_one_query(self):
+        results = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=50)
+
+        self.assertEqual(self.proxy.solrcon.all_docs, results)
+        self.assertEqual(1, len(self.proxy.solrcon.requests))
+
+    def test_last_full_page_is_not_followed_by_an_empty_one(self):
+        self.proxy.solrcon = FakeSolr(20)
+
+        results = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10)
+
+        self.assertEqual(self.proxy.solrcon.all_docs, results)
+        self.assertEqual(2, len(self.proxy.solrcon.requests))
+
+    def test_stream_yields_pages(self):
+        pages = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10, stream=True)
+
+        self.assertEqual([], self.proxy.solrcon.requests)
+        self.assertEqual([10, 10, 5], [len(page) for page in pages])
+
+    def test_explicit_start_uses_offset_paging(self):
+        results = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=10, start=0)
+
+        self.assertEqual(self.proxy.solrcon.all_docs, results)
+        self.assertTrue(all('cursorMark' not in request for request in self.proxy.solrcon.requests))
+
+
+class TestSolrSession(unittest.TestCase):
+    def test_session_is_shared_and_sized(self):
+        session = get_solr_session('http://localhost:8983/solr/test_core', 7)
+
+        self.assertIs(session, get_solr_session('http://localhost:8983/solr/test_core', 7))
+        adapter = session.get_adapter('http://localhost:8983/solr/test_core')
+        self.assertEqual(7, adapter._pool_maxsize)
+        self.assertTrue(adapter._pool_block)
+
+    def test_proxy_uses_configured_pool_and_timeouts(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+        config.set("solr", "pool_size", "3")
+        config.set("solr", "connect_timeout", "2")
+        config.set("solr", "read_timeout", "30")
+
+        proxy = SolrProxy(config)
+
+        self.assertEqual((2.0, 30.0), proxy.solrcon.timeout)
+        self.assertEqual(3, proxy.solrcon.get_session().get_adapter(proxy.solrcon.url)._pool_maxsize)
+
+
+class TestColumnarQuery(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+
+        self.proxy = SolrProxy(config)
+        self.proxy.solrcon = FakeSolr(3)
+        for i, doc in enumerate(self.proxy.solrcon.all_docs):
+            doc['tile_min_lat'] = -10.0 + i
+            doc['tile_count_i'] = 100 + i
+            doc['tile_min_time_dt'] = '2016-01-0%dT00:00:00Z' % (i + 1)
+
+    def test_columns_are_typed_arrays(self):
+        columns = self.proxy.do_query_all(*('*:*', None, None, False, None), rows=2, columnar=True,
+                                          fl=['id,tile_min_lat', 'tile_count_i,tile_min_time_dt'])
+
+        self.assertEqual(['tile-000', 'tile-001', 'tile-002'], columns['id'].tolist())
+        np.testing.assert_array_equal(np.array([-10.0, -9.0, -8.0]), columns['tile_min_lat'])
+        self.assertEqual(np.int64, columns['tile_count_i'].dtype)
+        np.testing.assert_array_equal(np.array([1451606400, 1451692800, 1451779200]), columns['tile_min_time_dt'])
+        self.assertEqual('id,tile_min_lat,tile_count_i,tile_min_time_dt', self.proxy.solrcon.requests[0]['fl'])
+
+    def test_missing_values(self):
+        del self.proxy.solrcon.all_docs[1]['tile_count_i']
+
+        columns = self.proxy.do_query_all(*('*:*', 'tile_count_i,tile_avg_val_d', None, False, None), columnar=True)
+
+        self.assertTrue(np.isnan(columns['tile_count_i'][1]))
+        self.assertTrue(np.isnan(columns['tile_avg_val_d']).all())
+
+    def test_empty_result(self):
+        self.proxy.solrcon.all_docs = []
+
+        columns = self.proxy.do_query_all(*('*:*', 'id,tile_max_lon', None, False, None), columnar=True)
+
+        self.assertEqual(0, len(columns['id']))
+        self.assertEqual(np.float64, columns['tile_max_lon'].dtype)
+
+
+class FakeUpdateSolr(FakeSolr):
+    def __init__(self, num_docs):
+        FakeSolr.__init__(self, num_docs)
+        for doc in self.all_docs:
+            doc['solr_id_s'] = 'ds!%s' % doc['id']
+        self.added = []
+        self.commits = 0
+
+    def add(self, docs, fieldUpdates=None, commit=False):
+        self.added.append((docs, fieldUpdates, commit))
+
+    def commit(self):
+        self.commits += 1
+
+
+class TestUpdateTileAggregates(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+
+        self.proxy = SolrProxy(config)
+        self.proxy.solrcon = FakeUpdateSolr(2)
+
+    def test_atomic_update_by_unique_key(self):
+        self.proxy.update_tile_aggregates({'tile-000': (1.5, 0.5, 3.0, 9.0, 2.0, 4.0, 2),
+                                           'tile-001': (0.0, 0.0, 0.0, 0.0, float('nan'), float('nan'), 0)})
+
+        docs, field_updates, commit = self.proxy.solrcon.added[0]
+        docs = dict((doc['solr_id_s'], doc) for doc in docs)
+        self.assertEqual({'solr_id_s': 'ds!tile-000', 'tile_weighted_sum_d': 1.5, 'tile_weight_sum_d': 0.5,
+                          'tile_sum_d': 3.0, 'tile_sum_sq_d': 9.0, 'tile_min_val_d': 2.0, 'tile_max_val_d': 4.0,
+                          'tile_count_i': 2}, docs['ds!tile-000'])
+        self.assertNotIn('tile_min_val_d', docs['ds!tile-001'])
+        self.assertEqual('set', field_updates['tile_sum_sq_d'])
+        self.assertNotIn('solr_id_s', field_updates)
+        self.assertFalse(commit)
+
+    def test_commit_without_updates(self):
+        self.proxy.update_tile_aggregates({}, commit=True)
+
+        self.assertEqual([], self.proxy.solrcon.added)
+        self.assertEqual(1, self.proxy.solrcon.commits)
+
+
+class TestOverviewLevels(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+
+        self.proxy = SolrProxy(config)
+        self.proxy.solrcon = FakeUpdateSolr(2)
+
+    def test_full_resolution_by_default(self):
+        self.proxy.find_all_tiles_in_box_at_time(-10, 10, -10, 10, 'ds', 0)
+
+        self.assertIn('-level_i:[1 TO *]', self.proxy.solrcon.requests[0]['fq'])
+
+    def test_overview_level(self):
+        self.proxy.find_all_tiles_in_box_at_time(-10, 10, -10, 10, 'ds', 0, level=2)
+
+        fq = self.proxy.solrcon.requests[0]['fq']
+        self.assertIn('level_i:2', fq)
+        self.assertNotIn('-level_i:[1 TO *]', fq)
+
+    def test_tiles_by_id_are_found_at_any_level(self):
+        self.proxy.find_tiles_by_id(['tile-000', 'tile-001'], ds='ds')
+
+        self.assertFalse(any('level_i' in fq for fq in self.proxy.solrcon.requests[0]['fq']))
+        self.assertFalse(any('rollup_s' in fq for fq in self.proxy.solrcon.requests[0]['fq']))
+
+    def test_daily_tiles_by_default(self):
+        self.proxy.find_all_tiles_in_box_sorttimeasc(-10, 10, -10, 10, 'ds', 0, 86400)
+
+        self.assertIn('-rollup_s:[* TO *]', self.proxy.solrcon.requests[0]['fq'])
+
+    def test_rollup(self):
+        self.proxy.find_all_tiles_in_box_sorttimeasc(-10, 10, -10, 10, 'ds', 0, 86400, rollup='month')
+
+        fq = self.proxy.solrcon.requests[0]['fq']
+        self.assertIn('rollup_s:month', fq)
+        self.assertIn('-level_i:[1 TO *]', fq)
+        self.assertNotIn('-rollup_s:[* TO *]', fq)
+
+    def test_add_tiles_fills_unique_key(self):
+        self.proxy.add_tiles([{'id': 'overview', 'dataset_s': 'ds'}])
+
+        docs, field_updates, commit = self.proxy.solrcon.added[0]
+        self.assertEqual('ds!overview', docs[0]['solr_id_s'])
+        self.assertIsNone(field_updates)
+
+
+class FakeStreamResponse(object):
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in xrange(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStreamSession(object):
+    def __init__(self, body, chunk_size=7):
+        self.response = FakeStreamResponse(body, chunk_size)
+        self.requests = []
+
+    def post(self, url, data=None, **kwargs):
+        self.requests.append((url, data))
+        return self.response
+
+
+class TestExportTileIds(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
+
+        self.proxy = SolrProxy(config)
+
+    def export(self, body, **kwargs):
+        self.proxy.solrcon.session = FakeStreamSession(body)
+        return list(self.proxy.export_tile_ids(box(-10, -10, 10, 10), "test_ds", 100, 200, **kwargs))
+
+    def test_ids_are_streamed_across_chunks(self):
+        ids = ['tile-%d' % i for i in xrange(20)]
+        body = json.dumps({'result-set': {'docs': [{'id': tile_id} for tile_id in ids] + [{'EOF': True}]}})
+
+        self.assertEqual(ids, self.export(body))
+
+        url, data = self.proxy.solrcon.session.requests[0]
+        self.assertTrue(url.endswith('/nexustiles/stream'))
+        self.assertIn('q="dataset_s:test_ds"', data['expr'])
+        self.assertIn('sort="id asc"', data['expr'])
+        self.assertIn('qt="/export"', data['expr'])
+        self.assertIn('Intersects(POLYGON', data['expr'])
+        self.assertTrue(self.proxy.solrcon.session.response.closed)
+
+    def test_sort_is_passed_through(self):
+        self.export(json.dumps({'result-set': {'docs': [{'EOF': True}]}}),
+                    sort=['tile_min_time_dt asc', 'tile_min_lon asc'])
+
+        self.assertIn('sort="tile_min_time_dt asc, tile_min_lon asc"',
+                      self.proxy.solrcon.session.requests[0][1]['expr'])
+
+    def test_exception_is_raised(self):
+        body = json.dumps({'result-set': {'docs': [{'EXCEPTION': 'sort field has no docValues', 'EOF': True}]}})
+
+        with self.assertRaises(pysolr.SolrError):
+            self.export(body)
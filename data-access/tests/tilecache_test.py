@@ -0,0 +1,256 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+import unittest
+
+import nexusproto.DataTile_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import to_shaped_array
+
+from nexustiles.cache.DiskTileCache import DiskTileCache
+from nexustiles.cache.MemoryTileCache import MemoryTileCache, entry_nbytes
+from nexustiles.dao.TileDecoder import decode_lat_lon_time_data_meta
+from nexustiles.model.nexusmodel import Tile
+from nexustiles.nexustiles import NexusTileService
+
+
+def _entry(n=10, fill=1.0):
+    lats = np.ma.masked_invalid(np.linspace(0, 1, n))
+    lons = np.ma.masked_invalid(np.linspace(0, 1, n))
+    times = np.array([0])
+    data = np.ma.masked_invalid(np.full((1, n, n), fill))
+    meta = {'wind_u': np.ma.masked_invalid(np.full((1, n, n), fill))}
+    return lats, lons, times, data, meta
+
+
+class TestMemoryTileCache(unittest.TestCase):
+    def test_hit_and_miss_counters(self):
+        cache = MemoryTileCache(10 * 1024 * 1024)
+
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', _entry())
+        self.assertIsNotNone(cache.get('a'))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+
+    def test_evicts_least_recently_used(self):
+        nbytes = entry_nbytes(_entry())
+        cache = MemoryTileCache(nbytes * 2)
+
+        cache.put('a', _entry())
+        cache.put('b', _entry())
+        cache.get('a')
+        cache.put('c', _entry())
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(1, cache.stats()['evictions'])
+        self.assertLessEqual(cache.stats()['bytes'], nbytes * 2)
+
+    def test_entry_larger_than_cache_is_not_stored(self):
+        cache = MemoryTileCache(1)
+
+        cache.put('a', _entry())
+
+        self.assertEqual(0, len(cache))
+
+    def test_modifying_returned_arrays_does_not_change_cache(self):
+        cache = MemoryTileCache(10 * 1024 * 1024)
+        entry = _entry()
+        cache.put('a', entry)
+
+        entry[3].data[:] = 5.0
+        first = cache.get('a')
+        first[3].data[:] = 7.0
+        first[4]['wind_u'][:] = 7.0
+
+        second = cache.get('a')
+        np.testing.assert_array_equal(np.ones((1, 10, 10)), second[3])
+        np.testing.assert_array_equal(np.ones((1, 10, 10)), second[4]['wind_u'])
+
+
+class TestDiskTileCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_round_trip(self):
+        cache = DiskTileCache(self.path, 10 * 1024 * 1024)
+        lats, lons, times, data, meta = _entry()
+        data[0, 0, 0] = np.ma.masked
+
+        cache.put('a', (lats, lons, times, data, meta))
+        c_lats, c_lons, c_times, c_data, c_meta = cache.get('a')
+
+        np.testing.assert_array_equal(lats, c_lats)
+        np.testing.assert_array_equal(times, c_times)
+        np.testing.assert_array_equal(np.ma.getmaskarray(data), np.ma.getmaskarray(c_data))
+        np.testing.assert_array_equal(meta['wind_u'], c_meta['wind_u'])
+        self.assertEqual(1, cache.stats()['hits'])
+
+    def test_modifying_returned_arrays_does_not_change_cache(self):
+        cache = DiskTileCache(self.path, 10 * 1024 * 1024)
+        cache.put('a', _entry())
+
+        cache.get('a')[3].data[:] = 7.0
+
+        np.testing.assert_array_equal(np.ones((1, 10, 10)), cache.get('a')[3])
+
+    def test_evicts_least_recently_used(self):
+        cache = DiskTileCache(self.path, 10 * 1024 * 1024)
+        cache.put('a', _entry())
+        nbytes = cache.stats()['bytes']
+        cache.max_bytes = nbytes * 2
+
+        cache.put('b', _entry())
+        cache.get('a')
+        cache.put('c', _entry())
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_reopen_existing_directory(self):
+        DiskTileCache(self.path, 10 * 1024 * 1024).put('a', _entry())
+
+        cache = DiskTileCache(self.path, 10 * 1024 * 1024)
+
+        self.assertIn('a', cache)
+        self.assertIsNotNone(cache.get('a'))
+
+
+class FakeTileData(object):
+    def __init__(self, tile_id):
+        self.tile_id = tile_id
+
+    def get_lat_lon_time_data_meta(self, sparse=False):
+        tile = nexusproto.TileData()
+        tile.grid_tile.latitude.CopyFrom(to_shaped_array(np.array([0.0, 1.0], dtype=np.float32)))
+        tile.grid_tile.longitude.CopyFrom(to_shaped_array(np.array([10.0, 11.0], dtype=np.float32)))
+        tile.grid_tile.time = 1000
+        tile.grid_tile.variable_data.CopyFrom(to_shaped_array(np.array([[1.0, np.nan], [3.0, 4.0]],
+                                                                       dtype=np.float32)))
+        return decode_lat_lon_time_data_meta(tile)
+
+
+class FakeSwathTileData(object):
+    def __init__(self, tile_id):
+        self.tile_id = tile_id
+
+    def get_lat_lon_time_data_meta(self, sparse=False):
+        tile = nexusproto.TileData()
+        tile.swath_tile.latitude.CopyFrom(to_shaped_array(np.array([[0.0, 1.0], [2.0, 3.0]])))
+        tile.swath_tile.longitude.CopyFrom(to_shaped_array(np.array([[10.0, 11.0], [12.0, 13.0]])))
+        tile.swath_tile.time.CopyFrom(to_shaped_array(np.full((2, 2), 1000, dtype=np.int64)))
+        tile.swath_tile.variable_data.CopyFrom(to_shaped_array(np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32)))
+        return decode_lat_lon_time_data_meta(tile, sparse=sparse)
+
+
+class FakeDatastore(object):
+    def __init__(self, tile_data_class=FakeTileData):
+        self.tile_data_class = tile_data_class
+        self.fetched = []
+
+    def fetch_nexus_tiles(self, *tile_ids):
+        self.fetched.extend(tile_ids)
+        return [self.tile_data_class(tile_id) for tile_id in tile_ids]
+
+
+class FakeMetadataStore(object):
+    def find_all_tiles_in_box_sorttimeasc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time,
+                                          **kwargs):
+        return iter([[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}]])
+
+
+class TestTileServiceCaches(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.service = NexusTileService(skipDatastore=True, skipMetadatastore=True)
+        self.service._datastore = FakeDatastore()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def fetch(self):
+        tile = Tile()
+        tile.tile_id = 'a'
+        self.service.fetch_data_for_tiles(tile)
+        return tile
+
+    def assertWritable(self, tile):
+        for array in (tile.latitudes, tile.longitudes, tile.data):
+            self.assertTrue(np.ma.getdata(array).flags.writeable)
+        tile.data[0, 0, 0] = 5.0
+
+    def test_tile_data_is_writable_without_cache(self):
+        self.assertWritable(self.fetch())
+
+    def test_tile_data_is_writable_on_memory_cache_miss_and_hit(self):
+        self.service._tile_cache = MemoryTileCache(10 * 1024 * 1024)
+
+        self.assertWritable(self.fetch())
+        self.assertWritable(self.fetch())
+
+        self.assertEqual(['a'], self.service._datastore.fetched)
+        self.assertEqual(1, self.service._tile_cache.stats()['hits'])
+
+    def test_tile_data_is_writable_on_disk_cache_miss_and_hit(self):
+        self.service._disk_tile_cache = DiskTileCache(self.path, 10 * 1024 * 1024)
+
+        self.assertWritable(self.fetch())
+        self.assertWritable(self.fetch())
+
+        self.assertEqual(['a'], self.service._datastore.fetched)
+        self.assertEqual(1, self.service._disk_tile_cache.stats()['hits'])
+
+    def test_streaming_without_cache_leaves_memory_cache_empty(self):
+        self.service._metadatastore = FakeMetadataStore()
+        self.service._tile_cache = MemoryTileCache(10 * 1024 * 1024)
+
+        pages = list(self.service.find_tiles_in_box(0, 1, 10, 11, 'ds', 0, 1000, stream=True, use_cache=False))
+
+        self.assertEqual([['a', 'b'], ['c']], [[tile.tile_id for tile in page] for page in pages])
+        self.assertTrue(all(tile.data is not None for page in pages for tile in page))
+        self.assertEqual(0, len(self.service._tile_cache))
+
+        list(self.service.find_tiles_in_box(0, 1, 10, 11, 'ds', 0, 1000, stream=True))
+        self.assertEqual(3, len(self.service._tile_cache))
+
+    def test_sparse_swath_tile_is_masked_without_densifying(self):
+        self.service._datastore = FakeDatastore(FakeSwathTileData)
+        self.service._tile_cache = MemoryTileCache(10 * 1024 * 1024)
+        tile = Tile()
+        tile.tile_id = 'a'
+
+        self.service.fetch_data_for_tiles(tile, sparse=True)
+        tiles = self.service.mask_tiles_to_bbox(0, 1, 10, 11, [tile])
+
+        self.assertEqual([tile], tiles)
+        self.assertEqual(2, tile.sparse_data.count())
+        self.assertEqual([[0, 0, 0], [0, 1, 1]], tile.get_indices())
+        self.assertEqual(0, len(self.service._tile_cache))
+
+        self.assertEqual((1, 4, 4), tile.data.shape)
+        self.assertEqual(np.float64, tile.data.dtype)
+        self.assertEqual(2, np.ma.count(tile.data))
@@ -0,0 +1,123 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of tile decoding. For every tile type it reports the mean decode time and the peak resident memory
+growth of decoding one tile, for the previous implementation (np.load + np.ma.masked_invalid + dense masked_all cubes)
+and for nexustiles.dao.TileDecoder (dense and sparse).
+
+Usage: python tests/tiledecoder_benchmark.py [repeats]
+"""
+
+import multiprocessing
+import resource
+import sys
+import timeit
+
+import nexusproto.DataTile_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import from_shaped_array, to_shaped_array
+
+from nexustiles.dao.TileDecoder import decode_lat_lon_time_data_meta
+
+
+def make_grid_tile(n=300):
+    tile = nexusproto.TileData()
+    tile.grid_tile.latitude.CopyFrom(to_shaped_array(np.linspace(-10, 10, n, dtype=np.float32)))
+    tile.grid_tile.longitude.CopyFrom(to_shaped_array(np.linspace(-10, 10, n, dtype=np.float32)))
+    tile.grid_tile.time = 0
+    tile.grid_tile.variable_data.CopyFrom(to_shaped_array(np.random.rand(1, n, n).astype(np.float32)))
+    return tile
+
+
+def make_swath_tile(rows=40, cols=50):
+    tile = nexusproto.TileData()
+    tile.swath_tile.latitude.CopyFrom(to_shaped_array(np.random.rand(rows, cols).astype(np.float32)))
+    tile.swath_tile.longitude.CopyFrom(to_shaped_array(np.random.rand(rows, cols).astype(np.float32)))
+    tile.swath_tile.time.CopyFrom(to_shaped_array(np.zeros((rows, cols), dtype=np.int64)))
+    tile.swath_tile.variable_data.CopyFrom(to_shaped_array(np.random.rand(rows, cols).astype(np.float32)))
+    return tile
+
+
+def make_time_series_tile(times=365, points=200):
+    tile = nexusproto.TileData()
+    tile.time_series_tile.latitude.CopyFrom(to_shaped_array(np.random.rand(points).astype(np.float32)))
+    tile.time_series_tile.longitude.CopyFrom(to_shaped_array(np.random.rand(points).astype(np.float32)))
+    tile.time_series_tile.time.CopyFrom(to_shaped_array(np.arange(times, dtype=np.int64)))
+    tile.time_series_tile.variable_data.CopyFrom(to_shaped_array(np.random.rand(times, points).astype(np.float32)))
+    return tile
+
+
+def legacy_decode(tile):
+    """The decoding previously copied into CassandraProxy, S3Proxy and DynamoProxy (data variable only)."""
+    if tile.HasField('grid_tile'):
+        return np.ma.masked_invalid(from_shaped_array(tile.grid_tile.variable_data))
+    elif tile.HasField('swath_tile'):
+        lats = np.ma.masked_invalid(from_shaped_array(tile.swath_tile.latitude)).reshape(-1)
+        data = np.ma.masked_invalid(from_shaped_array(tile.swath_tile.variable_data))
+        reshaped = np.ma.masked_all((len(lats), len(lats)))
+        row, col = np.indices(data.shape)
+        reshaped[np.diag_indices(len(lats), 2)] = data[row.flat, col.flat]
+        reshaped.mask[np.diag_indices(len(lats), 2)] = data.mask[row.flat, col.flat]
+        return reshaped[np.newaxis, :]
+    else:
+        times = from_shaped_array(tile.time_series_tile.time).reshape(-1)
+        lats = np.ma.masked_invalid(from_shaped_array(tile.time_series_tile.latitude))
+        data = np.ma.masked_invalid(from_shaped_array(tile.time_series_tile.variable_data))
+        reshaped = np.ma.masked_all((len(times), len(lats), len(lats)))
+        idx = np.arange(len(lats))
+        reshaped[:, idx, idx] = data
+        return reshaped
+
+
+DECODERS = [
+    ('legacy', legacy_decode),
+    ('dense', lambda tile: decode_lat_lon_time_data_meta(tile)),
+    ('sparse', lambda tile: decode_lat_lon_time_data_meta(tile, sparse=True)),
+]
+
+
+def _peak_memory_child(tile_blob, decoder_index, queue):
+    tile = nexusproto.TileData.FromString(tile_blob)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = DECODERS[decoder_index][1](tile)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(after - before)
+    del result
+
+
+def peak_memory_kb(tile, decoder_index):
+    # Each measurement runs in a fresh process so the peaks of earlier decodes do not hide later ones
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_peak_memory_child,
+                                      args=(tile.SerializeToString(), decoder_index, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(repeats=20):
+    print '%-12s %-8s %12s %14s' % ('tile type', 'decoder', 'ms / tile', 'peak RSS (KB)')
+    for tile_type, tile in [('grid', make_grid_tile()), ('swath', make_swath_tile()),
+                            ('time_series', make_time_series_tile())]:
+        for decoder_index, (decoder_name, decoder) in enumerate(DECODERS):
+            seconds = timeit.timeit(lambda: decoder(tile), number=repeats) / repeats
+            print '%-12s %-8s %12.3f %14d' % (tile_type, decoder_name, seconds * 1000,
+                                              peak_memory_kb(tile, decoder_index))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
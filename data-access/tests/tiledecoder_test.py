@@ -0,0 +1,139 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import nexusproto.DataTile_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import to_shaped_array, to_metadata
+
+from nexustiles.dao.TileDecoder import decode_lat_lon_time_data_meta, from_shaped_array, SparseTileArray
+
+
+def grid_tile():
+    tile = nexusproto.TileData()
+    data = np.arange(12, dtype=np.float32).reshape((3, 4))
+    data[1, 2] = np.nan
+    tile.grid_tile.latitude.CopyFrom(to_shaped_array(np.array([0.0, 1.0, 2.0], dtype=np.float32)))
+    tile.grid_tile.longitude.CopyFrom(to_shaped_array(np.array([10.0, 11.0, 12.0, 13.0], dtype=np.float32)))
+    tile.grid_tile.time = 1000
+    tile.grid_tile.variable_data.CopyFrom(to_shaped_array(data))
+    tile.grid_tile.meta_data.add().CopyFrom(to_metadata('wind_dir', data * 2))
+    return tile, data
+
+
+def swath_tile(times):
+    tile = nexusproto.TileData()
+    data = np.arange(6, dtype=np.float32).reshape((2, 3))
+    data[0, 1] = np.nan
+    tile.swath_tile.latitude.CopyFrom(to_shaped_array(np.linspace(0, 5, 6).reshape((2, 3))))
+    tile.swath_tile.longitude.CopyFrom(to_shaped_array(np.linspace(10, 15, 6).reshape((2, 3))))
+    tile.swath_tile.time.CopyFrom(to_shaped_array(np.array(times, dtype=np.int64).reshape((2, 3))))
+    tile.swath_tile.variable_data.CopyFrom(to_shaped_array(data))
+    tile.swath_tile.meta_data.add().CopyFrom(to_metadata('wind_dir', data * 2))
+    return tile, data
+
+
+def time_series_tile():
+    tile = nexusproto.TileData()
+    data = np.arange(8, dtype=np.float32).reshape((2, 4))
+    data[1, 3] = np.nan
+    tile.time_series_tile.latitude.CopyFrom(to_shaped_array(np.array([0.0, 1.0, 2.0, 3.0])))
+    tile.time_series_tile.longitude.CopyFrom(to_shaped_array(np.array([10.0, 11.0, 12.0, 13.0])))
+    tile.time_series_tile.time.CopyFrom(to_shaped_array(np.array([100, 200], dtype=np.int64)))
+    tile.time_series_tile.variable_data.CopyFrom(to_shaped_array(data))
+    return tile, data
+
+
+class TestFromShapedArray(unittest.TestCase):
+    def test_matches_numpy_load(self):
+        for array in [np.arange(12, dtype=np.float32).reshape((3, 4)),
+                      np.asfortranarray(np.arange(12, dtype='>f8').reshape((3, 4))),
+                      np.array(5, dtype=np.int64)]:
+            result = from_shaped_array(to_shaped_array(array))
+
+            self.assertEqual(array.dtype, result.dtype)
+            np.testing.assert_array_equal(array, result)
+
+
+class TestDecodeGridTile(unittest.TestCase):
+    def test_grid_tile(self):
+        tile, data = grid_tile()
+
+        lats, lons, times, tile_data, meta = decode_lat_lon_time_data_meta(tile)
+
+        np.testing.assert_array_equal([0.0, 1.0, 2.0], lats)
+        np.testing.assert_array_equal([10.0, 11.0, 12.0, 13.0], lons)
+        np.testing.assert_array_equal([1000], times)
+        self.assertEqual((1, 3, 4), tile_data.shape)
+        self.assertTrue(tile_data.mask[0, 1, 2])
+        self.assertEqual(1, np.count_nonzero(tile_data.mask))
+        self.assertFalse(meta.is_decoded('wind_dir'))
+        np.testing.assert_array_equal(np.ma.masked_invalid(data * 2)[np.newaxis, :], meta['wind_dir'])
+        self.assertTrue(meta.is_decoded('wind_dir'))
+
+
+class TestDecodeSwathTile(unittest.TestCase):
+    def test_single_time_swath_tile(self):
+        tile, data = swath_tile([5] * 6)
+
+        lats, lons, times, tile_data, meta = decode_lat_lon_time_data_meta(tile)
+
+        self.assertEqual((6,), lats.shape)
+        np.testing.assert_array_equal([5], times)
+        self.assertEqual((1, 6, 6), tile_data.shape)
+        np.testing.assert_array_equal(np.ma.masked_invalid(data.reshape(-1)), np.diagonal(tile_data[0]))
+        self.assertEqual(5, np.ma.count(tile_data))
+        self.assertEqual(5, np.ma.count(meta['wind_dir']))
+
+    def test_multi_time_swath_tile(self):
+        tile, data = swath_tile(range(6))
+
+        lats, lons, times, tile_data, meta = decode_lat_lon_time_data_meta(tile)
+
+        self.assertEqual((6, 6, 6), tile_data.shape)
+        for i in range(6):
+            if i == 1:
+                self.assertIs(np.ma.masked, tile_data[i, i, i])
+            else:
+                self.assertEqual(data.reshape(-1)[i], tile_data[i, i, i])
+        self.assertEqual(5, np.ma.count(tile_data))
+
+    def test_sparse_swath_tile(self):
+        tile, data = swath_tile([5] * 6)
+
+        dense = decode_lat_lon_time_data_meta(tile)[3]
+        sparse = decode_lat_lon_time_data_meta(tile, sparse=True)[3]
+
+        self.assertIsInstance(sparse, SparseTileArray)
+        self.assertEqual(dense.shape, sparse.shape)
+        self.assertEqual(np.float64, dense.dtype)
+        self.assertEqual(np.float32, sparse.dtype)
+        self.assertLess(sparse.nbytes, dense.nbytes + dense.mask.nbytes)
+        np.testing.assert_array_equal(np.ma.getmaskarray(dense), np.ma.getmaskarray(sparse.todense()))
+        np.testing.assert_array_equal(dense.compressed(), sparse.todense().compressed())
+
+
+class TestDecodeTimeSeriesTile(unittest.TestCase):
+    def test_time_series_tile(self):
+        tile, data = time_series_tile()
+
+        lats, lons, times, tile_data, meta = decode_lat_lon_time_data_meta(tile)
+
+        np.testing.assert_array_equal([100, 200], times)
+        self.assertEqual((2, 4, 4), tile_data.shape)
+        idx = np.arange(4)
+        np.testing.assert_array_equal(np.ma.masked_invalid(data), tile_data[:, idx, idx])
+        self.assertEqual(7, np.ma.count(tile_data))
@@ -0,0 +1,106 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compute the partial statistics (TileAggregates) of existing tiles and store them with the tile metadata in Solr, so
+that analyses such as /timeSeriesSpark can summarize tiles completely inside their area without fetching the tile
+data. Requires the nexustiles package (data-access) configured for the target Solr and data store.
+
+    python backfillaggregates.py -ds AVHRR_OI_L4_GHRSST_NCEI --startTime 2015-01-01T00:00:00Z
+"""
+
+import argparse
+import logging
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from nexustiles.nexustiles import get_tile_service
+
+logging.basicConfig()
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().handlers[0].setFormatter(
+    logging.Formatter(fmt="%(asctime)s %(levelname)s:%(name)s:  %(message)s", datefmt="%Y-%m-%dT%H:%M:%S"))
+
+SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_seconds(iso_time):
+    return int((datetime.strptime(iso_time, SOLR_FORMAT) - EPOCH).total_seconds())
+
+
+def backfill(args):
+    tile_service = get_tile_service()
+
+    start_time = to_seconds(args.startTime) if args.startTime else 0
+    end_time = to_seconds(args.endTime) if args.endTime else -1
+
+    def update_page(tiles):
+        tile_service.fetch_data_for_tiles(*tiles, variables=[], use_cache=False)
+        tile_service.update_tile_aggregates(tiles, ds=args.dataset)
+        return len(tiles)
+
+    pages = tile_service.find_tiles_in_box(-90, 90, -180, 180, args.dataset, start_time, end_time,
+                                           fetch_data=False, stream=True, rows=args.batchSize, fl='id')
+
+    pool = ThreadPool(args.workers)
+    try:
+        updated = 0
+        for count in pool.imap_unordered(update_page, (page for page in pages if page)):
+            updated += count
+            logging.info("Updated %s tiles" % updated)
+    finally:
+        pool.close()
+
+    logging.info("Committing")
+    tile_service.update_tile_aggregates([], commit=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Store the partial statistics of NEXUS tiles in Solr',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-ds', '--dataset',
+                        help='The dataset whose tiles are updated.',
+                        required=True,
+                        metavar='AVHRR_OI_L4_GHRSST_NCEI')
+
+    parser.add_argument('--startTime',
+                        help='Only update tiles from this time on.',
+                        required=False,
+                        metavar='2015-01-01T00:00:00Z')
+
+    parser.add_argument('--endTime',
+                        help='Only update tiles up to this time.',
+                        required=False,
+                        metavar='2015-12-31T23:59:59Z')
+
+    parser.add_argument('--batchSize',
+                        help='Number of tiles fetched and updated at once.',
+                        required=False,
+                        type=int,
+                        default=500)
+
+    parser.add_argument('--workers',
+                        help='Number of batches processed concurrently.',
+                        required=False,
+                        type=int,
+                        default=4)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    backfill(parse_args())
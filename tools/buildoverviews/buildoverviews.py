@@ -0,0 +1,96 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Build the overview levels of a gridded dataset: level k holds tiles of 2^k x 2^k full resolution cells, storing the
+mean as tile data and the sum and count of every cell as meta data. Overview tiles are indexed in Solr with level_i
+so that NexusTileService can read the coarsest level matching the resolution an analysis asks for. Requires the
+nexustiles package (data-access) configured for the target Solr and data store.
+
+    python buildoverviews.py -ds AVHRR_OI_L4_GHRSST_NCEI --levels 3 --startTime 2015-01-01T00:00:00Z
+"""
+
+import argparse
+import logging
+from datetime import datetime
+
+from nexustiles import pyramid
+from nexustiles.nexustiles import get_tile_service
+
+logging.basicConfig()
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().handlers[0].setFormatter(
+    logging.Formatter(fmt="%(asctime)s %(levelname)s:%(name)s:  %(message)s", datefmt="%Y-%m-%dT%H:%M:%S"))
+
+SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_seconds(iso_time):
+    return int((datetime.strptime(iso_time, SOLR_FORMAT) - EPOCH).total_seconds())
+
+
+def build(args):
+    start_time = to_seconds(args.startTime) if args.startTime else 0
+    end_time = to_seconds(args.endTime) if args.endTime else -1
+
+    written = pyramid.build_overviews(get_tile_service(), args.dataset, args.levels, start_time, end_time,
+                                      tile_size=args.tileSize, rows=args.batchSize)
+
+    logging.info("Wrote %s overview tiles" % written)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the overview levels of a gridded NEXUS dataset',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-ds', '--dataset',
+                        help='The dataset whose overviews are built.',
+                        required=True,
+                        metavar='AVHRR_OI_L4_GHRSST_NCEI')
+
+    parser.add_argument('--levels',
+                        help='Number of overview levels, level k aggregating 2^k x 2^k cells.',
+                        required=False,
+                        type=int,
+                        default=3)
+
+    parser.add_argument('--startTime',
+                        help='Only build overviews from this time on.',
+                        required=False,
+                        metavar='2015-01-01T00:00:00Z')
+
+    parser.add_argument('--endTime',
+                        help='Only build overviews up to this time.',
+                        required=False,
+                        metavar='2015-12-31T23:59:59Z')
+
+    parser.add_argument('--tileSize',
+                        help='Number of cells along each side of an overview tile.',
+                        required=False,
+                        type=int,
+                        default=pyramid.DEFAULT_TILE_SIZE)
+
+    parser.add_argument('--batchSize',
+                        help='Number of full resolution tiles fetched at once.',
+                        required=False,
+                        type=int,
+                        default=500)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    build(parse_args())
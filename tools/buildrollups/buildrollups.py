@@ -0,0 +1,84 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Build the monthly and yearly rollups of a gridded dataset: for every tile footprint and calendar month or year, the sum,
+count and sum of squares of the daily values of each cell. Rollup tiles are indexed in Solr with rollup_s so that the
+time average, variance and climatology analyses read one tile per full period instead of every daily tile. Only periods
+lying entirely in the time range are built. Run it again for periods whose daily tiles change. Requires the nexustiles
+package (data-access) configured for the target Solr and data store.
+
+    python buildrollups.py -ds AVHRR_OI_L4_GHRSST_NCEI --startTime 2000-01-01T00:00:00Z --endTime 2019-12-31T23:59:59Z
+"""
+
+import argparse
+import logging
+from datetime import datetime
+
+from nexustiles import rollup
+from nexustiles.nexustiles import get_tile_service
+
+logging.basicConfig()
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().handlers[0].setFormatter(
+    logging.Formatter(fmt="%(asctime)s %(levelname)s:%(name)s:  %(message)s", datefmt="%Y-%m-%dT%H:%M:%S"))
+
+SOLR_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_seconds(iso_time):
+    return int((datetime.strptime(iso_time, SOLR_FORMAT) - EPOCH).total_seconds())
+
+
+def build(args):
+    start_time = to_seconds(args.startTime) if args.startTime else 0
+    end_time = to_seconds(args.endTime) if args.endTime else -1
+
+    written = rollup.build_rollups(get_tile_service(), args.dataset, start_time, end_time, rows=args.batchSize)
+
+    logging.info("Wrote %s rollup tiles" % written)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the monthly and yearly rollups of a gridded NEXUS dataset',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-ds', '--dataset',
+                        help='The dataset whose rollups are built.',
+                        required=True,
+                        metavar='AVHRR_OI_L4_GHRSST_NCEI')
+
+    parser.add_argument('--startTime',
+                        help='Only build rollups of the periods starting from this time on.',
+                        required=False,
+                        metavar='2015-01-01T00:00:00Z')
+
+    parser.add_argument('--endTime',
+                        help='Only build rollups of the periods ending up to this time (default now).',
+                        required=False,
+                        metavar='2015-12-31T23:59:59Z')
+
+    parser.add_argument('--batchSize',
+                        help='Number of daily tiles fetched, and of rollup tiles written, at once.',
+                        required=False,
+                        type=int,
+                        default=500)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    build(parse_args())